@@ -23,6 +23,9 @@ setup(name='summarize2',
           "jinja2",
           "bokeh==2.1.0"
       ],
+      extras_require={
+          "arrow": ["pyarrow"]
+      },
       packages=find_packages(),
       entry_points={
           'console_scripts': [
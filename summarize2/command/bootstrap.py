@@ -11,11 +11,12 @@ import os
 import io
 
 # Summarize2 imports
-from ..core.jinja_app import generate_report
-from ..core.summary_stats import generate_common_columns
-from ..core.helper_funcs import (
-    read_data, path_checker, open_report_in_default_browser,
-    launch_temp_file, convert_dtypes)
+from ..core.options import (
+    EXPORT_FORMATS, MAX_DIFF_CATEGORIES, path_checker, filter_checker, positive_int,
+    fraction)
+
+#Number of rows used to guess data types when not reading full datasets
+DTYPE_SAMPLE_ROWS = 1000
 
 def main(**kwargs):
     '''
@@ -52,7 +53,10 @@ def main(**kwargs):
         "--ridge", "-r",
         default=False,
         action="store_true",
-        help="not implemented yet",
+        help=textwrap.dedent('''\
+        add a ridge plot of the slices of chosen columns with the
+        most different distributions of a numerical column
+        '''),
         )
 
     parser.add_argument(
@@ -72,6 +76,117 @@ def main(**kwargs):
         "--output", "-o",
         help="file path where to save the report, including .html",
         )
+
+    parser.add_argument(
+        "--chunksize", "-c",
+        type=positive_int,
+        default=None,
+        help=textwrap.dedent('''\
+        read datasets in chunks of N rows to limit peak memory;
+        quartiles and plots are based on a row sample
+        '''),
+        )
+
+    parser.add_argument(
+        "--approx", "-a",
+        default=False,
+        action="store_true",
+        help=textwrap.dedent('''\
+        estimate quartiles and unique counts using mergeable
+        sketches; estimates are shown with their error bounds
+        '''),
+        )
+
+    parser.add_argument(
+        "--projected", "-p",
+        default=False,
+        action="store_true",
+        help=textwrap.dedent('''\
+        read headers first and load only the common columns,
+        with categorical columns read as categories
+        '''),
+        )
+
+    parser.add_argument(
+        "--no-cache",
+        default=False,
+        action="store_true",
+        help=textwrap.dedent('''\
+        always parse the datasets and compile the report template
+        instead of loading them from (and saving them to) the on-disk cache
+        '''),
+        )
+
+    parser.add_argument(
+        "--workers", "-w",
+        type=positive_int,
+        default=1,
+        help=textwrap.dedent('''\
+        number of processes used to generate the column plots and
+        to search for the ridge plot slices
+        '''),
+        )
+
+    parser.add_argument(
+        "--max-categories",
+        type=positive_int,
+        default=MAX_DIFF_CATEGORIES,
+        help=textwrap.dedent('''\
+        most bars in a frequency difference plot; columns with
+        more values show the most different ones and "Other"
+        '''),
+        )
+
+    parser.add_argument(
+        "--format",
+        default="html",
+        choices=["html", *EXPORT_FORMATS],
+        help=textwrap.dedent('''\
+        html report or the summary and per-column divergence
+        scores as json or parquet, without plotting anything
+        '''),
+        )
+
+    parser.add_argument(
+        "--compact",
+        default=False,
+        action="store_true",
+        help=textwrap.dedent('''\
+        embed the plots as one compressed block of binary
+        arrays; needs a browser with DecompressionStream
+        '''),
+        )
+
+    parser.add_argument(
+        "--lazy",
+        default=False,
+        action="store_true",
+        help=textwrap.dedent('''\
+        only render each plot when it scrolls into view so
+        reports with many columns open quickly
+        '''),
+        )
+
+    parser.add_argument(
+        "--filter", "-f",
+        default=None,
+        action="append",
+        type=filter_checker,
+        help=textwrap.dedent('''\
+        only compare rows matching a filter like "age>=30";
+        can be repeated. Pushed down to Parquet and Arrow readers
+        '''),
+        )
+
+    parser.add_argument(
+        "--sample", "-s",
+        default=None,
+        type=fraction,
+        help=textwrap.dedent('''\
+        only compare a random fraction of rows; Parquet and
+        Arrow files are sampled by row group or record batch
+        '''),
+        )
  
     args = parser.parse_args(sys.argv[1:])
 
@@ -79,8 +194,51 @@ def main(**kwargs):
     if args.verbose:
         sys.tracebacklimit = 1000
 
-    #Read in files as dataframes
-    df1, df2 = read_data(args.first_dataset, args.second_dataset)
+    #Modules working on the data load NumPy and Pandas, so they are only
+    #imported once the arguments are valid; plotting libraries are only
+    #imported by the HTML report (see below)
+    from ..core.summary_stats import generate_common_columns, generate_summary
+    from ..core.exports import column_metrics, export_comparison
+    from ..core.streaming import stream_summary
+    from ..core.cache import DatasetCache
+    from ..core.mp_distributions import generate_ridge_spec
+    from ..core.helper_funcs import (
+        read_data, open_report_in_default_browser, launch_temp_file,
+        convert_dtypes, read_headers, projected_read_kwargs, downcast_numerics,
+        print_load_times, replaced_on_success)
+
+    #Parsed datasets are cached unless the user opts out
+    cache = None if args.no_cache else DatasetCache()
+
+    #Row filters and sampling apply to every read of the datasets
+    read_kwargs = {}
+
+    if args.filter:
+        read_kwargs["filters"] = args.filter
+
+    if args.sample is not None:
+        read_kwargs["sample"] = args.sample
+
+    #Projected mode finds common columns from the headers alone
+
+    if args.projected:
+        headers_1 = read_headers(args.first_dataset)
+        headers_2 = read_headers(args.second_dataset)
+        read_kwargs["usecols"] = [a for a in headers_1 if a in headers_2]
+
+    #Read in files as dataframes; in streaming and projected modes only
+    #the first rows of each file are read to guess the data types
+    if args.chunksize is not None or args.projected:
+        df1, df2 = read_data(
+            args.first_dataset, args.second_dataset,
+            nrows=args.chunksize or DTYPE_SAMPLE_ROWS, **read_kwargs)
+    else:
+        df1, df2 = read_data(
+            args.first_dataset, args.second_dataset, cache=cache, **read_kwargs)
+
+    if args.verbose:
+        print_load_times(df1, df2)
+
     common_columns = generate_common_columns(df1, df2)
 
     #Ask user to confirm data types for each column (via editable temp text file)
@@ -94,32 +252,99 @@ def main(**kwargs):
 
     #Select only non-numeric columns
     common_cat_cols = [k for k, v in user_dtypes.items() if v != "Continuous"]
+    common_num_cols = [k for k, v in user_dtypes.items() if v == "Continuous"]
+
+    #Load only the common columns using the confirmed data types
+    if args.projected:
+
+        read_kwargs.update(projected_read_kwargs(common_columns, user_dtypes))
+
+        if args.chunksize is None:
+            df1, df2 = read_data(
+                args.first_dataset, args.second_dataset, cache=cache, **read_kwargs)
+
+            if args.verbose:
+                print_load_times(df1, df2)
+
+            df1 = downcast_numerics(df1, user_dtypes)
+            df2 = downcast_numerics(df2, user_dtypes)
 
     #Run through optional features of the report:
     ridge_spec = None
     xtab_spec = None
 
+    if args.format != "html" and (args.xtab or args.ridge):
+        print("WARNING: Crosstab and ridge plots are only added to HTML reports.")
+        args.xtab = args.ridge = False
+
     if args.xtab:
 
         xtab_spec = launch_temp_file(file_type="xtab", common_cols=common_cat_cols)
 
-    #Generate report
-    report = generate_report(df1, df2, user_dtypes, xtab=xtab_spec, ridge=ridge_spec)
-
-    #Write to file or IO
-    if args.output:
-        #if output is StringIO() then write, don't close, don't open browser
-        if isinstance(args.output, io.TextIOBase):
-            args.output.write(report)
-        else:
-            #handle the string as if it's a path string
-            file_path = args.output
-            with open(file_path, 'w+') as f:
-                f.write(report)
-            open_report_in_default_browser(file_path)
+    #Pop user_ridge if passed, otherwise launch text editor for user input
+    ridge_input = None
+
+    if args.ridge:
+
+        ridge_input = kwargs.pop('user_ridge', None)
+
+        if not ridge_input:
+            ridge_input = launch_temp_file(
+                file_type="ridge", common_cols=common_cat_cols, num_cols=common_num_cols)
+
+    #Stream both files through summary accumulators
+    summary = None
+    frequencies = None
+
+    if args.chunksize is not None:
+
+        if xtab_spec:
+            print("WARNING: Crosstab in streaming mode is based on a row sample.")
+
+        if ridge_input:
+            print("WARNING: Ridge plot in streaming mode is based on a row sample.")
+
+        summary, (df1, df2), frequencies = stream_summary(
+            args.first_dataset, args.second_dataset, user_dtypes, args.chunksize,
+            approx=args.approx, **read_kwargs)
+
+    #Search the loaded dataframes for the most different slices
+    if ridge_input:
+
+        ridge_spec = generate_ridge_spec(
+            df1, df2, ridge_input, common_cat_cols, common_num_cols, workers=args.workers)
+
+    #Write the numbers only, without plotting libraries
+    if args.format != "html":
+
+        if summary is None:
+            summary = generate_summary(df1, df2, user_dtypes, approx=args.approx)
+
+        metrics = column_metrics(df1, df2, summary, frequencies)
+        output = args.output or os.path.join(os.getcwd(), f"report.{args.format}")
+
+        export_comparison(output, args.format, summary, metrics)
+
+        return
+
+    #Plotting and templating libraries are only needed for the HTML report
+    from ..core.jinja_app import generate_report
+
+    report_kwargs = dict(
+        xtab=xtab_spec, ridge=ridge_spec, summary=summary,
+        frequencies=frequencies, approx=args.approx, workers=args.workers,
+        max_categories=args.max_categories, compact=args.compact, lazy=args.lazy,
+        template_cache=not args.no_cache)
+
+    #Generate report, writing it to file or IO as it's rendered
+    #if output is StringIO() then write, don't close, don't open browser
+    if isinstance(args.output, io.TextIOBase):
+        generate_report(df1, df2, user_dtypes, output=args.output, **report_kwargs)
 
     else:
-        file_path = os.path.join(os.getcwd(), "report.html")
-        with open(file_path, 'w+') as f:
-            f.write(report)
+        #handle the string as if it's a path string; a failed report
+        #doesn't overwrite the previous one
+        file_path = args.output or os.path.join(os.getcwd(), "report.html")
+        with replaced_on_success(file_path) as f:
+            generate_report(df1, df2, user_dtypes, output=f, **report_kwargs)
         open_report_in_default_browser(file_path)
@@ -7,7 +7,20 @@ from unittest.mock import patch
 import argparse
 from pathlib import Path
 from io import StringIO
+import base64
+import json
+import os
 import re
+import subprocess
+import sys
+import tempfile
+import textwrap
+import zlib
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
 
 # Summarize2 imports
 from summarize2.core.helper_funcs import package_dir
@@ -41,7 +54,19 @@ class referenceTests(unittest.TestCase):
             second_dataset=Path(package_dir('sample data', 'basic_2.csv')),
             verbose=True,
             xtab=None,
-            output=test_output
+            output=test_output,
+            chunksize=None,
+            approx=False,
+            projected=False,
+            no_cache=True,
+            filter=None,
+            sample=None,
+            max_categories=50,
+            compact=False,
+            lazy=False,
+            format="html",
+            ridge=False,
+            workers=1
         )
 
         test_dtypes = {
@@ -77,6 +102,126 @@ class referenceTests(unittest.TestCase):
 
         assert a == b
 
+    @patch('argparse.ArgumentParser.parse_args')
+    def test_basic_dataset_comparison_in_chunks(self, mock_args):
+        '''
+        Reading the basic datasets in chunks should produce the same
+        report because both datasets fit into the row sample.
+        '''
+
+        test_output = StringIO()
+        ref_path = Path(package_dir('command', 'tests', 'ref', 'ref_basic.html'))
+        with open(ref_path, 'r') as f:
+            ref_output = f.read()
+
+        mock_args.return_value = argparse.Namespace(
+            first_dataset=Path(package_dir('sample data', 'basic_1.csv')),
+            second_dataset=Path(package_dir('sample data', 'basic_2.csv')),
+            verbose=True,
+            xtab=None,
+            output=test_output,
+            chunksize=7,
+            approx=False,
+            projected=False,
+            no_cache=True,
+            filter=None,
+            sample=None,
+            max_categories=50,
+            compact=False,
+            lazy=False,
+            format="html",
+            ridge=False,
+            workers=1
+        )
+
+        test_dtypes = {
+            "age": "Categorical",
+            "episodes": "Continuous",
+            "gender": "Categorical",
+            "hbres_name": "Categorical",
+            "length_of_stay": "Continuous",
+            "reporting_date": "Timeseries"
+        }
+
+        tm.main(user_dtypes=test_dtypes)
+
+        pattern = re.compile(
+            r'"\d{4}"|'
+            r'.*main.css">\n|'
+            r'.*bokeh-.*.min.js">|'
+            r'__ndarray__":.*?",'
+            )
+
+        a_clean = re.sub(pattern, '', ref_output).upper()
+        b_clean = re.sub(pattern, '', test_output.getvalue()).upper()
+
+        a = ''.join(sorted(a_clean))
+        b = ''.join(sorted(b_clean))
+        
+        test_output.close()
+
+        assert a == b
+
+    @patch('argparse.ArgumentParser.parse_args')
+    def test_basic_dataset_comparison_projected(self, mock_args):
+        '''
+        Loading only the common columns should produce the same report;
+        columns missing from one dataset are still listed from headers.
+        '''
+
+        test_output = StringIO()
+        ref_path = Path(package_dir('command', 'tests', 'ref', 'ref_basic.html'))
+        with open(ref_path, 'r') as f:
+            ref_output = f.read()
+
+        mock_args.return_value = argparse.Namespace(
+            first_dataset=Path(package_dir('sample data', 'basic_1.csv')),
+            second_dataset=Path(package_dir('sample data', 'basic_2.csv')),
+            verbose=True,
+            xtab=None,
+            output=test_output,
+            chunksize=None,
+            approx=False,
+            projected=True,
+            no_cache=True,
+            filter=None,
+            sample=None,
+            max_categories=50,
+            compact=False,
+            lazy=False,
+            format="html",
+            ridge=False,
+            workers=1
+        )
+
+        test_dtypes = {
+            "age": "Categorical",
+            "episodes": "Continuous",
+            "gender": "Categorical",
+            "hbres_name": "Categorical",
+            "length_of_stay": "Continuous",
+            "reporting_date": "Timeseries"
+        }
+
+        tm.main(user_dtypes=test_dtypes)
+
+        pattern = re.compile(
+            r'"\d{4}"|'
+            r'.*main.css">\n|'
+            r'.*bokeh-.*.min.js">|'
+            r'__ndarray__":.*?",'
+            )
+
+        a_clean = re.sub(pattern, '', ref_output).upper()
+        b_clean = re.sub(pattern, '', test_output.getvalue()).upper()
+
+        a = ''.join(sorted(a_clean))
+        b = ''.join(sorted(b_clean))
+        
+        test_output.close()
+
+        assert a == b
+
     @patch('argparse.ArgumentParser.parse_args')
     def test_synthpop_dataset_comparison(self, mock_args):
         '''
@@ -95,7 +240,19 @@ class referenceTests(unittest.TestCase):
             second_dataset=Path(package_dir('sample data', 'Synth.csv')),
             verbose=True,
             xtab=None,
-            output=test_output
+            output=test_output,
+            chunksize=None,
+            approx=False,
+            projected=False,
+            no_cache=True,
+            filter=None,
+            sample=None,
+            max_categories=50,
+            compact=False,
+            lazy=False,
+            format="html",
+            ridge=False,
+            workers=1
         )
 
         test_dtypes = {
@@ -136,3 +293,392 @@ class referenceTests(unittest.TestCase):
         test_output.close()
 
         assert a == b
+
+    @patch('argparse.ArgumentParser.parse_args')
+    def test_synthpop_dataset_comparison_in_parallel(self, mock_args):
+        '''
+        Generating the column plots in worker processes should produce
+        the same report apart from the Bokeh IDs, which are random UUIDs
+        in the workers, including the plots of columns with NAs.
+        '''
+
+        test_output = StringIO()
+        ref_path = Path(package_dir('command', 'tests', 'ref', 'ref_synthpop.html'))
+        with open(ref_path, 'r') as f:
+            ref_output = f.read()
+
+        mock_args.return_value = argparse.Namespace(
+            first_dataset=Path(package_dir('sample data', 'Original.csv')),
+            second_dataset=Path(package_dir('sample data', 'Synth.csv')),
+            verbose=True,
+            xtab=None,
+            output=test_output,
+            chunksize=None,
+            approx=False,
+            projected=False,
+            no_cache=True,
+            filter=None,
+            sample=None,
+            max_categories=50,
+            compact=False,
+            lazy=False,
+            format="html",
+            ridge=False,
+            workers=2
+        )
+
+        test_dtypes = {
+
+            "agegr": "Categorical",
+            "depress": "Continuous",
+            "edu": "Categorical",
+            "income": "Continuous",
+            "marital": "Categorical",
+            "sex": "Categorical",
+            "socprof": "Categorical",
+            "trust": "Categorical",
+            "trustfam": "Categorical",
+            "trustneigh": "Categorical",
+            "weight": "Continuous",
+        }
+
+        tm.main(user_dtypes=test_dtypes)
+
+        pattern = re.compile(
+            r'"\d{4}"|'
+            r'"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}"|'
+            r'.*main.css">\n|'
+            r'.*bokeh-.*.min.js">|'
+            r'__ndarray__":.*?",'
+            )
+
+        a_clean = re.sub(pattern, '', ref_output).upper()
+        b_clean = re.sub(pattern, '', test_output.getvalue()).upper()
+
+        a = ''.join(sorted(a_clean))
+        b = ''.join(sorted(b_clean))
+        
+        test_output.close()
+
+        assert a == b
+
+    @patch('argparse.ArgumentParser.parse_args')
+    def test_synthpop_ridge_plot(self, mock_args):
+        '''
+        Ridge plot should show the most different slices found in the
+        loaded dataframes, as many as the user asked for
+        '''
+
+        test_output = StringIO()
+
+        mock_args.return_value = argparse.Namespace(
+            first_dataset=Path(package_dir('sample data', 'Original.csv')),
+            second_dataset=Path(package_dir('sample data', 'Synth.csv')),
+            verbose=True,
+            xtab=None,
+            output=test_output,
+            chunksize=None,
+            approx=False,
+            projected=True,
+            no_cache=True,
+            filter=None,
+            sample=None,
+            max_categories=50,
+            compact=False,
+            lazy=False,
+            format="html",
+            ridge=True,
+            workers=1
+        )
+
+        test_dtypes = {
+
+            "agegr": "Categorical",
+            "depress": "Continuous",
+            "edu": "Categorical",
+            "income": "Continuous",
+            "marital": "Categorical",
+            "sex": "Categorical",
+            "socprof": "Categorical",
+            "trust": "Categorical",
+            "trustfam": "Categorical",
+            "trustneigh": "Categorical",
+            "weight": "Continuous",
+        }
+
+        test_ridge = {
+            "columns": {"slice_columns": ["sex", "agegr"], "numerical_column": "income"},
+            "options": {"metric": "ks", "top_n": 3}
+        }
+
+        tm.main(user_dtypes=test_dtypes, user_ridge=test_ridge)
+
+        report = test_output.getvalue()
+        test_output.close()
+
+        self.assertIn("Ridge plot showing 3 combinations", report)
+
+        for label in ("FEMALE | 16-24", "MALE | 45-59", "MALE | 35-44"):
+            self.assertIn(label, report)
+
+    @patch('argparse.ArgumentParser.parse_args')
+    def test_synthpop_plot_data_blocks(self, mock_args):
+        '''
+        Lazy and compact reports should keep the JSON of every plot in
+        data blocks keyed by the id of the table cell it goes into
+        '''
+
+        test_dtypes = {
+            "agegr": "Categorical",
+            "depress": "Continuous",
+            "edu": "Categorical",
+            "income": "Continuous",
+            "marital": "Categorical",
+            "sex": "Categorical",
+            "socprof": "Categorical",
+            "trust": "Categorical",
+            "trustfam": "Categorical",
+            "trustneigh": "Categorical",
+            "weight": "Continuous",
+        }
+
+        reports = {}
+
+        for mode in ("lazy", "compact"):
+
+            test_output = StringIO()
+
+            mock_args.return_value = argparse.Namespace(
+                first_dataset=Path(package_dir('sample data', 'Original.csv')),
+                second_dataset=Path(package_dir('sample data', 'Synth.csv')),
+                verbose=True,
+                xtab=None,
+                output=test_output,
+                chunksize=None,
+                approx=False,
+                projected=True,
+                no_cache=True,
+                filter=None,
+                sample=None,
+                max_categories=50,
+                compact=mode == "compact",
+                lazy=mode == "lazy",
+                format="html",
+                ridge=False,
+                workers=1
+            )
+
+            tm.main(user_dtypes=test_dtypes)
+            reports[mode] = test_output.getvalue()
+            test_output.close()
+
+        targets = re.findall(r'class="table-plot" id="(.*?)"', reports["lazy"])
+
+        blocks = dict(re.findall(
+            r'<script type="application/json" class="plot-data" '
+            r'data-target="(.*?)">(.*?)</script>', reports["lazy"]))
+
+        bundle = re.search(r'<script type="text/plain" id="plot_bundle">(.*?)</script>',
+                           reports["compact"]).group(1)
+        items = json.loads(zlib.decompress(base64.b64decode(bundle)))
+
+        self.assertEqual(len(targets), len(test_dtypes))
+        self.assertCountEqual(blocks.keys(), targets)
+        self.assertCountEqual(items.keys(), targets)
+
+        for target in targets:
+            self.assertEqual(
+                json.loads(blocks[target])["target_id"], items[target]["target_id"])
+
+    def test_json_and_parquet_output_skip_plotting(self):
+        '''
+        Machine-readable outputs should have the summary and a score for
+        each common column, without importing Bokeh or Jinja (Parquet
+        is only checked if pyarrow is installed)
+        '''
+
+        script = textwrap.dedent('''\
+            import argparse, json, sys
+            from io import StringIO
+            from pathlib import Path
+            from unittest.mock import patch
+            from summarize2.command import bootstrap
+            from summarize2.core.helper_funcs import package_dir
+
+            args = dict(
+                first_dataset=Path(package_dir("sample data", "basic_1.csv")),
+                second_dataset=Path(package_dir("sample data", "basic_2.csv")),
+                verbose=False, xtab=None, chunksize=None, approx=False,
+                projected=False, no_cache=True, filter=None, sample=None,
+                max_categories=50, compact=False, lazy=False, ridge=False,
+                workers=1)
+
+            outputs = {"json": StringIO()}
+            if sys.argv[1]:
+                outputs["parquet"] = sys.argv[1]
+
+            for output_format, output in outputs.items():
+                namespace = argparse.Namespace(
+                    output=output, format=output_format, **args)
+                with patch("argparse.ArgumentParser.parse_args", return_value=namespace):
+                    bootstrap.main(user_dtypes={
+                        "age": "Categorical",
+                        "episodes": "Continuous",
+                        "gender": "Categorical",
+                        "hbres_name": "Categorical",
+                        "length_of_stay": "Continuous",
+                        "reporting_date": "Timeseries"})
+
+            print(json.dumps({
+                "report": json.loads(outputs["json"].getvalue()),
+                "modules": [m for m in ("bokeh", "jinja2") if m in sys.modules]}))
+            ''')
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+
+            parquet_path = os.path.join(temp_dir, "report.parquet") if pq else ""
+            result = subprocess.run(
+                [sys.executable, "-c", script, parquet_path],
+                capture_output=True, text=True, check=True)
+
+            table = pq.read_table(parquet_path) if pq else None
+
+        result = json.loads(result.stdout)
+        columns = {row["column"]: row for row in result["report"]["columns"]}
+
+        self.assertListEqual(result["modules"], [])
+        self.assertEqual(result["report"]["summary"]["DFs"]["DF2"]["shape"], [30, 7])
+        self.assertEqual(len(columns), 6)
+        self.assertGreater(columns["length_of_stay"]["ks"], 0)
+        self.assertIsNone(columns["length_of_stay"]["tvd"])
+        self.assertGreater(columns["gender"]["tvd"], 0)
+
+        if table is not None:
+            self.assertListEqual(table.column("column").to_pylist(), list(columns))
+            self.assertEqual(
+                json.loads(table.schema.metadata[b"summarize2.summary"]),
+                result["report"]["summary"])
+
+    @patch('summarize2.core.helper_funcs.open_report_in_default_browser')
+    @patch('argparse.ArgumentParser.parse_args')
+    def test_failed_report_keeps_previous_file(self, mock_args, mock_browser):
+        '''
+        The report file should only be replaced once the new report is
+        complete, without leaving temporary files behind either way
+        '''
+
+        test_dtypes = {
+            "age": "Categorical",
+            "episodes": "Continuous",
+            "gender": "Categorical",
+            "hbres_name": "Categorical",
+            "length_of_stay": "Continuous",
+            "reporting_date": "Timeseries"
+        }
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+
+            report_path = os.path.join(temp_dir, "report.html")
+
+            with open(report_path, "w") as f:
+                f.write("previous report")
+
+            mock_args.return_value = argparse.Namespace(
+                first_dataset=Path(package_dir('sample data', 'basic_1.csv')),
+                second_dataset=Path(package_dir('sample data', 'basic_2.csv')),
+                verbose=True,
+                xtab=None,
+                output=report_path,
+                chunksize=None,
+                approx=False,
+                projected=False,
+                no_cache=True,
+                filter=None,
+                sample=None,
+                max_categories=50,
+                compact=False,
+                lazy=False,
+                format="html",
+                ridge=False,
+                workers=1
+            )
+
+            def failing_report(*args, output, **kwargs):
+                output.write("<html>")
+                raise RuntimeError("plotting failed")
+
+            with patch('summarize2.core.jinja_app.generate_report', failing_report):
+                with self.assertRaises(RuntimeError):
+                    tm.main(user_dtypes=test_dtypes)
+
+            with open(report_path) as f:
+                self.assertEqual(f.read(), "previous report")
+
+            self.assertListEqual(os.listdir(temp_dir), ["report.html"])
+            mock_browser.assert_not_called()
+
+            tm.main(user_dtypes=test_dtypes)
+
+            with open(report_path) as f:
+                self.assertIn("<html", f.read())
+
+            self.assertListEqual(os.listdir(temp_dir), ["report.html"])
+            mock_browser.assert_called_once_with(report_path)
+
+    @patch('argparse.ArgumentParser.parse_args')
+    def test_range_filter_on_projected_categories(self, mock_args):
+        '''
+        Range filters on columns read as categories with --projected
+        should select the same rows as without it
+        '''
+
+        test_dtypes = {
+            "age": "Categorical",
+            "episodes": "Continuous",
+            "gender": "Categorical",
+            "hbres_name": "Categorical",
+            "length_of_stay": "Continuous",
+            "reporting_date": "Timeseries"
+        }
+
+        reports = {}
+
+        for projected in (False, True):
+
+            test_output = StringIO()
+
+            mock_args.return_value = argparse.Namespace(
+                first_dataset=Path(package_dir('sample data', 'basic_1.csv')),
+                second_dataset=Path(package_dir('sample data', 'basic_2.csv')),
+                verbose=False,
+                xtab=None,
+                output=test_output,
+                chunksize=None,
+                approx=False,
+                projected=projected,
+                no_cache=True,
+                filter=[("age", ">=", 30), ("hbres_name", "<", "C")],
+                sample=None,
+                max_categories=50,
+                compact=False,
+                lazy=False,
+                format="json",
+                ridge=False,
+                workers=1
+            )
+
+            tm.main(user_dtypes=test_dtypes)
+            reports[projected] = json.loads(test_output.getvalue())
+
+        for df in ("DF1", "DF2"):
+            self.assertEqual(
+                reports[True]["summary"]["DFs"][df]["shape"][0],
+                reports[False]["summary"]["DFs"][df]["shape"][0])
+
+        self.assertGreater(reports[True]["summary"]["DFs"]["DF1"]["shape"][0], 0)
+        self.assertLess(reports[True]["summary"]["DFs"]["DF1"]["shape"][0], 30)
+
+        for unfiltered, projected in zip(reports[False]["columns"], reports[True]["columns"]):
+            self.assertEqual(unfiltered["column"], projected["column"])
+            if unfiltered["tvd"] is not None:
+                self.assertAlmostEqual(unfiltered["tvd"], projected["tvd"])
@@ -0,0 +1,93 @@
+'''
+Startup tests for the command line tool
+'''
+# Standard library imports
+import unittest
+import subprocess
+import sys
+import json
+import textwrap
+
+#Cumulative time budget for importing the entry point, in microseconds;
+#importing Pandas alone takes several times longer
+IMPORT_BUDGET_US = 150000
+
+#Libraries that shouldn't be loaded before the arguments are parsed
+HEAVY_MODULES = ["numpy", "pandas", "yaml", "bokeh", "jinja2", "scipy", "matplotlib"]
+
+class startupTests(unittest.TestCase):
+    '''
+    --help and argument errors shouldn't wait for heavy libraries
+    '''
+
+    def test_help_loads_no_heavy_libraries(self):
+        '''
+        Printing the help should only import the standard library
+        '''
+
+        script = textwrap.dedent('''\
+            import json, sys
+            from summarize2.command import bootstrap
+            sys.argv = ["summarize2", "--help"]
+            try:
+                bootstrap.main()
+            except SystemExit:
+                pass
+            print(json.dumps([m for m in %r if m in sys.modules]), file=sys.stderr)
+            ''' % HEAVY_MODULES)
+
+        result = subprocess.run(
+            [sys.executable, "-c", script], capture_output=True, text=True, check=True)
+
+        self.assertIn("--format", result.stdout)
+        self.assertListEqual(json.loads(result.stderr.splitlines()[-1]), [])
+
+    def test_entry_point_import_time_within_budget(self):
+        '''
+        Cumulative import time of the entry point reported by
+        python -X importtime should stay within IMPORT_BUDGET_US
+        '''
+
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import summarize2.command.bootstrap"],
+            capture_output=True, text=True, check=True)
+
+        cumulative = [
+            int(line.split("|")[1]) for line in result.stderr.splitlines()
+            if line.rstrip().endswith("| summarize2.command.bootstrap")]
+
+        self.assertEqual(len(cumulative), 1)
+        self.assertLess(cumulative[0], IMPORT_BUDGET_US)
+
+    def test_out_of_range_numbers_are_rejected(self):
+        '''
+        Counts below 1 and fractions outside 0 to 1 should be argument
+        errors, before any data is read
+        '''
+
+        script = textwrap.dedent('''\
+            import sys
+            from summarize2.command import bootstrap
+            from summarize2.core.helper_funcs import package_dir
+            sys.argv = [
+                "summarize2", package_dir("sample data", "basic_1.csv"),
+                package_dir("sample data", "basic_2.csv"), *sys.argv[1:]]
+            bootstrap.main()
+            ''')
+
+        invalid = {
+            "--max-categories": ("0", "-3"),
+            "--workers": ("0", "-2"),
+            "--chunksize": ("0", "-100"),
+            "--sample": ("0", "1.5", "-0.5", "nan"),
+        }
+
+        for option, values in invalid.items():
+            for value in values:
+
+                result = subprocess.run(
+                    [sys.executable, "-c", script, option, value],
+                    capture_output=True, text=True)
+
+                self.assertEqual(result.returncode, 2)
+                self.assertIn(f"argument {option}", result.stderr)
@@ -9,17 +9,188 @@ import math
 # External library imports
 import numpy as np
 from numpy import linspace
-from scipy.stats.kde import gaussian_kde
 import pandas as pd
 
 from bokeh.plotting import figure
 from bokeh.models import (
-    ColumnDataSource, BasicTicker, HoverTool, NumeralTickFormatter, FactorRange)
+    ColumnDataSource, BasicTicker, HoverTool, NumeralTickFormatter, FactorRange,
+    LinearColorMapper, ColorBar, CustomJSHover)
 from bokeh.layouts import column
 from bokeh.embed import json_item
+from bokeh.util.serialization import encode_base64_dict, decode_base64_dict
 
 # Summarize2 imports
-from ..core.helper_funcs import transform_frequencies
+from ..core.helper_funcs import (
+    align_frequencies, top_categories, crosstab_cells, MAX_DIFF_CATEGORIES)
+from ..core.kde import BinnedKDE
+
+#Crosstabs with more cells than this are drawn as a heatmap by default
+MAX_XTAB_GLYPH_CELLS = 2500
+
+#Floats below this size are exact as float32 if they are whole numbers
+FLOAT32_EXACT_INT = 2 ** 24
+
+def compact_column(column):
+    '''
+    Return a data source column with numbers as binary float32 or int32
+    arrays where the loss of precision can't be seen in the plot.
+
+    Whole numbers are kept exact and floats are only downcast if none
+    is larger than FLOAT32_EXACT_INT, beyond which Bokeh's hover tool
+    shows 4 significant digits; other lists of floats are sent as float64
+    binary arrays. Columns of strings are returned unchanged.
+    '''
+
+    if isinstance(column, dict) and "__ndarray__" in column:
+
+        array = decode_base64_dict(column)
+
+        if array.dtype == np.float64:
+            finite = array[np.isfinite(array)]
+            if not len(finite) or np.abs(finite).max() < FLOAT32_EXACT_INT:
+                return encode_base64_dict(array.astype(np.float32))
+
+        return column
+
+    if not isinstance(column, list) or not column:
+        return column
+
+    #image columns are lists of arrays
+    if all(isinstance(x, dict) for x in column):
+        return [compact_column(x) for x in column]
+
+    if not all(isinstance(x, (int, float)) and not isinstance(x, bool) for x in column):
+        return column
+
+    array = np.array(column)
+
+    if array.dtype.kind == "i":
+        if np.abs(array).max() < 2 ** 31:
+            return encode_base64_dict(array.astype(np.int32))
+        return column
+
+    return compact_column(encode_base64_dict(array.astype(np.float64)))
+
+def compact_plot(item_text):
+    '''
+    Return the JSON item of a plot with the numbers in its data sources
+    as binary arrays (see compact_column) and no whitespace.
+    '''
+
+    item = json.loads(item_text)
+
+    for model in item["doc"]["roots"]["references"]:
+        if model["type"] == "ColumnDataSource":
+            data = model["attributes"]["data"]
+            for name, column in data.items():
+                data[name] = compact_column(column)
+
+    return json.dumps(item, separators=(",", ":"))
+
+def share_palette(start, end, n=256):
+    '''
+    Palette of n colours going from start through white to end
+    '''
+
+    stops = np.array([
+        [int(c[i:i+2], 16) for i in (1, 3, 5)]
+        for c in (start, "#ffffff", end)], dtype=float)
+
+    positions = np.linspace(0, 2, n)
+    rgb = np.column_stack([np.interp(positions, [0, 1, 2], stops[:, i]) for i in range(3)])
+
+    return ["#%02x%02x%02x" % tuple(colour) for colour in np.rint(rgb).astype(int)]
+
+def xtab_heatmap(df_xtab, x_col, y_col, x_labels, num_rows, spec, colours):
+    '''
+    Crosstab drawn as a single image with a pixel per cell coloured by
+    the DF2 share of the cell's rows.
+
+    Counts and label codes of the cells are image-shaped int32 arrays
+    that Bokeh sends as binary and the hover tool looks up by pixel, so
+    the plot is made of the same few models however large the crosstab.
+
+    Returns a Bokeh figure
+    '''
+
+    if spec['options']['column_sort']:
+        x_factors = list(x_labels)
+        y_factors = [str(x) for x in range(num_rows)]
+        rows = (
+            df_xtab.groupby(x_col, sort=False)['angle_s'].rank(method='first')
+            .to_numpy(dtype=np.int64) - 1)
+    else:
+        x_factors = list(df_xtab[x_col].unique())
+        y_factors = list(df_xtab[y_col].unique())
+        rows = pd.Index(y_factors).get_indexer(df_xtab[y_col])
+
+    cols = pd.Index(x_factors).get_indexer(df_xtab[x_col])
+    y_labels = df_xtab[y_col].unique()
+    o = df_xtab['o'].to_numpy()
+    s = df_xtab['s'].to_numpy()
+
+    #empty cells are transparent and have -1 label codes
+    shape = (len(y_factors), len(x_factors))
+    share = np.full(shape, np.nan, dtype=np.float32)
+    counts_1 = np.zeros(shape, dtype=np.int32)
+    counts_2 = np.zeros(shape, dtype=np.int32)
+    x_code = np.full(shape, -1, dtype=np.int32)
+    y_code = np.full(shape, -1, dtype=np.int32)
+
+    share[rows, cols] = s / (o + s)
+    counts_1[rows, cols] = o
+    counts_2[rows, cols] = s
+    x_code[rows, cols] = cols
+    y_code[rows, cols] = pd.Index(y_labels).get_indexer(df_xtab[y_col])
+
+    source = ColumnDataSource({
+        'image': [share], 'o': [counts_1], 's': [counts_2],
+        'x_code': [x_code], 'y_code': [y_code]})
+
+    #labels are sent once and looked up by the codes of the hovered pixel
+    x_lookup = ColumnDataSource({'label': [str(x) for x in x_factors]})
+    y_lookup = ColumnDataSource({'label': [str(x) for x in y_labels]})
+    label_code = "return value < 0 ? '' : labels.data['label'][value]"
+
+    MyHover = HoverTool(
+        tooltips=[
+            ("DF1 Value", "@o"),
+            ("DF2 Value", "@s"),
+            ("X-LABEL", "@x_code{custom}"),
+            ("Y-LABEL", "@y_code{custom}"),
+        ],
+        formatters={
+            "@x_code": CustomJSHover(args=dict(labels=x_lookup), code=label_code),
+            "@y_code": CustomJSHover(args=dict(labels=y_lookup), code=label_code),
+        }
+    )
+
+    mapper = LinearColorMapper(
+        palette=share_palette(*colours), low=0, high=1, nan_color="rgba(0, 0, 0, 0)")
+
+    p = figure(
+        plot_width=965, plot_height=max(600, min(965, 25 * num_rows)),
+        toolbar_location=None,
+        tools=["pan, wheel_zoom", MyHover],
+        active_scroll="wheel_zoom",
+        x_range=FactorRange(factors=x_factors),
+        y_range=FactorRange(factors=y_factors),
+        x_axis_location='above')
+
+    #factor ranges place factor i at i + 0.5 in synthetic coordinates
+    p.image(
+        image='image', x=0, y=0, dw=shape[1], dh=shape[0],
+        color_mapper=mapper, source=source)
+
+    p.add_layout(ColorBar(
+        color_mapper=mapper, title="DF2 share", width=10,
+        background_fill_color='#e6e5e3'), 'right')
+
+    p.xaxis.visible = spec['options']['x_labels_visible']
+    p.yaxis.visible = (
+        spec['options']['y_labels_visible'] and not spec['options']['column_sort'])
+
+    return p
 
 def colour_mapper(angles, preset):
     '''
@@ -45,6 +216,12 @@ def colour_mapper(angles, preset):
 def generate_xtab_plot(df1, df2, spec):
     '''
     Crosstab with PIEs!
+
+    Only the cells that occur in the data are counted (see crosstab_cells)
+    so crosstabs of columns with many values stay small.
+
+    Crosstabs with more cells than the raster_threshold option (or
+    MAX_XTAB_GLYPH_CELLS) are drawn as a heatmap instead (see xtab_heatmap).
     '''
 
     DF1_COLOR = "#DD8452"
@@ -57,43 +234,11 @@ def generate_xtab_plot(df1, df2, spec):
     y_axis = spec['columns']['y_axis']
     y_axis = [y_axis] if isinstance(y_axis, str) else y_axis
 
-    if len(x_axis) == 1:
-        x_col = x_axis[0]
-
-    else: 
-        x_col = '-'.join(x_axis)
-        df1[x_col] = df1[x_axis[0]].str.cat(df1[x_axis[1:]], sep=" - ")
-        df2[x_col] = df2[x_axis[0]].str.cat(df2[x_axis[1:]], sep=" - ")
-
-    if len(y_axis) == 1:
-        y_col = y_axis[0]
-
-    else: 
-        y_col = '-'.join(y_axis)
-        df1[y_col] = df1[y_axis[0]].str.cat(df1[y_axis[1:]], sep=" - ")
-        df2[y_col] = df2[y_axis[0]].str.cat(df2[y_axis[1:]], sep=" - ")
-
-    df1_xtab = (
-        pd.crosstab(
-            index=df1[y_col],
-            columns=df1[x_col])
-                .reset_index()
-                .melt(id_vars=y_col, value_name='o'))
+    #Multi-column axes are named after all of their columns
+    x_col = '-'.join(x_axis)
+    y_col = '-'.join(y_axis)
 
-    df2_xtab = (
-        pd.crosstab(
-            index=df2[y_col],
-            columns=df2[x_col])
-                .reset_index()
-                .melt(id_vars=y_col, value_name='s'))
-
-    df_xtab = pd.merge(df1_xtab, df2_xtab, how='left')
-
-    #% of total times 360 + 90 because Bokeh starts angle from horizontal
-    df_xtab['angle_s'] = (df_xtab['s']/(df_xtab['o'] + df_xtab['s']) * 360) + 90
-
-    df_xtab[x_col] = df_xtab[x_col].astype('str')
-    df_xtab[y_col] = df_xtab[y_col].astype('str')
+    df_xtab, x_labels, num_rows = crosstab_cells(df1, df2, x_axis, y_axis)
         
     TOOLTIPS = [
         ("DF1 Value", "@o"),
@@ -111,39 +256,44 @@ def generate_xtab_plot(df1, df2, spec):
     #it's complicated-ish. can play around (but not too much) 
     #with magic numbers: 10, 25, 80 and 25.
     
-    num_rows = df_xtab[y_col].nunique()
-    num_cols = df_xtab[x_col].nunique()
+    num_cols = len(x_labels)
     aspect = min(10, num_cols) / min(25, num_rows)
     plot_width = max(965, 80 * num_cols)
     plot_height = max(600, 25 * num_rows)
     wedge_radius = 0.25 * aspect
     ray_length = wedge_radius * 2.1
 
-    if spec['options']['column_sort']:
+    raster_threshold = spec['options'].get('raster_threshold', MAX_XTAB_GLYPH_CELLS)
+
+    if num_cols * num_rows > raster_threshold:
+
+        p = xtab_heatmap(
+            df_xtab, x_col, y_col, x_labels, num_rows, spec, (DF1_COLOR, DF2_COLOR))
+
+    elif spec['options']['column_sort']:
 
         p = figure(
             plot_width=plot_width, plot_height=plot_height,
             toolbar_location=None,
             tools=["pan, wheel_zoom", MyHover],
             active_scroll="wheel_zoom",
-            x_range=df_xtab[x_col].unique(),
+            x_range=x_labels,
             y_range=FactorRange(
-                factors=[str(x) for x in range(df_xtab[y_col].nunique())]),
+                factors=[str(x) for x in range(num_rows)]),
             x_axis_location='above')
     
         p.extra_y_ranges = {}
 
-        for x_col_val in df_xtab[x_col].unique():
+        #position of each cell when its x heading is sorted by angle
+        df_xtab['sorted_index'] = (
+            df_xtab.groupby(x_col, sort=False)['angle_s'].rank(method='first')
+            .astype(int) - 1)
+
+        for x_col_val, x_df in df_xtab.groupby(x_col, sort=False):
+
+            x_df = x_df.sort_values('sorted_index').reset_index(drop=True)
+            x_df['sorted_index'] = x_df['sorted_index'].astype(str)
 
-            #create a df for selected x heading and sort it
-            x_df = (
-                df_xtab[df_xtab[x_col] == x_col_val]
-                .sort_values('angle_s')
-                .reset_index(drop=True)
-                .dropna()
-            )
-        
-            x_df['sorted_index'] = [str(x) for x in x_df.index]
             p.extra_y_ranges[x_col_val] = FactorRange(factors=x_df['sorted_index'])
             x_df['line_colour'] = colour_mapper(
                 x_df['angle_s'], preset=spec['options']['colour_preset'])
@@ -176,8 +326,6 @@ def generate_xtab_plot(df1, df2, spec):
         df_xtab['line_colour'] = colour_mapper(
             df_xtab['angle_s'], preset=spec['options']['colour_preset'])
 
-        df_xtab.dropna(inplace=True)
-
         p = figure(
             plot_width=plot_width, plot_height=plot_height,
             toolbar_location=None,
@@ -224,9 +372,17 @@ def generate_xtab_plot(df1, df2, spec):
 
     return item_text
 
-def generate_diff_plot(df1, df2, var_name, shade):
+def generate_diff_plot(df1, df2, var_name, shade, frequencies=None,
+                       max_categories=MAX_DIFF_CATEGORIES):
     '''
     Plot the difference in frequency for each unique value of a given column (var_name).
+
+    Pre-computed (freq_1, freq_2) value counts can be passed in frequencies
+    when the full columns are not available.
+
+    Columns with more than max_categories unique values are reduced to the
+    values whose share of rows differs the most and an "Other" bar with
+    the rest, before any plot data is made (see top_categories).
     
     Returns a json representation of a Bokeh plot to be embedded in the template.
     '''
@@ -236,20 +392,25 @@ def generate_diff_plot(df1, df2, var_name, shade):
     else:
         band_color = 'gainsboro'
 
-    freq_1, freq_2 = transform_frequencies(df1, df2, var_name)
+    values, counts_1, counts_2 = align_frequencies(df1, df2, var_name, frequencies)
+    values, counts_1, counts_2 = top_categories(values, counts_1, counts_2, max_categories)
+
+    #counts are sent to Bokeh as object columns which it serialises as lists
+    freq_1 = counts_1.astype(object)
+    freq_2 = counts_2.astype(object)
 
     #horrible, horrible stuff to get round zero division error!
-    a = (freq_2[1] - freq_1[1])
-    b = ((freq_2[1] + freq_1[1]) / 2)
+    a = (freq_2 - freq_1)
+    b = ((freq_2 + freq_1) / 2)
 
     #make sure to sanitise names with an ' as JSON.parse will freak out.
     bokeh_df = pd.DataFrame(
-        {'VAR':[str(x).replace("'", "") for x in freq_1[0]],
-         'DF1':freq_1[1],
-         'DF2':freq_2[1],
-         'DIFF_ABS': freq_2[1] - freq_1[1],
+        {'VAR':[str(x).replace("'", "") for x in values],
+         'DF1':freq_1,
+         'DF2':freq_2,
+         'DIFF_ABS': freq_2 - freq_1,
          'DIFF_PCT': np.divide(a, b, out=np.zeros_like(a), where=b != 0),
-         'COLOR': np.where(freq_2[1] - freq_1[1] > 0, '#527563', '#876388')}
+         'COLOR': np.where(counts_2 - counts_1 > 0, '#527563', '#876388')}
     )
 
     source = ColumnDataSource(bokeh_df.sort_values(by='DIFF_PCT'))
@@ -310,6 +471,10 @@ def generate_ridge_plot(df1, df2, spec):
     '''
     Given a ridge spec, generate a series of Bokeh plots showing
     histogram overlaid with KDE lines.
+
+    spec has the slice columns (cols), the numerical column (num_col)
+    and the (score, slice) tuples of the slices to plot (indices), with
+    '_' for the padding of launch_controller / compare_groups results.
     '''
 
     DF1_COLOR = '#DD8452'
@@ -320,8 +485,12 @@ def generate_ridge_plot(df1, df2, spec):
     indices = spec['indices']
 
     temp_cats = [x[1] for x in indices if x[1] != '_']
-    temp_df1 = df1.set_index(cols)[num_col]
-    temp_df2 = df2.set_index(cols)[num_col]
+
+    #Row positions of each slice, found in a single pass over each dataset;
+    #slices of a single column are plain values rather than tuples
+    keys = cols[0] if len(cols) == 1 else cols
+    positions1 = df1.groupby(keys, observed=True).indices
+    positions2 = df2.groupby(keys, observed=True).indices
 
     def make_plot(s1, s2, index, shade):
 
@@ -331,7 +500,7 @@ def generate_ridge_plot(df1, df2, spec):
         else:
             band_color = 'gainsboro'
 
-        bins = sorted(s1.append(s2).unique())
+        bins = np.union1d(s1, s2)
 
         hist1, edges1 = np.histogram(s1, density=False, bins=bins)
         hist2, edges2 = np.histogram(s2, density=False, bins=bins)
@@ -341,13 +510,20 @@ def generate_ridge_plot(df1, df2, spec):
 
         x = linspace(plot_min, plot_max, 500)
 
-        pdf1 = gaussian_kde(s1, bw_method=0.1)
-        pdf2 = gaussian_kde(s2, bw_method=0.1)
+        def density(s):
+            #a slice with a single distinct value doesn't have a density
+            try:
+                return BinnedKDE(s, bw_method=0.1)(x)
+            except ValueError:
+                return np.zeros_like(x)
+
+        y1 = density(s1)
+        y2 = density(s2)
 
-        scale_factor = max(hist1.max(), hist2.max()) / max(pdf1(x).max(), pdf2(x).max())
+        scale_factor = max(hist1.max(), hist2.max()) / (max(y1.max(), y2.max()) or 1)
 
-        y1 = pdf1(x) * scale_factor
-        y2 = pdf2(x) * scale_factor
+        y1 = y1 * scale_factor
+        y2 = y2 * scale_factor
 
         p = figure(
             plot_width=965, x_range=(plot_min, plot_max),
@@ -365,7 +541,7 @@ def generate_ridge_plot(df1, df2, spec):
             line_width=1,
             muted_color=DF1_COLOR,
             muted_alpha=0.2,
-            legend='PDF1')
+            legend_label='PDF1')
 
         p.line(
             x=x,
@@ -375,7 +551,7 @@ def generate_ridge_plot(df1, df2, spec):
             line_width=1,
             muted_color=DF2_COLOR,
             muted_alpha=0.2,
-            legend='PDF2')
+            legend_label='PDF2')
 
         hist1 = p.vbar(
             x=edges1[:-1],
@@ -388,7 +564,7 @@ def generate_ridge_plot(df1, df2, spec):
             line_alpha=0.4,
             muted_color=DF1_COLOR,
             muted_alpha=0.1,
-            legend='HIST1')
+            legend_label='HIST1')
 
         hist2 = p.vbar(
             x=edges2[:-1],
@@ -401,7 +577,7 @@ def generate_ridge_plot(df1, df2, spec):
             line_alpha=0.4,
             muted_color=DF2_COLOR,
             muted_alpha=0.1,
-            legend='HIST2')
+            legend_label='HIST2')
 
         hist1.muted = True
         hist2.muted = True
@@ -438,20 +614,14 @@ def generate_ridge_plot(df1, df2, spec):
     plots = []
 
     for i, cat in enumerate(temp_cats):
-        
-        if len(cols) == 1:
 
-            temp_s1 = temp_df1.xs(cat, level=None).dropna()
-            temp_s2 = temp_df2.xs(cat, level=None).dropna()
-
-            plots.append(make_plot(temp_s1, temp_s2, cat, i%2))
+        temp_s1 = df1[num_col].take(positions1[cat]).dropna()
+        temp_s2 = df2[num_col].take(positions2[cat]).dropna()
 
+        if len(cols) == 1:
+            plots.append(make_plot(temp_s1, temp_s2, str(cat), i%2))
         else:
-
-            temp_s1 = temp_df1.xs(cat, level=cols).dropna()
-            temp_s2 = temp_df2.xs(cat, level=cols).dropna()
-
-            plots.append(make_plot(temp_s1, temp_s2, ' | '.join(cat), i%2))
+            plots.append(make_plot(temp_s1, temp_s2, ' | '.join(map(str, cat)), i%2))
 
 
     p = column(plots)
@@ -462,8 +632,8 @@ def generate_ridge_plot(df1, df2, spec):
 
 def generate_kde_plot(df1, df2, col_name, shade):
     '''
-    Using scipy's KDE implementation, create a KDE plot
-    with a zoom and pan interactivity.
+    Using a binned KDE with the same bandwidth as scipy's gaussian_kde,
+    create a KDE plot with a zoom and pan interactivity.
     '''
 
     s1 = df1[col_name].dropna()
@@ -483,8 +653,8 @@ def generate_kde_plot(df1, df2, col_name, shade):
 
     x = linspace(plot_min, plot_max, 500)
 
-    pdf1 = gaussian_kde(s1, bw_method=0.1)
-    pdf2 = gaussian_kde(s2, bw_method=0.1)
+    pdf1 = BinnedKDE(s1, bw_method=0.1)
+    pdf2 = BinnedKDE(s2, bw_method=0.1)
 
     y1 = pdf1(x)
     y2 = pdf2(x)
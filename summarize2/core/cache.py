@@ -0,0 +1,270 @@
+'''
+Module with an on-disk cache of parsed datasets.
+
+Parsing a large .csv or Excel file is much slower than reading the same
+data back from binary arrays, so each parsed dataframe is saved as one
+.npy file per column. Numerical columns (and category codes) are memory
+mapped when loaded which means they are only read from disk when used.
+
+Nothing in the cache is pickled, so a tampered cache file can't run code
+when it's loaded. Text columns are saved as integer codes and a JSON
+list of their unique strings; dataframes with other Python objects in
+their columns, like dates or a mix of numbers and text, aren't cached.
+
+Entries are content-addressed: the key is a hash of the file contents
+and the reader arguments, so a copy of the same file is a cache hit.
+Hashing the contents still means reading the whole file, so the content
+hash of each path, size and modification time is remembered in a small
+index and only recomputed when any of them change.
+'''
+
+# Standard library imports
+from pathlib import Path
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+# External library imports
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_categorical_dtype
+
+#Default location and size limit (in bytes) of the cache
+CACHE_DIR = os.environ.get(
+    "SUMMARIZE2_CACHE_DIR", os.path.join(Path.home(), ".cache", "summarize2"))
+CACHE_SIZE_LIMIT = int(os.environ.get("SUMMARIZE2_CACHE_SIZE", 2 * 1024 ** 3))
+
+#Part of every key so that entries saved in an older layout are never read
+CACHE_FORMAT = 2
+
+def string_values(values):
+    '''
+    Return values as a list for JSON or None if they aren't all strings.
+
+    Other objects could come back as a different type and pd.factorize
+    treats equal numbers of different types, like 1 and True, as one value.
+    '''
+
+    values = list(values)
+
+    if all(isinstance(x, str) for x in values):
+        return values
+
+    return None
+
+class DatasetCache:
+    '''
+    Size-bounded cache of parsed dataframes with LRU eviction.
+
+    Each entry is a directory with a manifest.json and a .npy file per
+    column, plus a .json file of values for text columns and categories.
+    The manifest's modification time is updated on every hit and entries
+    with the oldest manifests are evicted first, along with the index
+    files of their contents.
+    '''
+
+    def __init__(self, cache_dir=CACHE_DIR, size_limit=CACHE_SIZE_LIMIT):
+
+        self.root = Path(cache_dir)
+        self.size_limit = size_limit
+        self.entries = self.root / "entries"
+        self.index = self.root / "index"
+
+        #both datasets are read (and saved) from separate threads
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def content_hash(data_path, block_size=2 ** 20):
+        '''
+        Hash the file contents in blocks to keep memory use flat
+        '''
+
+        digest = hashlib.blake2b(digest_size=16)
+
+        with open(data_path, "rb") as f:
+            for block in iter(lambda: f.read(block_size), b""):
+                digest.update(block)
+
+        return digest.hexdigest()
+
+    def key(self, data_path, **kwargs):
+        '''
+        Build the cache key for a file and the reader kwargs used to parse it
+        '''
+
+        stat = os.stat(data_path)
+        stat_id = f"{os.path.abspath(data_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+        stat_key = hashlib.blake2b(stat_id.encode(), digest_size=16).hexdigest()
+
+        index_path = self.index / stat_key
+
+        if index_path.exists():
+            content_key = index_path.read_text()
+        else:
+            content_key = self.content_hash(data_path)
+            self.index.mkdir(parents=True, exist_ok=True)
+            index_path.write_text(content_key)
+
+        reader_id = repr((CACHE_FORMAT, sorted(kwargs.items())))
+        reader_key = hashlib.blake2b(reader_id.encode(), digest_size=8).hexdigest()
+
+        return f"{content_key}-{reader_key}"
+
+    def get(self, key):
+        '''
+        Load a cached dataframe or return None if there isn't one.
+
+        Numerical arrays are opened in copy-on-write mode, so the dataframe
+        can be modified without touching the cached files.
+        '''
+
+        entry = self.entries / key
+        manifest_path = entry / "manifest.json"
+
+        if not manifest_path.exists():
+            return None
+
+        manifest = json.loads(manifest_path.read_text())
+        data = {}
+
+        for i, column in enumerate(manifest["columns"]):
+
+            if column["kind"] == "array":
+                data[column["name"]] = np.load(entry / f"{i}.npy", mmap_mode="c")
+
+            elif column["kind"] == "category":
+                codes = np.load(entry / f"{i}.npy", mmap_mode="c")
+                if column["categories"] == "json":
+                    categories = pd.Index(
+                        json.loads((entry / f"{i}_categories.json").read_text()), dtype=object)
+                else:
+                    categories = np.load(entry / f"{i}_categories.npy")
+                data[column["name"]] = pd.Categorical.from_codes(
+                    codes, categories, ordered=column["ordered"])
+
+            else:
+                codes = np.load(entry / f"{i}.npy")
+                #NAs have code -1, which picks the np.nan that Pandas parsers use
+                values = json.loads((entry / f"{i}_values.json").read_text())
+                data[column["name"]] = np.array(values + [np.nan], dtype=object)[codes]
+
+        #mark as recently used
+        os.utime(manifest_path)
+
+        return pd.DataFrame(data, index=pd.RangeIndex(manifest["rows"]), copy=False)
+
+    def put(self, key, df):
+        '''
+        Save a dataframe to the cache and evict old entries if needed.
+
+        Only dataframes with a default index, string column names and
+        object columns of strings (see string_values) are cached because
+        those are the only ones the manifest can rebuild without pickling.
+        '''
+
+        if not (isinstance(df.index, pd.RangeIndex) and df.index.start == 0
+                and df.index.step == 1 and all(isinstance(c, str) for c in df.columns)):
+            return
+
+        entry = self.entries / key
+        temp_entry = self.entries / f"{key}.tmp"
+
+        shutil.rmtree(temp_entry, ignore_errors=True)
+        temp_entry.mkdir(parents=True)
+
+        columns = []
+
+        for i, name in enumerate(df.columns):
+
+            series = df[name]
+
+            column = {"name": name}
+
+            if is_categorical_dtype(series):
+
+                categories = series.cat.categories
+                np.save(temp_entry / f"{i}.npy", series.cat.codes.to_numpy())
+
+                if categories.dtype.kind in "biufcmM":
+                    np.save(temp_entry / f"{i}_categories.npy", categories.to_numpy())
+                    column["categories"] = "npy"
+                else:
+                    #other objects, like dates, would need pickling
+                    values = string_values(categories)
+                    if values is None:
+                        shutil.rmtree(temp_entry, ignore_errors=True)
+                        return
+                    (temp_entry / f"{i}_categories.json").write_text(json.dumps(values))
+                    column["categories"] = "json"
+
+                column.update(kind="category", ordered=bool(series.cat.ordered))
+
+            elif isinstance(series.dtype, np.dtype) and series.dtype.kind in "biufcmM":
+                np.save(temp_entry / f"{i}.npy", series.to_numpy())
+                column["kind"] = "array"
+
+            else:
+                codes, uniques = pd.factorize(series.to_numpy(dtype=object))
+                values = string_values(uniques)
+                if values is None:
+                    shutil.rmtree(temp_entry, ignore_errors=True)
+                    return
+                np.save(temp_entry / f"{i}.npy", codes)
+                (temp_entry / f"{i}_values.json").write_text(json.dumps(values))
+                column["kind"] = "object"
+
+            columns.append(column)
+
+        manifest = {"rows": len(df), "columns": columns}
+        (temp_entry / "manifest.json").write_text(json.dumps(manifest))
+
+        #entries are renamed into place so a half-written entry is never read
+        with self.lock:
+            shutil.rmtree(entry, ignore_errors=True)
+            os.replace(temp_entry, entry)
+            self.evict()
+
+    def evict(self):
+        '''
+        Delete least recently used entries until the cache fits its size
+        limit, then the index files of contents without any entries.
+
+        Called from put while holding the lock.
+        '''
+
+        entries = []
+
+        for entry in self.entries.iterdir():
+
+            #skip entries that are still being written
+            manifest_path = entry / "manifest.json"
+            if entry.suffix == ".tmp" or not manifest_path.exists():
+                continue
+
+            size = sum(f.stat().st_size for f in entry.iterdir())
+            entries.append((manifest_path.stat().st_mtime, size, entry))
+
+        total = sum(size for _, size, _ in entries)
+
+        for _, size, entry in sorted(entries, key=lambda x: x[0]):
+
+            if total <= self.size_limit:
+                break
+
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+        #entries are named by content hash and reader hash
+        content_keys = {entry.name.split("-")[0] for entry in self.entries.iterdir()}
+
+        if not self.index.exists():
+            return
+
+        for index_path in self.index.iterdir():
+            try:
+                if index_path.read_text() not in content_keys:
+                    index_path.unlink()
+            except OSError:
+                pass
@@ -0,0 +1,204 @@
+'''
+Module for reading columnar files: Parquet and Arrow IPC (Feather v2).
+
+Only the requested columns are read and row filters are pushed down to
+the reader, so Parquet row groups whose statistics rule out a match are
+skipped without being decompressed. Samples are taken as a random subset
+of row groups (Parquet) or record batches (Arrow IPC), which means the
+rest of the file is never read.
+
+pyarrow is an optional dependency and is only imported when needed.
+'''
+
+# External library imports
+import numpy as np
+import pandas as pd
+
+# Summarize2 imports
+from ..core.options import FILTER_OPERATORS, columnar_format
+
+def import_pyarrow():
+    '''
+    Import pyarrow with a helpful message if it's not installed.
+
+    Returns a tuple of pyarrow and pyarrow.dataset modules
+    '''
+
+    try:
+        import pyarrow
+        import pyarrow.dataset
+    except ImportError:
+        msg = "Reading Parquet or Arrow files requires pyarrow: pip install pyarrow"
+        raise ImportError(msg) from None
+
+    return pyarrow, pyarrow.dataset
+
+def filter_expression(filters):
+    '''
+    Combine (column, operator, value) filters into one pyarrow expression
+    '''
+
+    _, ds = import_pyarrow()
+
+    expression = None
+
+    for col, op, value in filters:
+
+        term = FILTER_OPERATORS[op](ds.field(col), value)
+        expression = term if expression is None else expression & term
+
+    return expression
+
+def read_columnar_headers(data_path):
+    '''
+    Read the column names from the file schema without reading any data
+    '''
+
+    _, ds = import_pyarrow()
+
+    return ds.dataset(str(data_path), format=columnar_format(data_path)).schema.names
+
+def columnar_pieces(data_path, usecols=None, filters=None, sample=None, seed=0):
+    '''
+    Generate pyarrow tables, one per Parquet row group or IPC record batch.
+
+    Parameters
+    ----------
+    data_path : Path
+        path to a Parquet or Arrow IPC file
+    usecols : list
+        column names to read; all columns if None
+    filters : list
+        (column, operator, value) tuples, all of which must be true
+    sample : float
+        fraction of row groups or record batches to read
+    seed : int
+        seed for picking the sampled row groups
+    '''
+
+    pa, ds = import_pyarrow()
+
+    expression = filter_expression(filters) if filters else None
+
+    if columnar_format(data_path) == "parquet":
+        dataset = ds.dataset(str(data_path), format="parquet")
+        schema = dataset.schema
+    else:
+        #memory mapping means unread record batches are never loaded
+        reader = pa.ipc.open_file(pa.memory_map(str(data_path)))
+        schema = reader.schema
+
+    #keep the file's column order, like the usecols of Pandas readers
+    columns = schema.names if usecols is None else [
+        col for col in schema.names if col in usecols]
+
+    if columnar_format(data_path) == "parquet":
+
+        #row groups that can't match the filter are dropped using statistics
+        pieces = [
+            row_group
+            for fragment in dataset.get_fragments(filter=expression)
+            for row_group in fragment.split_by_row_group(filter=expression)]
+
+        def read_piece(row_group):
+            return row_group.to_table(schema=schema, columns=columns, filter=expression)
+
+    else:
+
+        pieces = list(range(reader.num_record_batches))
+
+        def read_piece(i):
+            table = pa.Table.from_batches([reader.get_batch(i)]).select(columns)
+            return table.filter(expression) if expression is not None else table
+
+    if sample is not None and pieces:
+        rng = np.random.default_rng(seed)
+        size = max(1, int(round(len(pieces) * sample)))
+        picked = np.sort(rng.choice(len(pieces), size=size, replace=False))
+        pieces = [pieces[i] for i in picked]
+
+    if not pieces:
+        yield schema.empty_table().select(columns)
+
+    for piece in pieces:
+        yield read_piece(piece)
+
+def table_to_pandas(table, dtype=None):
+    '''
+    Convert a pyarrow table to a dataframe, applying Pandas-style dtypes.
+
+    Category columns are dictionary encoded by Arrow, which is much cheaper
+    than converting strings to Python objects and then to categories.
+    '''
+
+    dtype = dtype or {}
+    categories = [col for col, kind in dtype.items() if kind == "category"]
+
+    for col in categories:
+        if col in table.column_names:
+            index = table.column_names.index(col)
+            table = table.set_column(index, col, table[col].dictionary_encode())
+
+    #split_blocks and self_destruct avoid holding two copies of the data
+    df = table.to_pandas(split_blocks=True, self_destruct=True)
+
+    #Arrow nulls in string columns are None; Pandas parsers use np.nan
+    for col in df.columns[df.dtypes == object]:
+        values = df[col].to_numpy()
+        values[pd.isna(values)] = np.nan
+        df[col] = values
+
+    other_dtypes = {
+        col: kind for col, kind in dtype.items()
+        if kind != "category" and col in df.columns}
+
+    return df.astype(other_dtypes) if other_dtypes else df
+
+def read_columnar(data_path, usecols=None, dtype=None, nrows=None,
+                  filters=None, sample=None):
+    '''
+    Read a Parquet or Arrow IPC file into a dataframe.
+
+    Takes the same usecols, dtype and nrows kwargs as Pandas readers
+    so it can be used interchangeably with read_csv and read_excel.
+    '''
+
+    pa, _ = import_pyarrow()
+
+    tables = []
+    rows = 0
+
+    for table in columnar_pieces(data_path, usecols, filters, sample):
+
+        tables.append(table)
+        rows += table.num_rows
+
+        if nrows is not None and rows >= nrows:
+            break
+
+    table = pa.concat_tables(tables)
+
+    if nrows is not None:
+        table = table.slice(0, nrows)
+
+    return table_to_pandas(table, dtype)
+
+def read_columnar_chunks(data_path, chunksize, usecols=None, dtype=None,
+                         filters=None, sample=None):
+    '''
+    Generate dataframes with at most chunksize rows from a columnar file.
+
+    At least one (possibly empty) dataframe is always generated.
+    '''
+
+    pa, _ = import_pyarrow()
+
+    empty = True
+
+    for table in columnar_pieces(data_path, usecols, filters, sample):
+        for batch in table.to_batches(max_chunksize=chunksize):
+            empty = False
+            yield table_to_pandas(pa.Table.from_batches([batch]), dtype)
+
+    if empty:
+        yield table_to_pandas(table, dtype)
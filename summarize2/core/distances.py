@@ -0,0 +1,137 @@
+'''
+Module with numeric distances between two distributions.
+
+Used to rank how different the distributions of a numerical column are
+between the two datasets. Every distance is 0 for identical samples and
+grows as the distributions move apart:
+
+ks          - largest vertical gap between the two empirical CDFs (0 to 1)
+wasserstein - area between the two empirical CDFs, in the column's units
+js          - Jensen-Shannon distance between the two KDEs (0 to 1)
+overlap     - share of the KDE area that is not common to both (0 to 1)
+
+ks and wasserstein are exact and computed on the merged sorted values;
+js and overlap compare the two densities evaluated on a shared grid.
+'''
+
+# External library imports
+import numpy as np
+
+# Summarize2 imports
+from ..core.kde import BinnedKDE
+
+#Number of shared grid points used by the density based distances
+GRID_SIZE = 512
+
+def _empirical_cdfs(s1, s2):
+    '''
+    Evaluate both empirical CDFs at every value of the merged samples.
+
+    Returns a tuple of sorted merged values and the two CDFs
+    '''
+
+    s1 = np.sort(s1)
+    s2 = np.sort(s2)
+    values = np.sort(np.concatenate([s1, s2]))
+
+    cdf1 = np.searchsorted(s1, values, side="right") / len(s1)
+    cdf2 = np.searchsorted(s2, values, side="right") / len(s2)
+
+    return values, cdf1, cdf2
+
+def _shared_densities(s1, s2, bw_method=0.1):
+    '''
+    Evaluate both KDEs on a grid spanning the two samples
+    and normalise them to unit area on that grid.
+
+    Returns a tuple of grid and the two densities
+    '''
+
+    x = np.linspace(min(s1.min(), s2.min()), max(s1.max(), s2.max()), GRID_SIZE)
+
+    y1 = BinnedKDE(s1, bw_method=bw_method)(x)
+    y2 = BinnedKDE(s2, bw_method=bw_method)(x)
+
+    return x, y1 / np.trapz(y1, x), y2 / np.trapz(y2, x)
+
+def ks_distance(s1, s2):
+    '''
+    Kolmogorov-Smirnov statistic of two samples
+    '''
+
+    _, cdf1, cdf2 = _empirical_cdfs(s1, s2)
+
+    return np.abs(cdf1 - cdf2).max()
+
+def wasserstein_distance(s1, s2):
+    '''
+    First Wasserstein (earth mover's) distance of two samples
+    '''
+
+    values, cdf1, cdf2 = _empirical_cdfs(s1, s2)
+
+    return np.sum(np.abs(cdf1 - cdf2)[:-1] * np.diff(values))
+
+def js_distance(s1, s2):
+    '''
+    Jensen-Shannon distance (base 2) of the two KDEs
+    '''
+
+    x, y1, y2 = _shared_densities(s1, s2)
+    mixture = (y1 + y2) / 2
+
+    def kl_divergence(y):
+        #0 * log(0) is taken to be 0
+        ratio = np.divide(y, mixture, out=np.ones_like(y), where=y > 0)
+        return np.trapz(y * np.log2(ratio), x)
+
+    divergence = (kl_divergence(y1) + kl_divergence(y2)) / 2
+
+    return np.sqrt(max(divergence, 0))
+
+def overlap_distance(s1, s2):
+    '''
+    One minus the area under the smaller of the two KDEs
+    '''
+
+    x, y1, y2 = _shared_densities(s1, s2)
+
+    return max(1 - np.trapz(np.minimum(y1, y2), x), 0)
+
+DISTANCE_METRICS = {
+    "ks": ks_distance,
+    "wasserstein": wasserstein_distance,
+    "js": js_distance,
+    "overlap": overlap_distance,
+}
+
+def distribution_distance(s1, s2, metric="overlap"):
+    '''
+    Distance between the distributions of two numerical arrays.
+
+    NAs are ignored. The density based metrics (js and overlap) raise
+    a ValueError if either array has fewer than two distinct values.
+
+    Parameters
+    ----------
+    s1, s2 : array-like
+        samples to compare
+    metric : str
+        one of the keys of DISTANCE_METRICS
+
+    Returns
+    -------
+    Distance as a float
+    '''
+
+    if metric not in DISTANCE_METRICS:
+        msg = f"Unknown metric {metric}; choose from {', '.join(DISTANCE_METRICS)}"
+        raise ValueError(msg)
+
+    s1 = np.asarray(s1, dtype="float64")
+    s2 = np.asarray(s2, dtype="float64")
+
+    s1 = s1[~np.isnan(s1)]
+    s2 = s2[~np.isnan(s2)]
+
+    return float(DISTANCE_METRICS[metric](s1, s2))
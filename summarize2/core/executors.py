@@ -0,0 +1,382 @@
+'''
+Executors running the search for the most different permutations.
+
+compare_groups packs the grouped values of both datasets once and hands
+them to an executor, which returns lists of (score, position) tuples
+with the top N permutations of each part of the search for
+compare_groups to merge:
+
+LocalExecutor  - scores in this process, or in a pool of processes
+                 on this machine with the arrays in shared memory
+SocketExecutor - splits the groups between worker processes, possibly
+                 on other machines, that listen on a TCP socket (see
+                 serve and start_local_workers)
+
+Workers of SocketExecutor get only the groups of their partition as
+compact arrays: a JSON header followed by the raw bytes of each array.
+Nothing is unpickled on either side of the socket.
+
+To start a worker on another machine, run:
+python -m summarize2.core.executors --host 0.0.0.0 --port 8765
+
+Workers don't authenticate or encrypt their connections: anyone who
+can reach the port can send work to them and shut them down. Only
+listen on interfaces of a trusted network, or on 127.0.0.1 behind an
+SSH tunnel.
+'''
+
+# Standard library imports
+import argparse
+import json
+import multiprocessing as mp
+import socket
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+# External library imports
+import numpy as np
+
+# Summarize2 imports
+from ..core.mp_distributions import share_arrays, top_scores, get_pool, _pool_scores
+
+#Messages are prefixed by their length as an unsigned 8 byte integer
+LENGTH_PREFIX = struct.Struct("!Q")
+
+#Workers only accept arrays of these types
+ARRAY_DTYPES = ("<f8", "<i8")
+
+#Seconds SocketExecutor waits for a worker to connect or send the next
+#part of its reply before giving up
+REQUEST_TIMEOUT = 600
+
+class LocalExecutor:
+    '''
+    Score the permutations on this machine.
+
+    With a single worker, the search runs in this process; otherwise the
+    packed arrays are put in shared memory and scored in batches by a
+    pool of worker processes (all CPUs if workers is None).
+    '''
+
+    def __init__(self, workers=None, batch_size=None):
+
+        if workers is not None and workers < 1:
+            raise ValueError(f"Number of workers must be at least 1, got {workers}")
+
+        self.workers = mp.cpu_count() if workers is None else workers
+        self.batch_size = batch_size
+
+    def scores(self, keys, arrays, metric, engine, top_n, min_rows):
+        '''
+        Return a list of lists of up to top_n (score, position) tuples
+        '''
+
+        if self.workers == 1:
+            return [top_scores(arrays, metric, engine, 0, len(keys), top_n, min_rows)]
+
+        #workers forked after the arrays are shared would inherit their mappings
+        get_pool(self.workers)
+        blocks, specs = share_arrays(arrays)
+
+        try:
+            return _pool_scores(
+                ("shared", specs), len(keys), metric, self.workers, self.batch_size,
+                engine, top_n, min_rows)
+
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+class SocketExecutor:
+    '''
+    Score the permutations in worker processes listening on TCP sockets.
+
+    Groups are assigned to the workers by a hash of their keys, so
+    the same group always goes to the same worker for a given list of
+    addresses. Each worker returns the top permutations of its
+    partition and the heaps are merged by compare_groups.
+
+    Parameters
+    ----------
+    addresses : list
+        (host, port) tuples or "host:port" strings of running workers
+    timeout : float
+        seconds to wait for a worker to connect or send the next part
+        of its reply; None waits indefinitely
+    '''
+
+    def __init__(self, addresses, timeout=REQUEST_TIMEOUT):
+
+        if not addresses:
+            raise ValueError("SocketExecutor needs at least one worker address")
+
+        self.addresses = [parse_address(address) for address in addresses]
+        self.timeout = timeout
+
+    def scores(self, keys, arrays, metric, engine, top_n, min_rows):
+        '''
+        Return a list of lists of up to top_n (score, position) tuples
+        '''
+
+        partitions = partition_keys(keys, len(self.addresses))
+
+        def score_partition(worker):
+
+            positions = np.flatnonzero(partitions == worker)
+
+            if not len(positions):
+                return []
+
+            header = {
+                "command": "score",
+                "metric": metric,
+                "engine": engine,
+                "top_n": top_n,
+                "min_rows": min_rows,
+            }
+
+            reply = request(
+                self.addresses[worker], header, subset_groups(arrays, positions),
+                self.timeout)
+
+            #Positions in the partition are mapped back to positions in keys
+            return [(score, int(positions[i])) for score, i in reply["scores"]]
+
+        with ThreadPoolExecutor(len(self.addresses)) as threads:
+            return list(threads.map(score_partition, range(len(self.addresses))))
+
+def parse_address(address):
+    '''
+    Return a (host, port) tuple from a tuple or a "host:port" string
+    '''
+
+    if isinstance(address, str):
+        host, _, port = address.rpartition(":")
+        return host, int(port)
+
+    host, port = address
+
+    return host, int(port)
+
+def partition_keys(keys, n_partitions):
+    '''
+    Assign each group key to a partition by a hash that, unlike hash(),
+    is the same in every process and on every machine.
+
+    Returns an array with the partition of each key
+    '''
+
+    return np.array(
+        [zlib.crc32(str(key).encode("utf-8")) % n_partitions for key in keys],
+        dtype=np.int64)
+
+def subset_groups(arrays, positions):
+    '''
+    Repack the arrays from pack_groups to hold only the groups at the
+    given positions, which become groups 0 to len(positions) - 1.
+    '''
+
+    subset = []
+
+    for values, offsets in zip(arrays[::2], arrays[1::2]):
+
+        starts = offsets[positions]
+        counts = offsets[positions + 1] - starts
+
+        index = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+
+        subset.extend([
+            np.ascontiguousarray(values[index], dtype="<f8"),
+            np.concatenate([[0], np.cumsum(counts)]).astype("<i8")])
+
+    return subset
+
+def send_message(sock, payload):
+    '''
+    Send bytes prefixed by their length
+    '''
+
+    sock.sendall(LENGTH_PREFIX.pack(len(payload)))
+    sock.sendall(payload)
+
+def recv_exactly(sock, size):
+    '''
+    Receive exactly size bytes or raise ConnectionError
+    '''
+
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+
+    while received < size:
+
+        n = sock.recv_into(view[received:], size - received)
+
+        if not n:
+            raise ConnectionError("Connection closed in the middle of a message")
+
+        received += n
+
+    return buffer
+
+def recv_message(sock):
+    '''
+    Receive bytes sent by send_message
+    '''
+
+    size, = LENGTH_PREFIX.unpack(recv_exactly(sock, LENGTH_PREFIX.size))
+
+    return recv_exactly(sock, size)
+
+def send_arrays(sock, header, arrays):
+    '''
+    Send a JSON header describing the arrays followed by their raw bytes
+    '''
+
+    header = dict(header, arrays=[(array.dtype.str, array.shape) for array in arrays])
+    send_message(sock, json.dumps(header).encode("utf-8"))
+
+    for array in arrays:
+        send_message(sock, np.ascontiguousarray(array).tobytes())
+
+def recv_arrays(sock):
+    '''
+    Receive a header and arrays sent by send_arrays.
+
+    Returns a tuple of the header and a list of (read-only) arrays
+    '''
+
+    header = json.loads(recv_message(sock))
+    arrays = []
+
+    for dtype, shape in header.get("arrays", []):
+
+        if dtype not in ARRAY_DTYPES:
+            raise ValueError(f"Unsupported array type {dtype}")
+
+        arrays.append(np.frombuffer(recv_message(sock), dtype=dtype).reshape(shape))
+
+    return header, arrays
+
+def request(address, header, arrays=(), timeout=None):
+    '''
+    Send one request to a worker and return its JSON reply.
+
+    Raises RuntimeError if the worker couldn't complete the request
+    or didn't answer within timeout seconds
+    '''
+
+    host, port = address
+
+    try:
+        with socket.create_connection(address, timeout=timeout) as sock:
+
+            send_arrays(sock, header, arrays)
+            reply = json.loads(recv_message(sock))
+
+    except socket.timeout:
+        msg = f"Worker at {host}:{port} didn't answer within {timeout} seconds"
+        raise RuntimeError(msg) from None
+
+    if "error" in reply:
+        raise RuntimeError(f"Worker at {host}:{port} failed: {reply['error']}")
+
+    return reply
+
+def serve(host="127.0.0.1", port=0, on_ready=None):
+    '''
+    Run a worker scoring the permutations sent by SocketExecutor until
+    it receives a shutdown request (see shutdown_worker).
+
+    Requests are handled one at a time; a worker uses a single core,
+    so start one worker per core. on_ready is called with the (host,
+    port) the worker listens on, which is useful with port 0.
+
+    Requests aren't authenticated, so host should only be an address
+    on a trusted network (see the module docstring).
+    '''
+
+    with socket.create_server((host, port)) as server:
+
+        if on_ready is not None:
+            on_ready(server.getsockname()[:2])
+
+        while True:
+
+            conn, _ = server.accept()
+
+            with conn:
+
+                try:
+                    header, arrays = recv_arrays(conn)
+
+                    if header["command"] == "shutdown":
+                        send_message(conn, b"{}")
+                        return
+
+                    result = top_scores(
+                        arrays, header["metric"], header["engine"], 0,
+                        len(arrays[1]) - 1, header["top_n"], header["min_rows"])
+
+                    reply = {"scores": [(float(score), int(i)) for score, i in result]}
+
+                except ConnectionError:
+                    continue
+
+                except Exception as err: # pylint: disable=broad-except
+                    reply = {"error": repr(err)}
+
+                send_message(conn, json.dumps(reply).encode("utf-8"))
+
+def shutdown_worker(address, timeout=None):
+    '''
+    Ask a worker started by serve to stop
+    '''
+
+    request(parse_address(address), {"command": "shutdown"}, timeout=timeout)
+
+def _serve_local(conn):
+    '''
+    Target of the processes started by start_local_workers
+    '''
+
+    serve(on_ready=conn.send)
+
+def start_local_workers(n):
+    '''
+    Start n socket workers on this machine on free ports, to use
+    SocketExecutor without other machines.
+
+    Returns a tuple of the processes and their (host, port) addresses
+    '''
+
+    processes = []
+    addresses = []
+
+    for _ in range(n):
+
+        parent, child = mp.Pipe()
+
+        process = mp.Process(target=_serve_local, args=(child,), daemon=True)
+        process.start()
+
+        processes.append(process)
+        addresses.append(tuple(parent.recv()))
+
+    return processes, addresses
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Summarize2 search worker; connections aren't authenticated, "
+                    "so only listen on a trusted network")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    if args.host not in ("127.0.0.1", "localhost", "::1"):
+        print("WARNING: Anyone who can reach this port can use and stop the worker.")
+
+    serve(args.host, args.port, on_ready=lambda address: print("Listening on %s:%d" % address))
@@ -0,0 +1,157 @@
+'''
+Module writing the comparison in machine-readable formats.
+
+Instead of the HTML report, the summary and a table of per-column
+divergence scores can be saved as JSON or Parquet, for example to fail
+a CI check when a column drifts. Nothing here imports the plotting or
+templating libraries.
+
+Scores in the table (NaN where they don't apply to the column):
+
+ks          - Kolmogorov-Smirnov statistic of continuous columns (0 to 1)
+wasserstein - Wasserstein distance of continuous columns, in their units
+tvd         - total variation distance between the shares of each value
+              of categorical and timeseries columns (0 to 1)
+js          - Jensen-Shannon distance (base 2) between the same shares
+
+In streaming mode, value counts cover the full datasets but continuous
+scores are computed on the row samples.
+'''
+
+# Standard library imports
+import json
+
+# External library imports
+import numpy as np
+import pandas as pd
+
+# Summarize2 imports
+from ..core.distances import ks_distance, wasserstein_distance
+from ..core.helper_funcs import align_frequencies
+
+#Columns of the metrics table
+METRIC_COLUMNS = ["column", "dtype", "ks", "wasserstein", "tvd", "js"]
+
+def share_distances(counts_1, counts_2):
+    '''
+    Total variation and Jensen-Shannon distances between the shares
+    of aligned value counts.
+
+    Returns a tuple of the two distances (NaN if either dataset is empty)
+    '''
+
+    if not counts_1.sum() or not counts_2.sum():
+        return np.nan, np.nan
+
+    p = counts_1 / counts_1.sum()
+    q = counts_2 / counts_2.sum()
+    m = (p + q) / 2
+
+    #zero shares add nothing to the divergence
+    with np.errstate(divide="ignore", invalid="ignore"):
+        kl_p = np.where(p > 0, p * np.log2(p / m), 0).sum()
+        kl_q = np.where(q > 0, q * np.log2(q / m), 0).sum()
+
+    return 0.5 * np.abs(p - q).sum(), np.sqrt(max((kl_p + kl_q) / 2, 0))
+
+def column_metrics(df1, df2, summary, frequencies=None):
+    '''
+    Score how different each common column is between the datasets.
+
+    Pre-computed (freq_1, freq_2) value counts of categorical columns
+    can be passed in frequencies when the full columns aren't loaded.
+
+    Returns a dataframe with a row per column (see METRIC_COLUMNS)
+    '''
+
+    frequencies = frequencies or {}
+    rows = []
+
+    for dtype, columns in summary["Metadata"]["common_columns"].items():
+        for col in columns:
+
+            row = dict.fromkeys(METRIC_COLUMNS, np.nan)
+            row.update(column=col, dtype=dtype)
+
+            if dtype == "Continuous":
+
+                s1 = df1[col].dropna().to_numpy(dtype=np.float64)
+                s2 = df2[col].dropna().to_numpy(dtype=np.float64)
+
+                if len(s1) and len(s2):
+                    row["ks"] = ks_distance(s1, s2)
+                    row["wasserstein"] = wasserstein_distance(s1, s2)
+
+            else:
+
+                _, counts_1, counts_2 = align_frequencies(
+                    df1, df2, col, frequencies.get(col, None))
+                row["tvd"], row["js"] = share_distances(counts_1, counts_2)
+
+            rows.append(row)
+
+    return pd.DataFrame(rows, columns=METRIC_COLUMNS)
+
+def to_builtin(obj):
+    '''
+    Convert NumPy scalars, tuples and NaNs in the summary structure
+    to their JSON equivalents
+    '''
+
+    if isinstance(obj, dict):
+        return {str(k): to_builtin(v) for k, v in obj.items()}
+
+    if isinstance(obj, (list, tuple)):
+        return [to_builtin(x) for x in obj]
+
+    if isinstance(obj, np.generic):
+        obj = obj.item()
+
+    if isinstance(obj, float) and np.isnan(obj):
+        return None
+
+    return obj
+
+def export_comparison(output, output_format, summary, metrics):
+    '''
+    Write the summary and the metrics table to output, a path or a file
+    object (text for JSON, binary for Parquet).
+
+    JSON output is an object with "summary" and "columns" keys, where
+    columns is a list of the metrics table rows. Parquet output is the
+    metrics table with the summary JSON in the schema metadata under
+    the summarize2.summary key.
+    '''
+
+    summary = to_builtin(summary)
+
+    if output_format == "json":
+
+        result = {
+            "summary": summary,
+            "columns": to_builtin(metrics.to_dict(orient="records"))}
+
+        if isinstance(output, (str, bytes)) or hasattr(output, "__fspath__"):
+            with open(output, "w") as f:
+                json.dump(result, f, indent=2)
+        else:
+            json.dump(result, output, indent=2)
+
+    elif output_format == "parquet":
+
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            msg = "Writing Parquet output requires pyarrow: pip install pyarrow"
+            raise ImportError(msg) from None
+
+        table = pyarrow.Table.from_pandas(metrics, preserve_index=False)
+        table = table.replace_schema_metadata({
+            **(table.schema.metadata or {}),
+            b"summarize2.summary": json.dumps(summary).encode("utf-8")})
+
+        pyarrow.parquet.write_table(table, output)
+
+    else:
+        raise ValueError(f"Unknown output format {output_format}")
@@ -0,0 +1,404 @@
+'''
+Module scoring the distribution differences of many groups at once.
+
+Values of both datasets are packed so that each group is a contiguous
+segment (see pack_groups in mp_distributions). Each group gets its own
+grid spanning its values in both datasets, and the groups are binned,
+smoothed and compared as rows of 2D arrays, so there is no Python loop
+over groups. The distances approximate the ones in core.distances:
+
+ks, wasserstein - from the linearly binned empirical CDFs
+js, overlap     - from Gaussian KDEs with the same bandwidth semantics
+                  as BinnedKDE, smoothed in the frequency domain where
+                  every group can have its own bandwidth
+
+distance_bounds gives a cheap first stage for the exact ks and
+wasserstein distances: lower and upper bounds of each group's distance
+from its moments and a quantile sketch, so that only the groups that
+could still make it into the top N need the exact comparison.
+'''
+
+# External library imports
+import numpy as np
+
+#Number of grid points of each group
+GRID_SIZE = 512
+
+#Upper limit on the number of cells of the 2D arrays built at once
+MAX_CELLS = 2 ** 22
+
+#Minimum number of rows (NAs included) of a group in both datasets
+MIN_ROWS = 10
+
+#Number of quantile intervals of the sketches used for the bounds
+SKETCH_SIZE = 32
+
+METRICS = ("ks", "wasserstein", "js", "overlap")
+
+def segment_ids(counts):
+    '''
+    Row number of every value for segments with the given lengths
+    '''
+
+    return np.repeat(np.arange(len(counts)), counts)
+
+def gather_segments(values, offsets, groups):
+    '''
+    Concatenate the segments of the selected groups.
+
+    Returns a tuple of the values and the (0-based) position of each
+    value's group in groups
+    '''
+
+    starts = offsets[groups]
+    counts = offsets[groups + 1] - starts
+
+    #index of each value: its segment's start plus its place in the segment
+    rows = segment_ids(counts)
+    first = np.cumsum(counts) - counts
+    index = starts[rows] + np.arange(counts.sum()) - first[rows]
+
+    return values[index], rows
+
+def segment_moments(values, rows, n_rows):
+    '''
+    Count, mean, ddof=1 standard deviation, min and max of the
+    non-NA values of each row. Rows without values get NaNs.
+    '''
+
+    count = np.bincount(rows, minlength=n_rows)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+
+        mean = np.bincount(rows, weights=values, minlength=n_rows) / count
+        squares = np.bincount(
+            rows, weights=(values - mean[rows]) ** 2, minlength=n_rows)
+        std = np.sqrt(squares / (count - 1))
+
+    #values are grouped by row, so min and max are reductions over segments
+    starts = np.minimum(np.cumsum(count) - count, max(len(values) - 1, 0))
+    has_values = count > 0
+
+    minimum = np.full(n_rows, np.nan)
+    maximum = np.full(n_rows, np.nan)
+
+    if len(values):
+        minimum[has_values] = np.minimum.reduceat(values, starts)[has_values]
+        maximum[has_values] = np.maximum.reduceat(values, starts)[has_values]
+
+    return count, mean, std, minimum, maximum
+
+def binned_rows(values, rows, low, width, n_rows, grid_size):
+    '''
+    Linearly bin the values of each row onto that row's grid.
+
+    Returns a (rows x grid_size) array of bin weights
+    '''
+
+    position = (values - low[rows]) / width[rows]
+    left = np.clip(np.floor(position).astype(np.int64), 0, grid_size - 2)
+    right_weight = np.clip(position - left, 0, 1)
+
+    cell = rows * grid_size + left
+    size = n_rows * grid_size
+
+    weights = (
+        np.bincount(cell, weights=1 - right_weight, minlength=size) +
+        np.bincount(cell + 1, weights=right_weight, minlength=size))
+
+    return weights.reshape(n_rows, grid_size)
+
+def smoothed_rows(weights, bandwidth_bins):
+    '''
+    Convolve each row of bin weights with a Gaussian kernel of that row's
+    bandwidth (in bins) using FFT and normalise the rows to sum to 1.
+
+    Rows are zero padded to twice the grid so that kernel tails don't
+    wrap around; a bandwidth factor of 0.1 keeps the kernel well within
+    the padding.
+    '''
+
+    grid_size = weights.shape[1]
+    fft_size = 1 << int(np.ceil(np.log2(2 * grid_size)))
+
+    #Fourier transform of a Gaussian is a Gaussian
+    frequencies = np.fft.rfftfreq(fft_size)
+    kernels = np.exp(-2 * (np.pi * bandwidth_bins[:, None] * frequencies) ** 2)
+
+    density = np.fft.irfft(
+        np.fft.rfft(weights, fft_size, axis=1) * kernels, fft_size, axis=1)
+    density = np.maximum(density[:, :grid_size], 0)
+
+    return density / density.sum(axis=1, keepdims=True)
+
+def _score_rows(metric, samples, n_rows, grid_size, bw_method):
+    '''
+    Score the n_rows groups of a chunk given the gathered values and
+    rows of both datasets
+    '''
+
+    (values1, rows1), (values2, rows2) = samples
+
+    count1, _, std1, min1, max1 = segment_moments(values1, rows1, n_rows)
+    count2, _, std2, min2, max2 = segment_moments(values2, rows2, n_rows)
+
+    low = np.fmin(min1, min2)
+    width = (np.fmax(max1, max2) - low) / (grid_size - 1)
+
+    #groups with a single value in both datasets are binned into one cell
+    width = np.where(width > 0, width, 1)
+
+    weights1 = binned_rows(values1, rows1, low, width, n_rows, grid_size)
+    weights2 = binned_rows(values2, rows2, low, width, n_rows, grid_size)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+
+        if metric in ("ks", "wasserstein"):
+
+            gaps = np.abs(
+                np.cumsum(weights1, axis=1) / count1[:, None] -
+                np.cumsum(weights2, axis=1) / count2[:, None])
+
+            if metric == "ks":
+                scores = gaps.max(axis=1)
+            else:
+                scores = gaps[:, :-1].sum(axis=1) * width
+
+            return np.where((count1 > 0) & (count2 > 0), scores, np.nan)
+
+        p1 = smoothed_rows(weights1, bw_method * std1 / width)
+        p2 = smoothed_rows(weights2, bw_method * std2 / width)
+
+        if metric == "overlap":
+            scores = np.maximum(1 - np.minimum(p1, p2).sum(axis=1), 0)
+
+        else:
+            mixture = (p1 + p2) / 2
+
+            def kl_divergence(p):
+                #0 * log(0) is taken to be 0
+                ratio = np.divide(p, mixture, out=np.ones_like(p), where=p > 0)
+                return (p * np.log2(ratio)).sum(axis=1)
+
+            divergence = (kl_divergence(p1) + kl_divergence(p2)) / 2
+            scores = np.sqrt(np.maximum(divergence, 0))
+
+    #like BinnedKDE, densities need at least two distinct values
+    has_density = (count1 > 1) & (count2 > 1) & (std1 > 0) & (std2 > 0)
+
+    return np.where(has_density, scores, np.nan)
+
+def _eligible_groups(values1, offsets1, values2, offsets2, groups, min_rows):
+    '''
+    Positions (in groups) of the groups with at least min_rows rows in
+    both datasets and sums that aren't zero; sums are NaN if a group
+    has NAs which, as in the per-group scoring, doesn't rule it out
+    '''
+
+    checks = []
+
+    for values, offsets in ((values1, offsets1), (values2, offsets2)):
+
+        group_counts = np.diff(offsets)
+        sums = np.bincount(
+            segment_ids(group_counts), weights=values, minlength=len(group_counts))
+
+        checks.append((group_counts[groups] >= min_rows) & (sums[groups] != 0))
+
+    return np.flatnonzero(checks[0] & checks[1])
+
+def _chunks(values1, offsets1, values2, offsets2, groups, eligible):
+    '''
+    Yield the eligible positions in chunks, with the non-NA values and
+    rows of the chunk's groups gathered from both datasets
+    '''
+
+    #the FFT arrays are twice the width of the grid
+    chunk_size = max(1, MAX_CELLS // (2 * GRID_SIZE))
+
+    for start in range(0, len(eligible), chunk_size):
+
+        chunk = eligible[start:start + chunk_size]
+        samples = []
+
+        for values, offsets in ((values1, offsets1), (values2, offsets2)):
+            chunk_values, rows = gather_segments(values, offsets, groups[chunk])
+            not_na = ~np.isnan(chunk_values)
+            samples.append((chunk_values[not_na], rows[not_na]))
+
+        yield chunk, samples
+
+def group_distances(values1, offsets1, values2, offsets2, metric="overlap",
+                    groups=None, min_rows=MIN_ROWS, grid_size=GRID_SIZE, bw_method=0.1):
+    '''
+    Distances between the two datasets' distributions of every group.
+
+    Groups are scored if they have at least min_rows rows (NAs included)
+    in both datasets and their sums aren't zero, the same rules as the
+    per-group scoring in mp_distributions.
+
+    Parameters
+    ----------
+    values1, offsets1, values2, offsets2 : np.array
+        packed values of both datasets, where the values of group i are
+        values[offsets[i]:offsets[i + 1]]
+    metric : str
+        "ks", "wasserstein", "js" or "overlap"
+    groups : np.array
+        positions of the groups to score; all groups if None
+
+    Returns
+    -------
+    Array of distances for groups, with NaN for groups that weren't scored
+    '''
+
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric {metric}")
+
+    if groups is None:
+        groups = np.arange(len(offsets1) - 1)
+
+    groups = np.asarray(groups, dtype=np.int64)
+    scores = np.full(len(groups), np.nan)
+
+    eligible = _eligible_groups(values1, offsets1, values2, offsets2, groups, min_rows)
+
+    for chunk, samples in _chunks(values1, offsets1, values2, offsets2, groups, eligible):
+        scores[chunk] = _score_rows(metric, samples, len(chunk), grid_size, bw_method)
+
+    return scores
+
+def quantile_sketches(values, rows, n_rows, sketch_size=SKETCH_SIZE):
+    '''
+    Order statistics of each row at ranks max(1, ceil(j * n / k)) for
+    j = 0..k, where k is sketch_size: the minimum, the maximum and k - 1
+    quantiles in between. Every quantile Q(u) with u in (j / k, (j + 1) / k]
+    lies between the j-th and (j + 1)-th values of the sketch.
+
+    Returns a (rows x k + 1) array; rows without values are NaN
+    '''
+
+    count = np.bincount(rows, minlength=n_rows)
+    order = np.lexsort((values, rows))
+    ordered = np.append(values[order], np.nan)
+
+    levels = np.arange(sketch_size + 1)
+    ranks = np.maximum(1, (levels * count[:, None] + sketch_size - 1) // sketch_size)
+
+    #rows without values point at the NaN appended at the end
+    starts = np.cumsum(count) - count
+    index = np.where(count[:, None] > 0, starts[:, None] + ranks - 1, len(values))
+
+    return ordered[index]
+
+def _ks_bounds(sketch1, sketch2):
+    '''
+    Bounds of the KS distance from two quantile sketches.
+
+    If the j-th sketch value is at most x, the empirical CDF at x is at
+    least j / k; if it's more than x, the CDF is less than j / k. Both
+    bounds are steps that only change at sketch values, so evaluating
+    them at all values of both sketches gives the bounds of the largest
+    gap between the CDFs.
+    '''
+
+    sketch_size = sketch1.shape[1] - 1
+    points = np.concatenate([sketch1, sketch2], axis=1)[:, :, None]
+
+    cdf_bounds = []
+
+    for sketch in (sketch1, sketch2):
+        at_or_below = (sketch[:, None, :] <= points).sum(axis=2)
+        cdf_bounds.append((
+            np.maximum(at_or_below - 1, 0) / sketch_size,
+            np.minimum(at_or_below / sketch_size, 1)))
+
+    (low1, high1), (low2, high2) = cdf_bounds
+
+    lower = np.maximum(low1 - high2, low2 - high1).max(axis=1)
+    upper = np.maximum(high1 - low2, high2 - low1).max(axis=1)
+
+    return np.maximum(lower, 0), upper
+
+def _wasserstein_bounds(sketch1, sketch2, mean1, mean2):
+    '''
+    Bounds of the Wasserstein distance, the integral of |Q1(u) - Q2(u)|
+    over the quantile levels u, from two quantile sketches: within each
+    interval of levels both quantiles are between neighbouring sketch
+    values. The difference of the means is another lower bound.
+    '''
+
+    sketch_size = sketch1.shape[1] - 1
+
+    lower = np.maximum(
+        sketch1[:, :-1] - sketch2[:, 1:], sketch2[:, :-1] - sketch1[:, 1:])
+    upper = np.maximum(
+        sketch1[:, 1:] - sketch2[:, :-1], sketch2[:, 1:] - sketch1[:, :-1])
+
+    lower = np.maximum(lower, 0).sum(axis=1) / sketch_size
+    upper = np.maximum(upper, 0).sum(axis=1) / sketch_size
+
+    return np.maximum(lower, np.abs(mean1 - mean2)), upper
+
+def distance_bounds(values1, offsets1, values2, offsets2, metric="overlap",
+                    groups=None, min_rows=MIN_ROWS, sketch_size=SKETCH_SIZE):
+    '''
+    Lower and upper bounds of the exact distances (see core.distances)
+    between the two datasets' distributions of every group.
+
+    Bounds of ks and wasserstein are derived from the moments and
+    quantile sketches of each group. js and overlap have no useful
+    bounds from moments alone and the grid estimates of group_distances
+    aren't guaranteed to be within any margin of the exact distances,
+    so their bounds are the full range of 0 to 1.
+
+    Parameters are the same as for group_distances
+
+    Returns
+    -------
+    Tuple of lower and upper bounds for groups, with NaN for groups
+    that can't be scored: groups that group_distances skips and groups
+    without any non-NA values
+    '''
+
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric {metric}")
+
+    if groups is None:
+        groups = np.arange(len(offsets1) - 1)
+
+    groups = np.asarray(groups, dtype=np.int64)
+
+    if metric in ("js", "overlap"):
+
+        scored = ~np.isnan(group_distances(
+            values1, offsets1, values2, offsets2, metric, groups, min_rows))
+
+        return np.where(scored, 0.0, np.nan), np.where(scored, 1.0, np.nan)
+
+    lower = np.full(len(groups), np.nan)
+    upper = np.full(len(groups), np.nan)
+
+    eligible = _eligible_groups(values1, offsets1, values2, offsets2, groups, min_rows)
+
+    for chunk, samples in _chunks(values1, offsets1, values2, offsets2, groups, eligible):
+
+        n_rows = len(chunk)
+        moments = []
+        sketches = []
+
+        for values, rows in samples:
+            moments.append(segment_moments(values, rows, n_rows))
+            sketches.append(quantile_sketches(values, rows, n_rows, sketch_size))
+
+        if metric == "ks":
+            bounds = _ks_bounds(*sketches)
+        else:
+            bounds = _wasserstein_bounds(*sketches, moments[0][1], moments[1][1])
+
+        scored = (moments[0][0] > 0) & (moments[1][0] > 0)
+
+        lower[chunk] = np.where(scored, bounds[0], np.nan)
+        upper[chunk] = np.where(scored, bounds[1], np.nan)
+
+    return lower, upper
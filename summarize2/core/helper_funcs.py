@@ -3,9 +3,10 @@ Module with various functions to keep the rest of the code clean
 '''
 
 # Standard library imports
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import contextmanager
 import os.path
-from os.path import abspath, dirname, join, exists
+from os.path import abspath, dirname, join
 import sys
 import subprocess
 import tempfile
@@ -15,9 +16,16 @@ import textwrap
 # External library imports
 import numpy as np
 import pandas as pd
-from pandas.api.types import is_numeric_dtype, is_datetime64_dtype
+from pandas.api.types import (
+    is_numeric_dtype, is_datetime64_dtype, is_integer_dtype, is_categorical_dtype)
 import yaml
 
+# Summarize2 imports
+from ..core.columnar import read_columnar, read_columnar_chunks, read_columnar_headers
+from ..core.options import (
+    FILTER_OPERATORS, MAX_DIFF_CATEGORIES, columnar_format, file_format,
+    path_checker, filter_checker)
+
 def convert_dtypes(dtype):
     '''
     Rename pandas default dtypes for readability
@@ -44,6 +52,10 @@ def launch_temp_file(file_type, **kwargs):
 
     type == xtab:
         "common_cols" = columns shared between two DFs
+
+    type == ridge:
+        "common_cols" = non-numerical columns shared between two DFs
+        "num_cols" = numerical columns shared between two DFs
     '''
 
     if file_type == 'dtypes':
@@ -67,6 +79,7 @@ def launch_temp_file(file_type, **kwargs):
             #Valid column names are:
             #%s
             #The crosstab aggregation counts the rows for each x-y combination.
+            #Crosstabs with more cells than raster_threshold are drawn as a heatmap.
             #------------------------------------------------------------------        
         ''' % (', '.join(map(str, kwargs['common_cols']))))
         
@@ -82,12 +95,51 @@ def launch_temp_file(file_type, **kwargs):
                         "y_labels_visible": True,
                         "x_labels_visible": True,
                         "column_sort": False,
-                        "colour_preset": "default"
+                        "colour_preset": "default",
+                        "raster_threshold": 2500
                     }
             }
         )
         temp_name = "xtab.yml"
 
+    if file_type == "ridge":
+
+        comments = textwrap.dedent('''\
+            #-----------------------------------------------------------------
+            #Please choose the columns to slice the data by and a numerical
+            #column whose distributions are compared between the slices.
+            #Valid slice columns are:
+            #%s
+            #Valid numerical columns are:
+            #%s
+            #Metric is one of ks, wasserstein, js, overlap or pixels.
+            #To search on other machines, list host:port addresses of
+            #running workers (python -m summarize2.core.executors) and
+            #the seconds to wait for their answers as timeout.
+            #------------------------------------------------------------------
+        ''' % (
+            ', '.join(map(str, kwargs['common_cols'])),
+            ', '.join(map(str, kwargs['num_cols']))))
+
+        yaml_str = yaml.safe_dump(
+            {
+                "columns":
+                    {
+                        "slice_columns":[],
+                        "numerical_column": None
+                    },
+                "options":
+                    {
+                        "metric": "overlap",
+                        "top_n": 5,
+                        "min_rows": 10,
+                        "remote_workers": [],
+                        "timeout": 600
+                    }
+            }
+        )
+        temp_name = "ridge.yml"
+
     with tempfile.TemporaryDirectory() as td:
         f_name = join(td, temp_name)
         with open(f_name, 'w') as f:
@@ -114,6 +166,35 @@ def launch_temp_file(file_type, **kwargs):
             output = yaml.safe_load(f)
             return output
 
+@contextmanager
+def replaced_on_success(file_path):
+    '''
+    Open a temporary text file next to file_path to write into and
+    rename it to file_path once the block finishes without errors.
+
+    An existing file at file_path is left as it was if writing fails.
+    '''
+
+    f = tempfile.NamedTemporaryFile(
+        "w", dir=dirname(abspath(file_path)), prefix=".summarize2-",
+        suffix=os.path.splitext(file_path)[1], delete=False)
+
+    try:
+        with f:
+            yield f
+
+        #temporary files are only readable by their owner
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(f.name, 0o666 & ~umask)
+
+        os.replace(f.name, file_path)
+
+    except BaseException:
+        if os.path.exists(f.name):
+            os.remove(f.name)
+        raise
+
 def open_report_in_default_browser(file_path):
     '''
     Use platform-specific process to launch the report in the default
@@ -127,16 +208,54 @@ def open_report_in_default_browser(file_path):
     else:
         subprocess.call(["xdg-open", file_path])
 
-def path_checker(string):
+def filter_mask(column, op, value):
     '''
-    Improves error message for user if wrong path entered.
-    Returns Path object.
+    Boolean array of the rows of column matching a row filter.
+
+    Columns read as categories (see projected_read_kwargs) are compared
+    through their categories, which Pandas parses as strings, so that
+    range filters work and numbers compare as numbers like in a column
+    that wasn't read as categories. NAs never match.
     '''
 
-    if not exists(string):
-        msg = "Can't find specified file"
-        raise FileNotFoundError(msg)
-    return Path(string)
+    if is_categorical_dtype(column):
+
+        categories = column.cat.categories
+
+        if isinstance(value, (int, float)) and not is_numeric_dtype(categories):
+            categories = pd.to_numeric(categories, errors="coerce")
+
+        matches = FILTER_OPERATORS[op](categories.to_numpy(), value) & categories.notna()
+
+        #NAs have code -1, which picks the appended False
+        return np.append(matches, False)[column.cat.codes.to_numpy()]
+
+    return (FILTER_OPERATORS[op](column, value) & column.notna()).to_numpy()
+
+def select_rows(df, filters=None, sample=None, seed=0):
+    '''
+    Apply row filters and sampling to a dataframe read by Pandas.
+
+    Columnar files have both pushed down to the reader instead. Like
+    there, rows where the filtered column is NA never match.
+    '''
+
+    if filters:
+
+        mask = np.ones(len(df), dtype=bool)
+
+        for col, op, value in filters:
+            mask &= filter_mask(df[col], op, value)
+
+        df = df[mask]
+
+    if sample is not None:
+        df = df.sample(frac=sample, random_state=seed).sort_index()
+
+    if filters or sample is not None:
+        df = df.reset_index(drop=True)
+
+    return df
 
 def package_dir(*args):
     '''
@@ -153,65 +272,441 @@ def package_dir(*args):
 
     return abspath(join(dirname(__file__), "..", *args))
 
-def transform_frequencies(df1, df2, col_name):
+def align_frequencies(df1, df2, col_name, frequencies=None):
     '''
-    Adds zero frequency to a column that is present in one DF, but missing from another.
+    Value counts of a column in both datasets, aligned on their values
+    with a single outer join.
+
+    When datasets are read in chunks, the full columns are not available
+    so the accumulated value counts are passed in as a (freq_1, freq_2) tuple.
+
+    NAs of any kind are a single value, np.nan, with zero counts in both
+    datasets: plots show that the column has NAs while their counts are
+    in the summary table. Categories that occur in neither dataset are
+    left out.
+
+    Returns a tuple of an object array of values and two int64 arrays
+    with the counts of each value in the two datasets
     '''
 
-    freq_1 = df1[col_name].value_counts()
-    freq_2 = df2[col_name].value_counts()
+    if frequencies is None:
+        frequencies = (
+            df1[col_name].value_counts(dropna=False),
+            df2[col_name].value_counts(dropna=False))
 
-    all_cols = set(list(df1[col_name].unique()) + list(df2[col_name].unique()))
+    #Categorical indices are joined on their values rather than categories
+    counts = [
+        pd.Series(freq.to_numpy(dtype="int64"), index=np.asarray(freq.index, dtype=object))
+        for freq in frequencies]
 
-    new_freq_1 = []
-    new_freq_2 = []
+    joined = pd.concat(counts, axis=1, join="outer", sort=False).fillna(0)
 
-    for col in all_cols:
-        if col in freq_1:
-            new_freq_1.append([col, freq_1[col]])
-        else:
-            new_freq_1.append([col, 0])
-        
-        if col in freq_2:
-            new_freq_2.append([col, freq_2[col]])
-        else:
-            new_freq_2.append([col, 0])
+    values = joined.index.to_numpy(dtype=object)
+    counts_1 = joined.iloc[:, 0].to_numpy(dtype="int64")
+    counts_2 = joined.iloc[:, 1].to_numpy(dtype="int64")
 
-    bar_1 = np.array(new_freq_1, dtype=object).T
-    bar_2 = np.array(new_freq_2, dtype=object).T
+    is_na = pd.isna(values)
+    keep = ~is_na & ((counts_1 > 0) | (counts_2 > 0))
+
+    values = values[keep]
+    counts_1 = counts_1[keep]
+    counts_2 = counts_2[keep]
+
+    if is_na.any():
+        values = np.append(values, np.array([np.nan], dtype=object))
+        counts_1 = np.append(counts_1, 0)
+        counts_2 = np.append(counts_2, 0)
+
+    return values, counts_1, counts_2
+
+def transform_frequencies(df1, df2, col_name, frequencies=None):
+    '''
+    Adds zero frequency to a column that is present in one DF, but missing from another.
+
+    Returns a tuple of two object arrays, each with a row of values and
+    a row of counts; see align_frequencies for the typed version.
+    '''
+
+    values, counts_1, counts_2 = align_frequencies(df1, df2, col_name, frequencies)
+
+    bar_1 = np.array([values, counts_1.astype(object)], dtype=object)
+    bar_2 = np.array([values, counts_2.astype(object)], dtype=object)
 
     return (bar_1, bar_2)
 
-def read_data(data_path_1, data_path_2):
+def top_categories(values, counts_1, counts_2, max_categories):
+    '''
+    Reduce the aligned frequencies from align_frequencies to at most
+    max_categories values.
+
+    If there are more values than that, the max_categories - 1 values
+    whose share of rows differs the most between the two datasets are
+    kept and the rest are summed into a single "Other (N values)" value.
+
+    Returns a tuple of values and counts like align_frequencies
+    '''
+
+    if max_categories is not None and max_categories < 1:
+        msg = f"max_categories must be at least 1, got {max_categories}"
+        raise ValueError(msg)
+
+    if max_categories is None or len(values) <= max_categories:
+        return values, counts_1, counts_2
+
+    divergence = np.abs(
+        counts_2 / max(counts_2.sum(), 1) - counts_1 / max(counts_1.sum(), 1))
+
+    #ties are broken by the value's name so that the selection is repeatable
+    names = np.array([str(x) for x in values])
+    order = np.lexsort((names, -divergence))
+
+    top = np.sort(order[:max_categories - 1])
+    rest = order[max_categories - 1:]
+
+    values = np.append(values[top], np.array([f"Other ({len(rest)} values)"], dtype=object))
+
+    return (
+        values,
+        np.append(counts_1[top], counts_1[rest].sum()),
+        np.append(counts_2[top], counts_2[rest].sum()))
+
+def crosstab_cells(df1, df2, x_axis, y_axis):
+    '''
+    Counts of the combinations of x and y axis values in both datasets,
+    for the crosstab plot.
+
+    Values of each axis column are coded as integers over both datasets
+    and the codes of each axis are combined into a single joint key, so
+    only the cells that occur in the data are counted, with one
+    value_counts per dataset. Memory scales with the number of non-empty
+    cells rather than with the number of x values times y values.
+    Neither dataframe is changed.
+
+    Rows with NAs in any axis column are left out. Cells are kept if
+    their x and y values are in both datasets and at least one dataset
+    has rows in them. Values of axes with several columns are joined
+    with " - " and ordered as strings; single columns keep their order.
+
+    Returns a tuple of:
+        cells: dataframe with the x and y labels (in columns named after
+            the axes), counts in each dataset (o and s) and the angle of
+            the second dataset's share, ordered by x and then by y
+        x_labels: labels of all x values of the first dataset, in order
+        n_y: number of y values of the first dataset
+    '''
+
+    n1 = len(df1)
+    axis_ranks = []
+    axis_labels = []
+
+    for axis in (x_axis, y_axis):
+
+        #joint key of the axis columns with the codes of each column as digits
+        key = np.zeros(n1 + len(df2), dtype=np.int64)
+        valid = np.ones(n1 + len(df2), dtype=bool)
+        uniques = []
+
+        for col in axis:
+
+            codes, col_uniques = pd.factorize(
+                pd.concat([df1[col], df2[col]], ignore_index=True), sort=True)
+
+            key = key * len(col_uniques) + codes
+            valid &= codes >= 0
+            uniques.append(col_uniques)
+
+        keys, inverse = np.unique(key[valid], return_inverse=True)
+
+        #decode each joint key back into the values of the axis columns
+        labels = []
+        digits = keys.copy()
+
+        for col_uniques in reversed(uniques):
+            labels.append(np.asarray(col_uniques, dtype=object)[digits % len(col_uniques)])
+            digits //= len(col_uniques)
+
+        labels = np.array(
+            [" - ".join(map(str, values)) for values in zip(*reversed(labels))], dtype=object)
+
+        #joined labels are ordered as strings, like the concatenated columns they replace
+        order = np.argsort(labels, kind="stable") if len(axis) > 1 else np.arange(len(labels))
+        rank_of = np.empty(len(order), dtype=np.int64)
+        rank_of[order] = np.arange(len(order))
+
+        ranks = np.full(len(key), -1, dtype=np.int64)
+        ranks[valid] = rank_of[inverse]
+
+        axis_ranks.append(ranks)
+        axis_labels.append(labels[order])
+
+    (x_ranks, y_ranks), (x_labels, y_labels) = axis_ranks, axis_labels
+    n_y = len(y_labels)
+
+    counts = []
+    observed = []
+
+    for rows in (slice(None, n1), slice(n1, None)):
+
+        in_xtab = (x_ranks[rows] >= 0) & (y_ranks[rows] >= 0)
+        cell = x_ranks[rows][in_xtab] * n_y + y_ranks[rows][in_xtab]
+
+        counts.append(pd.Series(cell).value_counts(sort=False))
+        observed.append((np.unique(x_ranks[rows][in_xtab]), np.unique(y_ranks[rows][in_xtab])))
+
+    joined = pd.concat(counts, axis=1).fillna(0).astype("int64").sort_index()
+
+    cell = joined.index.to_numpy()
+    x = cell // max(n_y, 1)
+    y = cell % max(n_y, 1)
+
+    (x_1, y_1), (x_2, y_2) = observed
+    keep = np.isin(x, np.intersect1d(x_1, x_2)) & np.isin(y, np.intersect1d(y_1, y_2))
+
+    o = joined.iloc[:, 0].to_numpy()[keep]
+    s = joined.iloc[:, 1].to_numpy()[keep]
+
+    cells = pd.DataFrame({
+        '-'.join(x_axis): x_labels[x[keep]].astype(str),
+        '-'.join(y_axis): y_labels[y[keep]].astype(str),
+        'o': o,
+        's': s,
+        #% of total times 360 + 90 because Bokeh starts angle from horizontal
+        'angle_s': s / (o + s) * 360 + 90,
+    })
+
+    return cells, [str(x) for x in x_labels[x_1]], len(y_1)
+
+def read_headers(data_path):
+    '''
+    Read only the column names of a dataset, without parsing any rows.
+
+    Returns a list
+    '''
+
+    if columnar_format(data_path) is not None:
+
+        return read_columnar_headers(data_path)
+
+    if file_format(data_path) == "csv":
+
+        return pd.read_csv(data_path, nrows=0).columns.tolist()
+
+    if file_format(data_path) == "excel":
+
+        return pd.read_excel(data_path, nrows=0).columns.tolist()
+
+    msg = f"Unsupported file type: {os.path.basename(data_path)}"
+    raise ValueError(msg)
+
+def parse_file(data_path, **kwargs):
+    '''
+    Parse a single .csv, Excel or columnar file into a dataframe.
+
+    Kept at module level so that it can be sent to a worker process.
+    Row filters and sample fraction are popped from kwargs; any other
+    kwargs (like nrows or usecols) are passed to the reader.
+    '''
+
+    filters = kwargs.pop("filters", None)
+    sample = kwargs.pop("sample", None)
+
+    if columnar_format(data_path) is not None:
+
+        return read_columnar(data_path, filters=filters, sample=sample, **kwargs)
+
+    if file_format(data_path) == "csv":
+
+        df = pd.read_csv(data_path, **kwargs)
+
+    elif file_format(data_path) == "excel":
+
+        df = pd.read_excel(data_path, **kwargs)
+
+    else:
+        msg = f"Unsupported file type: {os.path.basename(data_path)}"
+        raise ValueError(msg)
+
+    return select_rows(df, filters, sample)
+
+def add_metadata(df, data_path, **kwargs):
+    '''
+    Save the file name in the _metadata of the dataframe.
+
+    If only some of the columns were loaded, the full list of column names
+    is saved as well so that the report can still show them.
+    '''
+
+    df._metadata = {"file_name":os.path.basename(data_path)}
+
+    if kwargs.get("usecols", None) is not None:
+        df._metadata["columns"] = read_headers(data_path)
+
+    return df
+
+def read_dataset(data_path, **kwargs):
+    '''
+    Read a single dataset file into a dataframe with _metadata.
+    '''
+
+    return add_metadata(parse_file(data_path, **kwargs), data_path, **kwargs)
+
+def read_data(data_path_1, data_path_2, cache=None, **kwargs):
     '''
-    Currently, only .csv and Excel files are supported.
-    Possible to bring more, as long as they integrate into Pandas
+    Currently, .csv, Excel, Parquet and Arrow IPC (Feather) files
+    are supported. Possible to bring more, as long as they integrate
+    into Pandas
 
     Filename is written into _metadata attribute of each dataframe.
     Watch out for version updates as work is underway to change
     how metadata is stored and propagated in dataframes
+
+    Both datasets are read at the same time. The C parser for .csv files
+    releases the GIL so a thread is enough, but Excel parsing is pure
+    Python so Excel files are parsed in a separate process and pickled
+    back. Start and end times of each read (in seconds from the start
+    of the function) are saved in _metadata as load_time.
+
+    If cache (a DatasetCache) is given, parsed dataframes are loaded from
+    and saved to it; reads of only the first few rows are never cached.
+    Neither are columnar files which are already quick to read and
+    would have to be hashed in full, defeating the pushed down filters.
+
+    Any kwargs (like nrows) are passed to the reader functions.
     '''
 
-    #Read the first dataset
-    if os.path.splitext(data_path_1)[1] == ".csv":
+    start = time.perf_counter()
+
+    excel_paths = [
+        path for path in (data_path_1, data_path_2)
+        if file_format(path) == "excel"]
+
+    process_pool = ProcessPoolExecutor(len(excel_paths)) if excel_paths else None
+
+    def timed_read(data_path):
 
-        df1 = pd.read_csv(data_path_1)
-        df1._metadata = {"file_name":os.path.basename(data_path_1)}
+        began = time.perf_counter()
 
-    elif os.path.splitext(data_path_1)[1] in [".xlsx", ".xls"]:
+        key = None
+        df = None
 
-        df1 = pd.read_excel(data_path_1)
-        df1._metadata = {"file_name":os.path.basename(data_path_1)}
+        if (cache is not None and "nrows" not in kwargs
+                and columnar_format(data_path) is None):
+            key = cache.key(data_path, **kwargs)
+            df = cache.get(key)
 
-    #Read the second dataset
-    if os.path.splitext(data_path_2)[1] == ".csv":
+        cached = df is not None
 
-        df2 = pd.read_csv(data_path_2)
-        df2._metadata = {"file_name":os.path.basename(data_path_2)}
+        if not cached:
 
-    elif os.path.splitext(data_path_2)[1] in [".xlsx", ".xls"]:
+            if data_path in excel_paths:
+                df = process_pool.submit(parse_file, data_path, **kwargs).result()
+            else:
+                df = parse_file(data_path, **kwargs)
 
-        df2 = pd.read_excel(data_path_2)
-        df2._metadata = {"file_name":os.path.basename(data_path_2)}
+            if key is not None:
+                cache.put(key, df)
+
+        df = add_metadata(df, data_path, **kwargs)
+        df._metadata["load_time"] = (began - start, time.perf_counter() - start)
+        df._metadata["cached"] = cached
+
+        return df
+
+    try:
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            df1, df2 = pool.map(timed_read, (data_path_1, data_path_2))
+    finally:
+        if process_pool is not None:
+            process_pool.shutdown()
 
     return df1, df2
+
+def dataset_columns(df):
+    '''
+    Return all column names of the file the dataframe was read from,
+    including any columns that were not loaded.
+    '''
+
+    if isinstance(df._metadata, dict) and "columns" in df._metadata:
+        return df._metadata["columns"]
+
+    return list(df.columns.values)
+
+def projected_read_kwargs(common_columns, user_dtypes):
+    '''
+    Build reader kwargs that load only the columns shared between
+    the two datasets, with non-numerical columns read as categories.
+
+    Continuous columns are left for the parser to infer because forcing
+    a float dtype would turn integer columns into floats in the report.
+    '''
+
+    dtypes = {
+        col: "category" for col in common_columns
+        if user_dtypes[col] != "Continuous"}
+
+    return {"usecols": common_columns, "dtype": dtypes}
+
+def downcast_numerics(df, user_dtypes):
+    '''
+    Downcast integer Continuous columns to the smallest integer type.
+
+    Float columns are kept as float64; Pandas accumulates float32 sums
+    in float32 which would change the means shown in the report.
+    '''
+
+    for col in df.columns:
+        if user_dtypes.get(col, None) == "Continuous" and is_integer_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], downcast="integer")
+
+    return df
+
+def read_data_chunks(data_path, chunksize, **kwargs):
+    '''
+    Return an iterator of dataframes with at most chunksize rows each.
+
+    Pandas can only read .csv files lazily; Excel files are read in full
+    and then sliced so that the rest of the pipeline can treat all
+    formats the same way. Columnar files are read a row group or record
+    batch at a time. Any kwargs are passed to the reader.
+    '''
+
+    if columnar_format(data_path) is not None:
+
+        return read_columnar_chunks(data_path, chunksize, **kwargs)
+
+    if file_format(data_path) == "csv":
+
+        filters = kwargs.pop("filters", None)
+        sample = kwargs.pop("sample", None)
+
+        chunks = pd.read_csv(data_path, chunksize=chunksize, **kwargs)
+
+        if not filters and sample is None:
+            return chunks
+
+        return (
+            select_rows(chunk, filters, sample, seed=i)
+            for i, chunk in enumerate(chunks))
+
+    if file_format(data_path) == "excel":
+
+        df = parse_file(data_path, **kwargs)
+
+        return (df.iloc[i:i + chunksize] for i in range(0, len(df), chunksize))
+
+    msg = f"Can't read {os.path.basename(data_path)} in chunks"
+    raise ValueError(msg)
+
+def print_load_times(*dfs):
+    '''
+    Print when each dataset started and finished loading to show
+    how much of the reading was done in parallel.
+    '''
+
+    for df in dfs:
+        began, ended = df._metadata["load_time"]
+        source = " from cache" if df._metadata.get("cached", False) else ""
+        print(
+            f"Read {df._metadata['file_name']}{source} from {began:.2f}s "
+            f"to {ended:.2f}s ({ended - began:.2f}s)")
@@ -3,46 +3,242 @@ Module handling the genration of all HTML components
 '''
 
 # Standard library imports
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import base64
+import json
+import zlib
 from io import StringIO
 from pathlib import Path
 from os.path import join
+import os
+import tempfile
 
 # External library imports
+import numpy as np
+import pandas as pd
 import bokeh
-from jinja2 import Environment, FileSystemLoader
+from bokeh.settings import settings as bokeh_settings
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
 
 # Summarize2 imports
 from ..core.bokeh_plots import (
     generate_diff_plot, generate_kde_plot,
-    generate_ridge_plot, generate_xtab_plot)
+    generate_ridge_plot, generate_xtab_plot, compact_plot, MAX_DIFF_CATEGORIES)
 from ..core.summary_stats import generate_summary
 from ..core.helper_funcs import package_dir
+from ..core.cache import CACHE_DIR
 
-def generate_report(df1, df2, user_dtypes, **kwargs):
+class TemplateBytecodeCache(FileSystemBytecodeCache):
+    '''
+    Bytecode cache of compiled templates shared by all Summarize2 runs.
+
+    The directory is only created when the first template is saved.
+    Files are written to a temporary name and renamed so that reports
+    rendered at the same time never read a half-written file, and the
+    cache is skipped if its directory can't be written to.
+    '''
+
+    def __init__(self, directory):
+
+        super().__init__(directory)
+        self.writable = True
+
+    def load_bytecode(self, bucket):
+
+        try:
+            super().load_bytecode(bucket)
+        except OSError:
+            pass
+
+    def dump_bytecode(self, bucket):
+
+        if not self.writable:
+            return
+
+        filename = self._get_cache_filename(bucket)
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                    "wb", dir=self.directory, delete=False) as f:
+                bucket.write_bytecode(f)
+            os.replace(f.name, filename)
+        except OSError:
+            self.writable = False
+
+@lru_cache(maxsize=None)
+def template_env(bytecode_cache=True):
+    '''
+    Environment loading the report templates, compiled once per process
+    and, unless bytecode_cache is False, cached on disk between runs
+    '''
+
+    return Environment(
+        loader=FileSystemLoader(package_dir("static")),
+        bytecode_cache=(
+            TemplateBytecodeCache(join(CACHE_DIR, "templates")) if bytecode_cache else None))
+
+def generate_column_plot(task):
+    '''
+    Generate the KDE or frequency difference plot of a single column.
+
+    task is a tuple of plot type ("kde" or "diff"), the two dataframes,
+    column name, shade, pre-computed frequencies (or None) and the
+    maximum number of bars of a frequency difference plot.
+    '''
+
+    plot_type, df1, df2, var, shade, frequencies, max_categories = task
+
+    if plot_type == "kde":
+        return generate_kde_plot(df1, df2, var, shade)
+
+    return generate_diff_plot(
+        df1, df2, var, shade, frequencies=frequencies, max_categories=max_categories)
+
+def init_plot_worker():
+    '''
+    Give the models made in a worker process random Bokeh IDs; the
+    sequential IDs of every process start from the same number, so
+    plots from different workers would share them
+    '''
+
+    bokeh_settings.simple_ids.set_value(False)
+
+def column_plot_worker(task):
+    '''
+    Worker process version of generate_column_plot.
+
+    Returns the plot JSON
+    '''
+
+    _, df1, df2, var, _, _, _ = task
+
+    #unpickled NAs are separate float objects; Pandas parsers use np.nan
+    for df in (df1, df2):
+        if df[var].dtype == object:
+            values = df[var].to_numpy(copy=True)
+            values[pd.isna(values)] = np.nan
+            df[var] = values
+
+    return generate_column_plot(task)
+
+def generate_column_plots(tasks, workers):
+    '''
+    Generate column plots in a pool of worker processes.
+
+    Results are collected in the order of tasks. The plots are the same
+    as the ones generated one by one except for the Bokeh IDs, which
+    are random (see init_plot_worker).
+
+    Returns a list of plot JSON strings
+    '''
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_plot_worker) as pool:
+        return list(pool.map(column_plot_worker, tasks))
+
+def bundle_plots(plots):
+    '''
+    Pack the plots into a single block of text to embed in the report.
+
+    plots is a dictionary of plot JSON keyed by the id of the element the
+    plot goes into. The plots are compacted (see compact_plot) and
+    compressed together with zlib, so the models and styling repeated in
+    every plot take little space, and the block is base64 encoded.
+    '''
+
+    items = ",".join(
+        f"{json.dumps(target)}:{compact_plot(plot)}" for target, plot in plots.items())
+
+    return base64.b64encode(
+        zlib.compress(("{" + items + "}").encode("utf-8"), 9)).decode("ascii")
+
+def generate_report(df1, df2, user_dtypes, output=None, **kwargs):
     '''
     Main function producing the report.
+
+    The report is written to the output file object as it's rendered;
+    without output, it's rendered into a string which is returned.
+
+    When datasets are read in chunks, df1 and df2 are row samples and
+    the summary along with the categorical value counts are passed in
+    as summary and frequencies kwargs.
+
+    If workers (1 by default) is more than 1, KDE and frequency difference
+    plots are generated in that many processes; each one is only sent the
+    column it's plotting.
+
+    Frequency difference plots of columns with more than max_categories
+    values show the most different values and an "Other" bar for the rest.
+
+    If compact is True, the plots are embedded as one compressed block
+    with float32 and int32 binary arrays (see bundle_plots) that the
+    browser unpacks with DecompressionStream.
+
+    If lazy is True, each plot is kept in a data block that isn't parsed
+    until the plot's table cell scrolls into view and only then rendered.
+
+    If template_cache is False, the compiled templates aren't saved to
+    or loaded from the on-disk cache.
     '''
 
+    if output is None:
+        buffer = StringIO()
+        generate_report(df1, df2, user_dtypes, output=buffer, **kwargs)
+        return buffer.getvalue()
+
     #Generate basic summary statistics about the datasets
-    summary = generate_summary(df1, df2, user_dtypes)
+    summary = kwargs.get('summary', None)
+    if summary is None:
+        summary = generate_summary(
+            df1, df2, user_dtypes, approx=kwargs.get('approx', False))
+
+    frequencies = kwargs.get('frequencies', None) or {}
+    max_categories = kwargs.get('max_categories', None)
+    if max_categories is None:
+        max_categories = MAX_DIFF_CATEGORIES
+
+    #Generate KDE plots for continuous variables and Bokeh categorical
+    #frequency difference plots to be used in Jinja template
+    tasks = []
 
-    #Generate KDE plots for continuous variables to be used in Jinja template
-    kde_plots = {}
     for i, var in enumerate(summary["Metadata"]["common_columns"]["Continuous"]):
+        tasks.append(("kde", df1, df2, var, i % 2, None, None))
+
+    for j, var in enumerate(summary["Metadata"]["common_columns"]["Categorical"]):
+        tasks.append((
+            "diff", df1, df2, var, j % 2, frequencies.get(var, None), max_categories))
 
-        kde_plots[var] = generate_kde_plot(df1, df2, var, i % 2)
+    workers = kwargs.get('workers', None)
+    if workers is None:
+        workers = 1
+    elif workers < 1:
+        raise ValueError(f"Number of workers must be at least 1, got {workers}")
 
-    #Generate Bokeh categorical frequency difference plots
+    if workers > 1 and len(tasks) > 1:
+        tasks = [
+            (plot_type, df1[[var]], df2[[var]], var, *options)
+            for plot_type, _, _, var, *options in tasks]
+        plots = generate_column_plots(tasks, workers)
+    else:
+        plots = [generate_column_plot(task) for task in tasks]
+
+    kde_plots = {}
     cat_diff_plots = {}
-    for j, var in enumerate(summary["Metadata"]["common_columns"]["Categorical"]):
 
-        cat_diff_plots[var] = generate_diff_plot(df1, df2, var, j % 2)
+    for (plot_type, _, _, var, *_), plot in zip(tasks, plots):
+        if plot_type == "kde":
+            kde_plots[var] = plot
+        else:
+            cat_diff_plots[var] = plot
 
     #Generate Bokeh Ridge plot:
     if kwargs.get('ridge', None):
         ridge_plot = generate_ridge_plot(df1, df2, kwargs['ridge'])
+        ridge_count = sum(x[1] != '_' for x in kwargs['ridge']['indices'])
     else:
         ridge_plot = None
+        ridge_count = 0
 
     #Generate Bokeh Crosstab plot:
     if kwargs.get('xtab', None):
@@ -50,8 +246,33 @@ def generate_report(df1, df2, user_dtypes, **kwargs):
     else:
         xtab_plot = None
 
+    #Plots are embedded as data blocks keyed by their element ids
+    compact = kwargs.get('compact', False)
+    lazy = kwargs.get('lazy', False)
+
+    plot_bundle = None
+    plot_items = None
+
+    if compact or lazy:
+
+        plots = {f"cat_{var}": plot for var, plot in cat_diff_plots.items()}
+        plots.update({f"kde_{var}": plot for var, plot in kde_plots.items()})
+
+        if xtab_plot is not None:
+            plots["xtab_plot_id"] = xtab_plot
+        if ridge_plot is not None:
+            plots["ridge_plot_id"] = ridge_plot
+
+        if compact:
+            plot_bundle = bundle_plots(plots)
+        else:
+            #a </script> in a plot's strings would end its data block early
+            plot_items = {
+                target: plot.replace("</", "<\\/") for target, plot in plots.items()}
+
     #Template loading machinery
     root_path = package_dir("static")
+    template_cache = kwargs.get('template_cache', True)
 
     #Check if Python version of Bokeh matches the locally saved version
     #We prefer to load from CDN with a local backup, but using an older
@@ -69,11 +290,7 @@ def generate_report(df1, df2, user_dtypes, **kwargs):
     else:
         print("WARNING: No local copy of Bokeh is available. Loading from CDN.")
 
-    env = Environment(loader=FileSystemLoader(root_path))
-        
-    template = env.get_template("templates/main.jinja")
-
-    output = StringIO()
+    template = template_env(template_cache).get_template("templates/main.jinja")
 
     template.stream(
         root=root_path,
@@ -83,6 +300,8 @@ def generate_report(df1, df2, user_dtypes, **kwargs):
         cat_plots=cat_diff_plots,
         kde_plots=kde_plots,
         xtab_plot=xtab_plot,
-        ridge_plot=ridge_plot).dump(output)
-
-    return output.getvalue()
+        ridge_plot=ridge_plot,
+        ridge_count=ridge_count,
+        plot_bundle=plot_bundle,
+        plot_items=plot_items,
+        lazy_plots=lazy).dump(output)
@@ -1,185 +1,533 @@
-def launch_worker(path1, path2, cols, num_col, input_queue, output_queue):
+def pack_groups(df1, df2, cols, num_col):
 	'''
-	Worker function spawned as a standalone Python process by the controller function.
-	Requires the following parameters:
-	
-	path1 		- 	File path to the first dataset (reference).
-	path2 		-	File path to the second dataset (comparison).
-	cols  		-	A list of columns common to both datasets. 
-			  		Unique values from each column are combined to
-			  		generate a multi-index.
-	num_col 	-	A string with a numerical column used to generate
-			  		a KDE for comparison between two datasets across
-			  		each multi-index generated from cols.
-	input_queue -	Multiprocessing queue with multi-index permutations.
-	output_queue-	Multiprocessing queue with top N results.
+	Sort the values of num_col in both datasets by the groups of cols.
+
+	Groups are numbered in the (sorted) order of the first dataset's
+	groups; rows of the second dataset in groups that the first one
+	doesn't have are dropped, like the permutations that only exist
+	in the second dataset were never scored.
+
+	Returns a tuple of group keys and a list of four arrays: values and
+	offsets of each dataset where the values of group i are between
+	offsets[i] and offsets[i + 1].
+	'''
+	import numpy as np
+
+	#Only combinations that exist in the data, even for categorical columns
+	grouped1 = df1.groupby(cols, observed=True)[num_col]
+	grouped2 = df2.groupby(cols, observed=True)[num_col]
+
+	#ngroup numbers the rows in the order of the group keys; NA keys are -1
+	keys = grouped1.size().index
+	positions = keys.get_indexer(grouped2.size().index)
+
+	codes1 = grouped1.ngroup().fillna(-1).to_numpy(dtype="int64")
+	codes2 = grouped2.ngroup().fillna(-1).to_numpy(dtype="int64")
+	codes2 = np.where(codes2 >= 0, positions[codes2], -1)
+
+	arrays = []
+
+	for df, codes in ((df1, codes1), (df2, codes2)):
+
+		in_group = codes >= 0
+		order = np.argsort(codes[in_group], kind="stable")
+		values = df[num_col].to_numpy(dtype="float64")[in_group][order]
+
+		counts = np.bincount(codes[in_group], minlength=len(keys))
+		offsets = np.concatenate([[0], np.cumsum(counts)])
+
+		arrays.extend([values, offsets])
+
+	return list(keys), arrays
+
+def share_arrays(arrays):
+	'''
+	Copy numpy arrays into new shared memory blocks.
+
+	Returns a tuple of the SharedMemory objects (to be unlinked by the
+	caller once the workers are done) and the specs workers need to
+	attach to them: (block name, dtype, shape) for each array.
+	'''
+	import numpy as np
+	from multiprocessing import shared_memory
+
+	blocks = []
+	specs = []
+
+	for array in arrays:
 
-	Because of how processes are spawned on Windows, each worker needs its own imports
+		#zero sized blocks aren't allowed
+		block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+		np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
 
+		blocks.append(block)
+		specs.append((block.name, array.dtype.str, array.shape))
+
+	return blocks, specs
+
+def attach_arrays(specs):
+	'''
+	Attach to arrays shared by share_arrays without copying them.
+
+	Returns a tuple of the SharedMemory objects (to be closed, but not
+	unlinked, when done) and read-only arrays backed by them.
+	'''
+	import numpy as np
+	from multiprocessing import shared_memory
+
+	blocks = []
+	arrays = []
+
+	for name, dtype, shape in specs:
+
+		block = shared_memory.SharedMemory(name=name)
+		array = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+		array.flags.writeable = False
+
+		blocks.append(block)
+		arrays.append(array)
+
+	return blocks, arrays
+
+#Number of most different permutations returned by launch_controller
+TOP_N = 5
+
+#Permutations with fewer rows than this in either dataset aren't scored
+MIN_ROWS = 10
+
+#Permutations are split into this many batches per worker so that the
+#load is balanced without paying the dispatch overhead per permutation
+BATCHES_PER_WORKER = 4
+
+#Pools kept alive between calls of launch_controller, by number of workers
+_pools = {}
+
+#Groups read from files, cached in each worker between batches
+_worker_data = {}
+
+def load_groups(source):
+	'''
+	Return the arrays packed by pack_groups for a data source of
+	("files", path1, path2, cols, num_col), reading and grouping the
+	datasets in the worker once for every batch of the same comparison.
 	'''
 	import pandas as pd
+
+	if _worker_data.get("source") != source:
+
+		_, path1, path2, cols, num_col = source
+		_, arrays = pack_groups(pd.read_csv(path1), pd.read_csv(path2), cols, num_col)
+
+		_worker_data.update(source=source, arrays=arrays)
+
+	return _worker_data["arrays"]
+
+def figure_prep(s1, s2):
+	'''
+	Given two arrays return two matplotlib figures with KDE plots.
+	'''
 	import numpy as np
-	from scipy.stats.kde import gaussian_kde
 	import matplotlib.pyplot as plt
-	import heapq
+	from summarize2.core.kde import BinnedKDE
 
-	#EACH WORKER READS IN DATA INDEPENDENTLY TO AVOID SERIALIZING IT THROUGH MULTIPROCESSING
-	df1 = pd.read_csv(path1)
-	df2 = pd.read_csv(path2)
+	s1 = s1[~np.isnan(s1)]
+	s2 = s2[~np.isnan(s2)]
+	
+	#special case when a series is all zeroes
+	if s1.sum() == 0:
+		func_1 = lambda x: np.array([0.00001] * len(x))
+	else:
+		func_1 = BinnedKDE(s1, bw_method=0.1)
 
-	#CONVERT DATAFRAME TO A DICTIONARY FOR FASTER INDEXING AND LOOKUP
-	grouped1 = df1.groupby(cols)[num_col]
-	grouped2 = df2.groupby(cols)[num_col]
+	if s1.sum() == 0:
+		func_2 = lambda x: np.array([0.00001] * len(x))	
+	else:
+		func_2 = BinnedKDE(s2, bw_method=0.1)
 
-	d1 = {index:group.values for index, group in grouped1}
-	d2 = {index:group.values for index, group in grouped2}
+	
+	x = np.linspace(min(s1.min(), s2.min()),
+					max(s1.max(), s2.max()),
+					100)
+	
+	#evaluate each density once and reuse it for the limits and the plots
+	y_1 = func_1(x)
+	y_2 = func_2(x)
 
-	def figure_prep(s1, s2):
-		'''
-		Given two arrays return two matplotlib figures with KDE plots.
-		'''
+	x_lims = (min(x), max(x))
+	y_lims = (min(y_1.min(), y_2.min()), max(y_1.max(), y_2.max()))
 	
-		s1 = s1[~np.isnan(s1)]
-		s2 = s2[~np.isnan(s2)]
-		
-		#special case when a series is all zeroes
-		if s1.sum() == 0:
-			func_1 = lambda x: np.array([0.00001] * len(x))
-		else:
-			func_1 = gaussian_kde(s1, bw_method=0.1)
+	fig_1, ax_1 = plt.subplots()
+	fig_2, ax_2 = plt.subplots()
+	
+	ax_1.axis('off')
+	ax_1.set_ylim(y_lims[0], y_lims[1])
+	ax_1.set_xlim(x_lims[0], x_lims[1])
+	ax_1.fill_between(x, 0, y_1, color='red')
+	
+	ax_2.axis('off')
+	ax_2.set_ylim(y_lims[0], y_lims[1])
+	ax_2.set_xlim(x_lims[0], x_lims[1])
+	ax_2.fill_between(x, 0, y_2, color='red')
+	
+	plt.close(fig='all')
+	
+	return fig_1, fig_2
 
-		if s1.sum() == 0:
-			func_2 = lambda x: np.array([0.00001] * len(x))	
-		else:
-			func_2 = gaussian_kde(s2, bw_method=0.1)
+def image_diff(fig_A, fig_B):
+	'''
+	Given two matplotlib figures, output % difference from vectorized comparison.
+	'''
+	import numpy as np
 
-		
-		x = np.linspace(min(s1.min(), s2.min()),
-						max(s1.max(), s2.max()),
-						100)
-		
-		x_lims = (min(x), max(x))
-		y_lims = (min(func_1(x).min(), func_2(x).min()), max(func_1(x).max(), func_2(x).max()))
-		
-		fig_1, ax_1 = plt.subplots()
-		fig_2, ax_2 = plt.subplots()
-		
-		ax_1.axis('off')
-		ax_1.set_ylim(y_lims[0], y_lims[1])
-		ax_1.set_xlim(x_lims[0], x_lims[1])
-		ax_1.fill_between(x, 0, func_1(x), color='red')
-		
-		ax_2.axis('off')
-		ax_2.set_ylim(y_lims[0], y_lims[1])
-		ax_2.set_xlim(x_lims[0], x_lims[1])
-		ax_2.fill_between(x, 0, func_2(x), color='red')
-		
-		plt.close(fig='all')
-		
-		return fig_1, fig_2
-
-	def image_diff(fig_A, fig_B):
-		'''
-		Given two matplotlib figures, output % difference from vectorized comparison.
-		'''
-		white = (255, 255, 255)
-		red = (255, 0, 0)
-		
-		fig_A.canvas.draw()
-		img_1 = np.frombuffer(fig_A.canvas.tostring_rgb(), dtype=np.uint8).reshape(-1, 3)
-		
-		fig_B.canvas.draw()
-		img_2 = np.frombuffer(fig_B.canvas.tostring_rgb(), dtype=np.uint8).reshape(-1, 3)
-		
+	fig_A.canvas.draw()
+	img_1 = np.frombuffer(fig_A.canvas.tostring_rgb(), dtype=np.uint8).reshape(-1, 3)
+	
+	fig_B.canvas.draw()
+	img_2 = np.frombuffer(fig_B.canvas.tostring_rgb(), dtype=np.uint8).reshape(-1, 3)
+	
+
+	ref_pixels = np.stack((np.sum(img_1, axis=1), np.sum(img_2, axis=1)), axis=-1).sum(axis=1)
+	diff_pixels = np.stack((np.sum(img_1, axis=1), np.sum(img_2, axis=1)), axis=-1).sum(axis=1)
+
+	#1020 is difference (red + white or white + red); reference area is any non "double white" combination
+	result = (np.sum(diff_pixels == 1020) / np.sum(ref_pixels != 1530))
+			
+	return round(result * 100, 2)
+
+def score(s1, s2, metric):
+	'''
+	Given two arrays, output how different their distributions are; higher is more different.
+
+	metric is "ks", "wasserstein", "js" or "overlap" for distances computed
+	from the values (see core.distances) or "pixels" to compare rendered
+	matplotlib figures.
+	'''
+	from summarize2.core.distances import distribution_distance
+
+	if metric == "pixels":
+		return image_diff(*figure_prep(s1, s2))
+
+	return distribution_distance(s1, s2, metric)
+
+def top_scores(arrays, metric, engine, start, stop, top_n=TOP_N, min_rows=MIN_ROWS):
+	'''
+	Score the permutations between the start and stop positions in the
+	group keys given the arrays packed by pack_groups.
+
+	engine is "vectorized" to score all permutations at once with
+	group_distances or "exact" to score them one by one. The exact scoring
+	has two stages: cheap bounds of every permutation's distance (see
+	distance_bounds) rule out the permutations that can't make it into
+	the top_n, and only the rest are compared, in order of their upper
+	bounds until none of the remaining ones can beat the current top_n.
+	Only ks and wasserstein have useful bounds, so the other metrics
+	score every permutation.
+
+	Returns a list of up to top_n (score, position) tuples
+	'''
+	import heapq
+	import numpy as np
+	from summarize2.core.group_distances import group_distances, distance_bounds
+
+	values1, offsets1, values2, offsets2 = arrays
+	positions = np.arange(start, stop)
 
-		ref_pixels = np.stack((np.sum(img_1, axis=1), np.sum(img_2, axis=1)), axis=-1).sum(axis=1)
-		diff_pixels = np.stack((np.sum(img_1, axis=1), np.sum(img_2, axis=1)), axis=-1).sum(axis=1)
+	#Only the exact ks and wasserstein scores can be pruned by their bounds
+	if metric == "pixels" or (engine != "vectorized" and metric in ("js", "overlap")):
 
-		#1020 is difference (red + white or white + red); reference area is any non "double white" combination
-		result = (np.sum(diff_pixels == 1020) / np.sum(ref_pixels != 1530))
-				
-		return round(result * 100, 2)
+		candidates = [
+			i for i in positions
+			if (offsets1[i + 1] - offsets1[i] >= min_rows) & (offsets2[i + 1] - offsets2[i] >= min_rows)]
+		upper = None
 
-	#Keep top 5 permutations in HEAPQ
-	h = [(0, '_')] * 5
+	elif engine == "vectorized":
 
-	while True:
+		scores = group_distances(
+			values1, offsets1, values2, offsets2, metric, groups=positions, min_rows=min_rows)
 
-		permut = input_queue.get()
-		if permut is None:
+		#Permutations that weren't scored are NaN
+		scored = ~np.isnan(scores)
+
+		return heapq.nlargest(
+			top_n, zip(scores[scored].tolist(), positions[scored].tolist()))
+
+	else:
+
+		lower, upper = distance_bounds(
+			values1, offsets1, values2, offsets2, metric, groups=positions, min_rows=min_rows)
+
+		#Permutations that can't be scored have NaN bounds
+		scored = np.flatnonzero(~np.isnan(upper))
+
+		#top_n permutations score at least the top_n-th largest lower bound
+		if len(scored) >= top_n > 0:
+			threshold = np.partition(lower[scored], len(scored) - top_n)[len(scored) - top_n]
+			scored = scored[upper[scored] >= threshold - _slack(threshold)]
+
+		upper = upper[scored]
+		order = np.argsort(-upper, kind="stable")
+		candidates = positions[scored][order]
+		upper = upper[order]
+
+	h = []
+
+	for n, i in enumerate(candidates):
+
+		if len(h) == top_n and upper is not None and upper[n] < h[0][0] - _slack(h[0][0]):
 			break
 
-		try:
-			if (d1[permut].shape[0] >= 10) & (d2[permut].shape[0] >= 10) & (d1[permut].sum() != 0) & (d2[permut].sum() !=0):
+		s1 = values1[offsets1[i]:offsets1[i + 1]]
+		s2 = values2[offsets2[i]:offsets2[i + 1]]
+
+		#Permutations missing from DF2 are empty and always skipped
+		if (s1.sum() != 0) & (s2.sum() !=0):
+
+			try:
+				item = (score(s1, s2, metric), int(i))
 
-				heapq.heappushpop(h, (image_diff(*figure_prep(d1[permut], d2[permut])), permut))
+			#Permutation has a constant value so it doesn't have a density to compare
+			except ValueError:
+				continue
 
-		#Either HEAPQ already has an equal value of image_diff or permutation doesn't exist in DF2
-		except (TypeError, KeyError):
-			pass
+			if len(h) < top_n:
+				heapq.heappush(h, item)
+			elif top_n:
+				heapq.heappushpop(h, item)
 
-	output_queue.put(h)
+	return h
 
-def launch_controller(path1, path2, cols, num_col):
+def _slack(value):
 	'''
-	Main function / process in charge of Multiprocessing. 
-	Spawns worker processes to parallelize the generation and
-	differencing of KDE plots for each combination of given 
-	columns from two datasets being compared.
+	Allowance for rounding when comparing bounds with exact scores
 	'''
 
-	import pandas as pd
-	import numpy as np
-	import itertools
+	return 1e-9 * max(1, abs(value))
+
+def score_batch(task):
+	'''
+	Worker function scoring a batch of permutations in the pool.
+
+	task is a tuple of data source, metric, engine, top_n, min_rows and
+	the start and stop positions of the batch in the group keys. The
+	source is either ("shared", specs) with specs from share_arrays or
+	files to read (see load_groups).
+
+	Shared memory is only attached for the batch, so workers don't keep
+	the blocks mapped after the search is over and they are unlinked.
+
+	Returns a list of up to top_n (score, position) tuples
+
+	Because of how processes are spawned on Windows, each worker function needs its own imports
+	'''
+
+	source, metric, engine, top_n, min_rows, start, stop = task
+
+	if source[0] != "shared":
+		return top_scores(load_groups(source), metric, engine, start, stop, top_n, min_rows)
+
+	blocks, arrays = attach_arrays(source[1])
+
+	try:
+		return top_scores(arrays, metric, engine, start, stop, top_n, min_rows)
+
+	finally:
+		#Views into shared memory have to be released before closing it;
+		#if scoring failed, its traceback still holds them until it's freed
+		arrays = None
+		for block in blocks:
+			try:
+				block.close()
+			except BufferError:
+				pass
+
+def get_pool(workers):
+	'''
+	Return a pool of worker processes, starting it on first use.
+
+	Pools stay alive between calls of launch_controller so that repeated
+	comparisons don't pay for starting the processes again. They are
+	shut down by close_pools, which also runs when Python exits.
+	'''
+	import atexit
 	import multiprocessing as mp
-	import logging
-	import time
-	import heapq
-	import os
 
-	cpu_num = os.cpu_count()
+	if workers not in _pools:
 
-	mpl = mp.log_to_stderr()
-	mpl.setLevel(logging.WARNING)
+		if not _pools:
+			atexit.register(close_pools)
 
-	all_permuts = set(pd.read_csv(path1).set_index(cols).index)
+		_pools[workers] = mp.Pool(workers)
 
-	output_queue = mp.Queue()
-	input_queue = mp.Queue()
+	return _pools[workers]
 
-	#Load permutations into the input queue
-	for permut in all_permuts:
-		
-		if np.nan not in [permut]:
-			input_queue.put(permut)
+def close_pools():
+	'''
+	Shut down all worker pools started by get_pool
+	'''
 
-	#Add end signals
-	for i in range(cpu_num):
-		input_queue.put(None)
+	for pool in _pools.values():
+		pool.close()
+		pool.join()
 
-	args = (path1, path2, cols, num_col, input_queue, output_queue)
-	
-	#Define worker processes (1 per CPU core)
-	processes = [mp.Process(target=launch_worker, args=args) for i in range(cpu_num)]
+	_pools.clear()
+
+def _pool_scores(source, n_keys, metric, workers, batch_size, engine, top_n, min_rows):
+	'''
+	Score the permutations in batches in the pool of workers.
+
+	Returns a list of the top scores of each batch
+	'''
+	import multiprocessing as mp
+	import logging
 
-	for p in processes:
-		p.start()
+	mpl = mp.log_to_stderr()
+	mpl.setLevel(logging.WARNING)
 
-	for p in processes:
-		p.join()
+	if batch_size is None:
+		batch_size = max(1, -(-n_keys // (workers * BATCHES_PER_WORKER)))
 
-	result_heapq = [(0, '_')] * 5		
+	tasks = [
+		(source, metric, engine, top_n, min_rows, start, min(start + batch_size, n_keys))
+		for start in range(0, n_keys, batch_size)]
 
-	result = []
-	while not output_queue.empty():
-		result.append(output_queue.get())
+	return list(get_pool(workers).imap_unordered(score_batch, tasks))
 
-	for x in itertools.chain(*result):
-		heapq.heappushpop(result_heapq, x)
+def _top_permutations(keys, results, top_n):
+	'''
+	Merge the top permutations of each batch; only positive scores are kept
+	'''
+	import heapq
+
+	top = heapq.nlargest(top_n, (x for batch in results for x in batch if x[0] > 0))
+
+	result_heapq = [(score, keys[i]) for score, i in top]
+	result_heapq += [(0, '_')] * (top_n - len(result_heapq))
 	
 	#Sorted this way, Bokeh will draw the results
 	#with the most different distribution first.
 	return sorted(result_heapq, key=lambda x: x[0], reverse=True)
+
+def compare_groups(df1, df2, cols, num_col, metric="overlap", workers=None,
+				   batch_size=None, engine="vectorized", top_n=TOP_N, min_rows=MIN_ROWS,
+				   executor=None):
+	'''
+	Find the permutations of cols whose distributions of num_col are the
+	most different between two already loaded dataframes.
+
+	The grouped values are packed once in this process and scored by
+	executor (see core.executors). By default that's a LocalExecutor:
+	with more than one worker the arrays are placed in shared memory for
+	the pool, otherwise they are scored here without starting a pool.
+
+	See launch_controller for the other parameters and the result
+	'''
+	from summarize2.core.executors import LocalExecutor
+
+	if executor is None:
+		executor = LocalExecutor(workers, batch_size)
+
+	keys, arrays = pack_groups(df1, df2, cols, num_col)
+	results = executor.scores(keys, arrays, metric, engine, top_n, min_rows)
+
+	return _top_permutations(keys, results, top_n)
+
+def launch_controller(path1, path2, cols, num_col, metric="overlap", shared=True,
+					  workers=None, batch_size=None, engine="vectorized", top_n=TOP_N,
+					  min_rows=MIN_ROWS):
+	'''
+	Main function / process in charge of Multiprocessing. 
+	Uses a pool of worker processes to parallelize the scoring of
+	differences between distributions for each combination
+	of given columns from two datasets being compared.
+	See score for the accepted metrics.
+
+	With the default "vectorized" engine, all permutations of a batch are
+	scored at once on per-permutation grids (see core.group_distances);
+	"exact" scores them one by one. With a single worker, the datasets are
+	packed and scored in this process without starting a pool at all.
+
+	If shared is True, the datasets are parsed once and the grouped
+	values of num_col are placed in shared memory for the workers
+	(see compare_groups for dataframes that are already loaded);
+	otherwise each worker reads both datasets itself.
+
+	Permutations are sent to the workers as batches of positions in the
+	group keys; workers is the size of the pool (all CPUs if None) and
+	batch_size defaults to BATCHES_PER_WORKER batches per worker.
+	Results are collected as they arrive, so a slow batch never blocks
+	the others from being returned.
+
+	Returns the top_n most different permutations among those with at
+	least min_rows rows in both datasets, padded with (0, '_') if fewer
+	permutations have a positive score.
+	'''
+
+	import pandas as pd
+	import os
+
+	if workers is None:
+		workers = os.cpu_count()
+
+	if shared or workers == 1:
+
+		return compare_groups(
+			pd.read_csv(path1), pd.read_csv(path2), cols, num_col, metric, workers,
+			batch_size, engine, top_n, min_rows)
+
+	#Same (sorted) order of group keys as pack_groups in the workers
+	keys = list(pd.read_csv(path1).groupby(cols, observed=True).size().index)
+	source = ("files", path1, path2, cols, num_col)
+
+	results = _pool_scores(
+		source, len(keys), metric, workers, batch_size, engine, top_n, min_rows)
+
+	return _top_permutations(keys, results, top_n)
 		
+def generate_ridge_spec(df1, df2, ridge_input, cat_cols, num_cols, workers=1):
+	'''
+	Turn the choices from the ridge temp file (see launch_temp_file) into
+	the spec of generate_ridge_plot, searching the already loaded and
+	dtype-converted dataframes for the most different slices.
+
+	cat_cols and num_cols are the columns that can be used to slice the
+	data and the numerical columns to compare. Invalid choices print a
+	warning and return None so that the report is made without the plot.
+
+	If the remote_workers option lists "host:port" addresses of socket
+	workers (see core.executors), the search is spread across them
+	instead of the local processes, waiting up to the timeout option
+	(in seconds) for each of them to answer.
+	'''
+	from summarize2.core.executors import SocketExecutor, REQUEST_TIMEOUT
+
+	columns = ridge_input.get("columns") or {}
+	options = ridge_input.get("options") or {}
+
+	cols = columns.get("slice_columns") or []
+	num_col = columns.get("numerical_column")
+
+	if isinstance(cols, str):
+		cols = [cols]
+
+	invalid = [col for col in cols if col not in cat_cols]
+
+	if not cols or invalid or num_col not in num_cols:
+		print("WARNING: Ridge plot needs valid slice columns and a numerical column. Skipping.")
+		return None
+
+	remote_workers = options.get("remote_workers") or []
+
+	indices = compare_groups(
+		df1, df2, cols, num_col,
+		metric=options.get("metric", "overlap"),
+		workers=workers,
+		top_n=options.get("top_n", TOP_N),
+		min_rows=options.get("min_rows", MIN_ROWS),
+		executor=(
+			SocketExecutor(remote_workers, timeout=options.get("timeout", REQUEST_TIMEOUT))
+			if remote_workers else None))
+
+	return {"cols": cols, "num_col": num_col, "indices": indices}
+
 if __name__=="mp_distributions":
 	controller(path1, path2, cols, num_col)
\ No newline at end of file
@@ -0,0 +1,139 @@
+'''
+Module with the command line options that need checking or defaults
+before any data is read.
+
+Only the standard library is imported here so that argument parsing,
+--help and argument errors don't wait for NumPy, Pandas or the
+plotting libraries to load.
+'''
+
+# Standard library imports
+from pathlib import Path
+import operator
+import os.path
+
+#File extensions that can be read by Pandas and the format used to read them
+PANDAS_FORMATS = {
+    ".csv": "csv",
+    ".xlsx": "excel",
+    ".xls": "excel",
+}
+
+#File extensions and the pyarrow format used to read them
+COLUMNAR_FORMATS = {
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".feather": "ipc",
+    ".arrow": "ipc",
+    ".ipc": "ipc",
+}
+
+#Operators allowed in row filters, in the order they are matched
+FILTER_OPERATORS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<=": operator.le,
+    ">=": operator.ge,
+    "<": operator.lt,
+    ">": operator.gt,
+}
+
+#Output formats other than the HTML report
+EXPORT_FORMATS = ("json", "parquet")
+
+#Frequency difference plots show at most this many bars by default
+MAX_DIFF_CATEGORIES = 50
+
+def file_suffix(data_path):
+    '''
+    Lower case file extension, so that DATA.CSV is read like data.csv
+    '''
+
+    return os.path.splitext(data_path)[1].lower()
+
+def file_format(data_path):
+    '''
+    Return "csv", "excel", "parquet" or "ipc" for supported files
+    and None for other files
+    '''
+
+    suffix = file_suffix(data_path)
+
+    return PANDAS_FORMATS.get(suffix, COLUMNAR_FORMATS.get(suffix, None))
+
+def columnar_format(data_path):
+    '''
+    Return "parquet" or "ipc" for columnar files and None for other files
+    '''
+
+    return COLUMNAR_FORMATS.get(file_suffix(data_path), None)
+
+def path_checker(string):
+    '''
+    Improves error message for user if wrong path entered.
+    Returns Path object.
+    '''
+
+    if not os.path.exists(string):
+        msg = "Can't find specified file"
+        raise FileNotFoundError(msg)
+
+    if file_format(string) is None:
+        msg = f"Unsupported file type: {os.path.basename(string)}"
+        raise ValueError(msg)
+
+    return Path(string)
+
+def positive_int(string):
+    '''
+    Parse a count that must be at least 1, like the number of bars
+    of a frequency difference plot
+    '''
+
+    value = int(string)
+
+    if value < 1:
+        msg = f"Expected a whole number of at least 1, got {value}"
+        raise ValueError(msg)
+
+    return value
+
+def fraction(string):
+    '''
+    Parse a fraction of rows, more than 0 and at most 1
+    '''
+
+    value = float(string)
+
+    if not 0 < value <= 1:
+        msg = f"Expected a fraction more than 0 and at most 1, got {value}"
+        raise ValueError(msg)
+
+    return value
+
+def filter_checker(string):
+    '''
+    Parse a row filter like "age>=30" or "region==North" into
+    a (column, operator, value) tuple. Numbers are compared as
+    numbers and anything else as a string without quotes.
+    '''
+
+    for op in FILTER_OPERATORS:
+
+        col, found, value = string.partition(op)
+
+        if found and col.strip():
+            break
+    else:
+        msg = f"Filter must be column, one of {' '.join(FILTER_OPERATORS)} and value"
+        raise ValueError(msg)
+
+    value = value.strip()
+
+    for number_type in (int, float):
+        try:
+            return (col.strip(), op, number_type(value))
+        except ValueError:
+            pass
+
+    return (col.strip(), op, value.strip("'\""))
@@ -0,0 +1,323 @@
+'''
+Module with mergeable sketches for approximate summary statistics.
+
+Sketches are small, fixed-size summaries of a column that can be built
+independently for each chunk of data (or each worker) and merged
+together afterwards. A t-digest is used for quantiles and HyperLogLog
+is used for the number of unique values.
+'''
+
+# External library imports
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+class Estimate(float):
+    '''
+    Approximate value that renders with its error bound in the report.
+
+    Subclassing float means the template macros can still compare
+    estimates from the two datasets with ==, > and <.
+    '''
+
+    def __new__(cls, value, error):
+
+        estimate = super().__new__(cls, value)
+        estimate.value = value
+        estimate.error = error
+
+        return estimate
+
+    def __str__(self):
+
+        return f"{self.value} ±{self.error}"
+
+class TDigest:
+    '''
+    Merging t-digest for quantiles of a numerical column.
+
+    Values are kept as weighted centroids; centroids near the tails are
+    small and the ones in the middle are large so that extreme quantiles
+    remain accurate. The number of centroids is bounded by compression.
+    '''
+
+    def __init__(self, compression=200):
+
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.min = np.inf
+        self.max = -np.inf
+
+    @property
+    def count(self):
+        '''
+        Number of values added to the digest
+        '''
+
+        return self.weights.sum()
+
+    def _compress(self, means, weights):
+        '''
+        Group sorted centroids so that each group spans at most one unit
+        of the arcsine scale function. Done with array operations rather
+        than the usual centroid-by-centroid loop.
+        '''
+
+        order = np.argsort(means, kind="mergesort")
+        means = means[order]
+        weights = weights[order]
+
+        total = weights.sum()
+        q_mid = (np.cumsum(weights) - weights / 2) / total
+        k_mid = self.compression / (2 * np.pi) * np.arcsin(2 * q_mid - 1)
+        groups = np.floor(k_mid - k_mid[0]).astype(np.int64)
+
+        new_weights = np.bincount(groups, weights=weights)
+        new_sums = np.bincount(groups, weights=means * weights)
+        used = new_weights > 0
+
+        self.weights = new_weights[used]
+        self.means = new_sums[used] / self.weights
+
+    def update(self, values):
+        '''
+        Add an array of values to the digest, ignoring NAs
+        '''
+
+        values = np.asarray(values, dtype="float64")
+        values = values[~np.isnan(values)]
+
+        if not len(values):
+            return
+
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+
+        self._compress(
+            np.concatenate([self.means, values]),
+            np.concatenate([self.weights, np.ones(len(values))]))
+
+    def merge(self, other):
+        '''
+        Combine with a digest built from a different chunk or worker
+        '''
+
+        if not len(other.weights):
+            return
+
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+        self._compress(
+            np.concatenate([self.means, other.means]),
+            np.concatenate([self.weights, other.weights]))
+
+    def quantile(self, q):
+        '''
+        Estimate the q-th quantile.
+
+        Uses the same linear interpolation between ranks as Pandas so
+        that the result is exact while every centroid is a single value.
+
+        Returns
+        -------
+        A tuple of estimate and error bound; the bound is the distance
+        to the furthest of the two centroids the estimate lies between.
+        '''
+
+        if not len(self.weights):
+            return np.nan, np.nan
+
+        #rank of the middle value of each centroid, plus exact extremes
+        centres = np.cumsum(self.weights) - (self.weights + 1) / 2
+        ranks = np.concatenate([[0], centres, [self.count - 1]])
+        values = np.concatenate([[self.min], self.means, [self.max]])
+
+        target = q * (self.count - 1)
+        estimate = np.interp(target, ranks, values)
+
+        #while every centroid is a single value the estimate is exact
+        if self.count == len(self.weights):
+            return estimate, 0
+
+        right = min(np.searchsorted(ranks, target), len(ranks) - 1)
+        left = max(right - 1, 0)
+        error = max(estimate - values[left], values[right] - estimate)
+
+        return estimate, error
+
+class HyperLogLog:
+    '''
+    HyperLogLog sketch for the number of unique values in a column.
+
+    Hashes are kept exactly until there are more of them than registers,
+    so low cardinality columns (most categorical ones) get exact counts
+    and the sketch only becomes approximate when it would save memory.
+    '''
+
+    def __init__(self, precision=14):
+
+        self.precision = precision
+        self.size = 1 << precision
+        self.hashes = np.empty(0, dtype="uint64")
+        self.registers = None
+
+    @property
+    def exact(self):
+        '''
+        True while the sketch still holds every distinct hash
+        '''
+
+        return self.registers is None
+
+    @property
+    def relative_error(self):
+        '''
+        Standard error of the estimate
+        '''
+
+        return 0 if self.exact else 1.04 / np.sqrt(self.size)
+
+    def _registers(self, hashes):
+        '''
+        Compute register values for an array of 64 bit hashes
+        '''
+
+        suffix_bits = 64 - self.precision
+
+        index = (hashes >> np.uint64(suffix_bits)).astype(np.int64)
+        suffix = hashes & np.uint64((1 << suffix_bits) - 1)
+
+        #frexp exponent is the bit length of the (exactly representable) suffix
+        _, bit_length = np.frexp(suffix.astype(np.float64))
+        rank = suffix_bits - bit_length + 1
+
+        #keep the largest rank for each register without a Python loop
+        keys = np.unique(index * 64 + rank)
+        index, rank = keys // 64, keys % 64
+        last = np.ones(len(index), dtype=bool)
+        last[:-1] = index[1:] != index[:-1]
+
+        registers = np.zeros(self.size, dtype=np.uint8)
+        registers[index[last]] = rank[last]
+
+        return registers
+
+    def _add(self, hashes):
+        '''
+        Add hashes to the sketch, switching to registers when it's smaller
+        '''
+
+        if self.exact:
+            self.hashes = np.union1d(self.hashes, hashes)
+            if len(self.hashes) > self.size:
+                self.registers = self._registers(self.hashes)
+                self.hashes = None
+        else:
+            self.registers = np.maximum(self.registers, self._registers(hashes))
+
+    def update(self, values):
+        '''
+        Add a series of values to the sketch, ignoring NAs
+        '''
+
+        values = pd.Series(values).dropna()
+
+        #hash numbers as floats so that 1 and 1.0 from different chunks match
+        if is_numeric_dtype(values):
+            values = values.astype("float64")
+
+        hashes = pd.util.hash_pandas_object(values, index=False).to_numpy()
+
+        self._add(hashes)
+
+    def merge(self, other):
+        '''
+        Combine with a sketch built from a different chunk or worker
+        '''
+
+        if other.exact:
+            self._add(other.hashes)
+            return
+
+        if self.exact:
+            self.registers = self._registers(self.hashes)
+            self.hashes = None
+
+        self.registers = np.maximum(self.registers, other.registers)
+
+    def estimate(self):
+        '''
+        Estimate the number of unique values
+        '''
+
+        if self.exact:
+            return len(self.hashes)
+
+        alpha = 0.7213 / (1 + 1.079 / self.size)
+        raw = alpha * self.size ** 2 / np.sum(2.0 ** -self.registers.astype(np.float64))
+
+        #small range correction (linear counting)
+        zeros = np.count_nonzero(self.registers == 0)
+        if raw <= 2.5 * self.size and zeros:
+            return self.size * np.log(self.size / zeros)
+
+        return raw
+
+def approximate_uniques(sketch, rows, nas):
+    '''
+    Categorical table statistics from a HyperLogLog sketch.
+
+    Duplicates are only reported once the number of non-NA rows is
+    beyond three standard errors of the unique count estimate.
+    '''
+
+    estimate = sketch.estimate()
+
+    if sketch.exact:
+        uniques = estimate
+        duplicates = rows - nas > estimate
+    else:
+        uniques = Estimate(int(round(estimate)), f"{sketch.relative_error:.1%}")
+        duplicates = rows - nas > estimate * (1 + 3 * sketch.relative_error)
+
+    return {
+        "Uniques": uniques,
+        "Duplicates": duplicates or nas > 1,
+        "NAs": nas
+    }
+
+def approximate_quartiles(digest):
+    '''
+    Continuous table quartiles from a t-digest
+    '''
+
+    output = {}
+
+    for label, q in (("25%", 0.25), ("75%", 0.75)):
+
+        estimate, error = digest.quantile(q)
+        output[label] = Estimate(round(estimate, 2), round(error, 2))
+
+    return output
+
+def sketch_uniques(series):
+    '''
+    Approximate Categorical table statistics for a full column
+    '''
+
+    sketch = HyperLogLog()
+    sketch.update(series)
+
+    return approximate_uniques(sketch, len(series), int(series.isna().sum()))
+
+def sketch_quartiles(series):
+    '''
+    Approximate quartiles for a full column
+    '''
+
+    digest = TDigest()
+    digest.update(series)
+
+    return approximate_quartiles(digest)
@@ -0,0 +1,472 @@
+'''
+Module with mergeable accumulators for summarising datasets that are
+too large to be read into memory in one go.
+
+Each dataset is read in chunks and every chunk updates a set of
+accumulators - one per common column plus a row sample. Accumulators
+built from different chunks (or different processes) can be merged
+together, which means peak memory depends on the chunk size and the
+number of distinct values rather than on the size of the file.
+'''
+
+# Standard library imports
+from concurrent.futures import ThreadPoolExecutor
+import os.path
+
+# External library imports
+import numpy as np
+import pandas as pd
+
+# Summarize2 imports
+from ..core.helper_funcs import read_data_chunks, read_headers
+from ..core.sketches import (
+    TDigest, HyperLogLog, approximate_uniques, approximate_quartiles)
+from ..core.summary_stats import (
+    generate_default_dict, generate_common_columns, generate_different_columns,
+    generate_summary_output, guess_dateseries_format, guess_date_frequency,
+    guess_date_continuity)
+
+class CategoricalAccumulator:
+    '''
+    Running value counts of a column.
+
+    Uniques, Duplicates and NAs are derived from the counts so they
+    match what Pandas would report for the full column.
+    '''
+
+    def __init__(self):
+
+        self.rows = 0
+        self.nas = 0
+        self.counts = pd.Series(dtype="float64")
+
+    def update(self, series):
+        '''
+        Add a chunk of values to the accumulator
+        '''
+
+        self.rows += len(series)
+        self.nas += int(series.isna().sum())
+        self.counts = self.counts.add(series.value_counts(), fill_value=0)
+
+    def merge(self, other):
+        '''
+        Combine with an accumulator built from a different chunk
+        '''
+
+        self.rows += other.rows
+        self.nas += other.nas
+        self.counts = self.counts.add(other.counts, fill_value=0)
+
+    def frequencies(self):
+        '''
+        Value counts of the column as integers, with NAs counted under
+        a NaN key like value_counts(dropna=False)
+        '''
+
+        counts = self.counts.astype("int64")
+
+        if self.nas:
+            counts = pd.concat([counts, pd.Series([self.nas], index=[np.nan])])
+
+        return counts
+
+    def result(self):
+        '''
+        Return the statistics used in the Categorical table
+        '''
+
+        uniques = len(self.counts)
+
+        #duplicated() treats all NAs as the same value
+        distinct = uniques + min(self.nas, 1)
+
+        return {
+            "Uniques": uniques,
+            "Duplicates": self.rows > distinct,
+            "NAs": self.nas
+        }
+
+class DistinctAccumulator:
+    '''
+    HyperLogLog alternative to CategoricalAccumulator for approximate
+    mode; keeps a fixed-size sketch rather than every distinct value.
+    '''
+
+    def __init__(self):
+
+        self.rows = 0
+        self.nas = 0
+        self.sketch = HyperLogLog()
+
+    def update(self, series):
+        '''
+        Add a chunk of values to the accumulator
+        '''
+
+        self.rows += len(series)
+        self.nas += int(series.isna().sum())
+        self.sketch.update(series)
+
+    def merge(self, other):
+        '''
+        Combine with an accumulator built from a different chunk
+        '''
+
+        self.rows += other.rows
+        self.nas += other.nas
+        self.sketch.merge(other.sketch)
+
+    def result(self):
+        '''
+        Return the statistics used in the Categorical table
+        '''
+
+        return approximate_uniques(self.sketch, self.rows, self.nas)
+
+class ContinuousAccumulator:
+    '''
+    Running NAs, min, max and mean of a numerical column.
+
+    In approximate mode, a t-digest is also kept for the quartiles.
+    '''
+
+    def __init__(self, approx=False):
+
+        self.nas = 0
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+        #Pandas reads the whole column as float if any chunk has floats or NAs
+        self.floats = False
+
+        self.digest = TDigest() if approx else None
+
+    def _extend(self, low, high):
+        '''
+        Widen the running range; built-in min and max keep integer dtypes
+        '''
+
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+
+    def update(self, series):
+        '''
+        Add a chunk of values to the accumulator
+        '''
+
+        nas = int(series.isna().sum())
+
+        self.nas += nas
+        self.count += len(series) - nas
+        self.floats = self.floats or series.dtype.kind == "f"
+
+        if len(series) > nas:
+            self.total += series.sum()
+            self._extend(series.min(), series.max())
+
+        if self.digest is not None:
+            self.digest.update(series)
+
+    def merge(self, other):
+        '''
+        Combine with an accumulator built from a different chunk
+        '''
+
+        self.nas += other.nas
+        self.count += other.count
+        self.total += other.total
+        self.floats = self.floats or other.floats
+
+        if other.min is not None:
+            self._extend(other.min, other.max)
+
+        if self.digest is not None:
+            self.digest.merge(other.digest)
+
+    def result(self):
+        '''
+        Return the statistics used in the Continuous table.
+
+        Quartiles can't be derived from running totals so unless
+        there is a t-digest they are added separately from the row sample.
+        '''
+
+        if not self.count:
+            return {"Min": np.nan, "Max": np.nan, "Mean": np.nan, "NAs": self.nas}
+
+        if self.floats:
+            self.min, self.max = float(self.min), float(self.max)
+
+        output = {
+            "Min": round(self.min, 2),
+            "Max": round(self.max, 2),
+            "Mean": round(self.total / self.count, 2),
+            "NAs": self.nas
+        }
+
+        if self.digest is not None:
+            output.update(approximate_quartiles(self.digest))
+
+        return output
+
+class TimeseriesAccumulator:
+    '''
+    Running set of unique timestamps and NAs of a date column.
+
+    Frequency and continuity guesses only look at unique timestamps
+    so the full column is never required.
+    '''
+
+    def __init__(self, date_format):
+
+        self.date_format = date_format
+        self.nas = 0
+        self.uniques = pd.Series(dtype="datetime64[ns]")
+
+    def update(self, series):
+        '''
+        Add a chunk of values to the accumulator
+        '''
+
+        self.nas += int(series.isna().sum())
+        timestamps = pd.to_datetime(series.dropna(), format=self.date_format)
+        self.uniques = (
+            pd.concat([self.uniques, timestamps], ignore_index=True)
+            .drop_duplicates())
+
+    def merge(self, other):
+        '''
+        Combine with an accumulator built from a different chunk
+        '''
+
+        self.nas += other.nas
+        self.uniques = (
+            pd.concat([self.uniques, other.uniques], ignore_index=True)
+            .drop_duplicates())
+
+    def result(self):
+        '''
+        Return the statistics used in the Timeseries table
+        '''
+
+        format_iso = "%Y-%m-%d"
+
+        return {
+            "Format": self.date_format,
+            "Date From": f"{self.uniques.min():{format_iso}}",
+            "Date To": f"{self.uniques.max():{format_iso}}",
+            "Frequency": guess_date_frequency(self.uniques),
+            "Breaks?": guess_date_continuity(self.uniques),
+            "NAs": self.nas
+        }
+
+class RowSampler:
+    '''
+    Uniform sample of at most size rows, kept as a dataframe.
+
+    Each row is given a random key and the rows with the smallest keys
+    are kept (bottom-k sampling) which makes two samples mergeable.
+    If the dataset has fewer rows than size, the sample is the dataset.
+    '''
+
+    def __init__(self, size, seed=0):
+
+        self.size = size
+        self.rng = np.random.default_rng(seed)
+        self.keys = np.empty(0)
+        self.rows = None
+
+    def _keep(self, rows, keys):
+        '''
+        Trim rows down to the ones with the smallest keys, in original order
+        '''
+
+        if len(keys) > self.size:
+            keep = np.sort(np.argpartition(keys, self.size)[:self.size])
+            rows = rows.iloc[keep].reset_index(drop=True)
+            keys = keys[keep]
+
+        self.rows = rows
+        self.keys = keys
+
+    def update(self, frame):
+        '''
+        Add a chunk of rows to the sample
+        '''
+
+        keys = self.rng.random(len(frame))
+
+        if self.rows is not None:
+            frame = pd.concat([self.rows, frame], ignore_index=True)
+            keys = np.concatenate([self.keys, keys])
+
+        self._keep(frame.reset_index(drop=True), keys)
+
+    def merge(self, other):
+        '''
+        Combine with a sample built from a different chunk
+        '''
+
+        if other.rows is None:
+            return
+
+        if self.rows is None:
+            self._keep(other.rows, other.keys)
+        else:
+            self._keep(
+                pd.concat([self.rows, other.rows], ignore_index=True),
+                np.concatenate([self.keys, other.keys]))
+
+def stream_summary(data_path_1, data_path_2, user_dtypes, chunksize,
+                   sample_size=100000, approx=False, **kwargs):
+    '''
+    Read both datasets in chunks and build the same summary structure
+    as generate_summary without holding either dataset in memory.
+
+    Parameters
+    ----------
+    data_path_1 : Path
+        path to the first dataset
+    data_path_2 : Path
+        path to the second dataset
+    user_dtypes : dict
+        user-confirmed data type for each common column
+    chunksize : int
+        number of rows to read at a time
+    sample_size : int
+        number of rows kept from each dataset for quartiles and plots
+    approx : bool
+        use sketches for quartiles and uniques; categorical value counts
+        are then not accumulated and plots are drawn from the row sample
+    kwargs
+        passed to the Pandas reader, for example usecols and dtype
+
+    Returns
+    -------
+    A tuple of summary dictionary, a tuple of row samples from each
+    dataset and a dictionary of {column : (freq_1, freq_2)} value counts
+    for categorical columns
+    '''
+
+    chunks_1 = iter(read_data_chunks(data_path_1, chunksize, **kwargs))
+    chunks_2 = iter(read_data_chunks(data_path_2, chunksize, **kwargs))
+
+    #Chunks might only have the common columns so headers are read separately
+    headers_1 = read_headers(data_path_1)
+    headers_2 = read_headers(data_path_2)
+
+    #First chunks are needed upfront to find common columns and date formats
+    first_1 = next(chunks_1)
+    first_2 = next(chunks_2)
+
+    common_col_names = generate_common_columns(first_1, first_2)
+    diff_cols = generate_different_columns(headers_1, headers_2)
+
+    #Timeseries columns fall back to categorical if either format is unknown
+    col_types = {}
+    date_formats = {}
+
+    for col in common_col_names:
+
+        col_type = user_dtypes[col]
+
+        if col_type == "Timeseries":
+
+            format_1 = guess_dateseries_format(first_1[col])
+            format_2 = guess_dateseries_format(first_2[col])
+
+            if format_1 and format_2:
+                date_formats[col] = (format_1, format_2)
+            else:
+                col_type = "Categorical"
+
+        col_types[col] = col_type
+
+    def make_accumulators(position):
+
+        accumulators = {}
+
+        for col, col_type in col_types.items():
+
+            if col_type == "Continuous":
+                accumulators[col] = ContinuousAccumulator(approx)
+            elif col in date_formats:
+                accumulators[col] = TimeseriesAccumulator(date_formats[col][position])
+            elif approx:
+                accumulators[col] = DistinctAccumulator()
+            else:
+                accumulators[col] = CategoricalAccumulator()
+
+        return accumulators
+
+    def consume(first_chunk, chunks, position, headers):
+
+        accumulators = make_accumulators(position)
+        sampler = RowSampler(sample_size)
+        rows = 0
+
+        for chunk in [first_chunk, *chunks]:
+
+            rows += len(chunk)
+            sampler.update(chunk[common_col_names])
+
+            for col, acc in accumulators.items():
+                acc.update(chunk[col])
+
+        return accumulators, sampler.rows, (rows, len(headers))
+
+    #Both datasets are streamed at the same time, like in read_data
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        future_1 = pool.submit(consume, first_1, chunks_1, 0, headers_1)
+        future_2 = pool.submit(consume, first_2, chunks_2, 1, headers_2)
+        acc_1, sample_1, shape_1 = future_1.result()
+        acc_2, sample_2, shape_2 = future_2.result()
+
+    #Build an (empty) nested dictionary of common column metadata
+    common_cols = {
+        cat:{} for cat in sorted(
+            {v for key, v in user_dtypes.items()})
+        }
+
+    frequencies = {}
+
+    for col in common_col_names:
+
+        common_cols[user_dtypes[col]][col] = generate_default_dict(user_dtypes[col])
+        cc = common_cols[user_dtypes[col]][col]
+
+        stats_1 = acc_1[col].result()
+        stats_2 = acc_2[col].result()
+
+        #Timeseries that fell back to categorical only report Uniques and NAs
+        if user_dtypes[col] == "Timeseries" and col_types[col] == "Categorical":
+            del stats_1["Duplicates"]
+            del stats_2["Duplicates"]
+
+        cc["DFs"]["DF1"].update(stats_1)
+        cc["DFs"]["DF2"].update(stats_2)
+
+        if col_types[col] == "Continuous" and not approx:
+
+            #Quartiles are exact if the whole dataset fits into the sample
+            cc["DFs"]["DF1"]["25%"] = round(sample_1[col].quantile(q=0.25), 2)
+            cc["DFs"]["DF1"]["75%"] = round(sample_1[col].quantile(q=0.75), 2)
+            cc["DFs"]["DF2"]["25%"] = round(sample_2[col].quantile(q=0.25), 2)
+            cc["DFs"]["DF2"]["75%"] = round(sample_2[col].quantile(q=0.75), 2)
+
+        if col_types[col] == "Categorical" and not approx:
+
+            frequencies[col] = (acc_1[col].frequencies(), acc_2[col].frequencies())
+
+    sample_1._metadata = {"file_name":os.path.basename(data_path_1)}
+    sample_2._metadata = {"file_name":os.path.basename(data_path_2)}
+
+    summary = generate_summary_output(
+        common_cols, diff_cols,
+        (sample_1._metadata["file_name"], sample_2._metadata["file_name"]),
+        (shape_1, shape_2))
+
+    return summary, (sample_1, sample_2), frequencies
@@ -7,8 +7,13 @@ the two datasets.
 import datetime
 
 # External library imports
+import numpy as np
 import pandas as pd
 
+# Summarize2 imports
+from ..core.sketches import sketch_uniques, sketch_quartiles
+from ..core.helper_funcs import dataset_columns
+
 def generate_default_dict(col_dtype):
     '''
     Generate a default summary stats dictionary for each data type.
@@ -68,6 +73,22 @@ def generate_common_columns(df1, df2):
 
     return common_col_names
 
+def generate_different_columns(columns_1, columns_2):
+    '''
+    Find out different column names between the two datasets.
+
+    Takes two sequences of column names rather than dataframes so that
+    it can also be used when datasets are read in chunks.
+
+    Returns a list of (column name, DF it's present in) tuples
+    '''
+
+    diff_cols = (
+        [(a, "DF1") for a in columns_1 if a not in columns_2] + 
+        [(b, "DF2") for b in columns_2 if b not in columns_1])
+
+    return diff_cols
+
 def guess_date_format(date):
     '''
     A very basic date parser; only takes two common formats:
@@ -179,10 +200,80 @@ def guess_date_continuity(timeseries):
     
     return "interruped"     
 
-def generate_summary(df1, df2, user_dtypes):
+def profile_continuous(df, columns, quartiles=True):
+    '''
+    Compute Continuous table statistics for many columns at once.
+
+    Columns are grouped by dtype and each statistic is computed for the
+    whole group in one reduction over a 2D block. Keeping the groups
+    separate means integer columns still show integer Min and Max values.
+
+    Returns a dictionary of {column name : statistics}
+    '''
+
+    groups = {}
+
+    for col in columns:
+        groups.setdefault(df[col].dtype, []).append(col)
+
+    profiles = {}
+
+    for group_cols in groups.values():
+
+        block = df[group_cols]
+
+        stats = {
+            "Min": block.min(),
+            "Max": block.max(),
+            "Mean": block.mean(),
+            "NAs": block.isna().sum()
+        }
+
+        if quartiles:
+            quantiles = block.quantile([0.25, 0.75])
+            stats["25%"] = quantiles.loc[0.25]
+            stats["75%"] = quantiles.loc[0.75]
+
+        for col in group_cols:
+            profiles[col] = {
+                label: values[col] if label == "NAs" else round(values[col], 2)
+                for label, values in stats.items()}
+
+    return profiles
+
+def profile_categorical(df, columns):
+    '''
+    Compute Categorical table statistics for many columns at once.
+
+    Each column is hashed once by factorize; the unique values, NAs
+    and whether there are any duplicates all follow from its codes.
+    Like Pandas duplicated(), repeated NAs count as duplicates.
+
+    Returns a dictionary of {column name : statistics}
+    '''
+
+    profiles = {}
+
+    for col in columns:
+
+        codes, uniques = pd.factorize(df[col])
+        nas = np.count_nonzero(codes == -1)
+
+        profiles[col] = {
+            "Uniques": len(uniques),
+            "Duplicates": len(codes) > len(uniques) + (nas > 0),
+            "NAs": nas
+        }
+
+    return profiles
+
+def generate_summary(df1, df2, user_dtypes, approx=False):
     '''
     Main function to generate information used to populate tables in the HTML template
     Outputs pseudo-JSON code for easy parsing by Jinja2.
+
+    If approx is True, quartiles and unique counts are estimated using
+    mergeable sketches and are shown in the report with their error bounds.
     '''
 
     #Build an (empty) nested dictionary of common column metadata
@@ -193,51 +284,61 @@ def generate_summary(df1, df2, user_dtypes):
 
     common_col_names = generate_common_columns(df1, df2)
 
+    #Columns that weren't loaded because they are only in one dataset
+    #are still counted as long as they are recorded in _metadata
+    columns_1 = dataset_columns(df1)
+    columns_2 = dataset_columns(df2)
+
     #Find out different column names between the two datasets:
-    diff_cols = (
-        [(a, "DF1") for a in df1.columns.values if a not in df2.columns.values] + 
-        [(b, "DF2") for b in df2.columns.values if b not in df1.columns.values])
+    diff_cols = generate_different_columns(columns_1, columns_2)
 
     #Find out shapes of the two datasets:
-    shape_1 = df1.shape
-    shape_2 = df2.shape
+    shape_1 = (df1.shape[0], len(columns_1))
+    shape_2 = (df2.shape[0], len(columns_2))
     
+    #Profile each dtype group of columns in a few batched passes
+    #instead of making separate passes over every column
+    continuous_cols = [a for a in common_col_names if user_dtypes[a] == "Continuous"]
+    categorical_cols = [a for a in common_col_names if user_dtypes[a] == "Categorical"]
+
+    profiles = []
+
+    for df in (df1, df2):
+
+        profile = profile_continuous(df, continuous_cols, quartiles=not approx)
+
+        if not approx:
+            profile.update(profile_categorical(df, categorical_cols))
+
+        profiles.append(profile)
+
+    profile_1, profile_2 = profiles
+
     for col in common_col_names:
 
         #dictionary has to be defined inside the loop to create a new object every time
         common_cols[user_dtypes[col]][col] = generate_default_dict(user_dtypes[col])
         cc = common_cols[user_dtypes[col]][col]
 
-        if user_dtypes[col] == "Categorical":
+        if user_dtypes[col] == "Categorical" and approx:
 
-            #collect information from the first dataframe
-            cc["DFs"]["DF1"]["Uniques"] = df1[col].nunique()
-            cc["DFs"]["DF1"]["Duplicates"] = df1[col].duplicated().any()
-            cc["DFs"]["DF1"]["NAs"] = sum(df1[col].isna())
-        
-            #collect information from the second dataframe
-            cc["DFs"]["DF2"]["Uniques"] = df2[col].nunique()
-            cc["DFs"]["DF2"]["Duplicates"] = df2[col].duplicated().any()
-            cc["DFs"]["DF2"]["NAs"] = sum(df2[col].isna())
+            cc["DFs"]["DF1"].update(sketch_uniques(df1[col]))
+            cc["DFs"]["DF2"].update(sketch_uniques(df2[col]))
+
+        elif user_dtypes[col] == "Categorical":
 
+            cc["DFs"]["DF1"].update(profile_1[col])
+            cc["DFs"]["DF2"].update(profile_2[col])
         
         elif user_dtypes[col] == "Continuous":
 
-            #collect information from the first dataframe
-            cc["DFs"]["DF1"]["Min"] = round(df1[col].min(), 2)
-            cc["DFs"]["DF1"]["Max"] = round(df1[col].max(), 2)
-            cc["DFs"]["DF1"]["Mean"] = round(df1[col].mean(), 2)
-            cc["DFs"]["DF1"]["25%"] = round(df1[col].quantile(q=0.25), 2)
-            cc["DFs"]["DF1"]["75%"] = round(df1[col].quantile(q=0.75), 2)
-            cc["DFs"]["DF1"]["NAs"] = sum(df1[col].isna())
-        
-            #collect information from the second dataframe
-            cc["DFs"]["DF2"]["Min"] = round(df2[col].min(), 2)
-            cc["DFs"]["DF2"]["Max"] = round(df2[col].max(), 2)
-            cc["DFs"]["DF2"]["Mean"] = round(df2[col].mean(), 2)
-            cc["DFs"]["DF2"]["25%"] = round(df2[col].quantile(q=0.25), 2)
-            cc["DFs"]["DF2"]["75%"] = round(df2[col].quantile(q=0.75), 2)
-            cc["DFs"]["DF2"]["NAs"] = sum(df2[col].isna())
+            cc["DFs"]["DF1"].update(profile_1[col])
+            cc["DFs"]["DF2"].update(profile_2[col])
+
+            #quartiles need a sort of the full column unless sketched
+            if approx:
+                cc["DFs"]["DF1"].update(sketch_quartiles(df1[col]))
+                cc["DFs"]["DF2"].update(sketch_quartiles(df2[col]))
 
         else:
 
@@ -261,7 +362,7 @@ def generate_summary(df1, df2, user_dtypes):
                 cc["DFs"]["DF1"]["Date To"] = f"{df1[col].max():{format_iso}}"
                 cc["DFs"]["DF1"]["Frequency"] = guess_date_frequency(df1[col])
                 cc["DFs"]["DF1"]["Breaks?"] = guess_date_continuity(df1[col])
-                cc["DFs"]["DF1"]["NAs"] = sum(df1[col].isna())
+                cc["DFs"]["DF1"]["NAs"] = df1[col].isna().sum()
 
                 #collect information from the second dataframe
                 cc["DFs"]["DF2"]["Format"] = format_2
@@ -269,14 +370,42 @@ def generate_summary(df1, df2, user_dtypes):
                 cc["DFs"]["DF2"]["Date To"] = f"{df2[col].max():{format_iso}}"
                 cc["DFs"]["DF2"]["Frequency"] = guess_date_frequency(df2[col])
                 cc["DFs"]["DF2"]["Breaks?"] = guess_date_continuity(df2[col])
-                cc["DFs"]["DF2"]["NAs"] = sum(df2[col].isna())
+                cc["DFs"]["DF2"]["NAs"] = df2[col].isna().sum()
             
             else:
 
-                cc["DFs"]["DF1"]["Uniques"] = df1[col].nunique()
-                cc["DFs"]["DF1"]["NAs"] = sum(df1[col].isna())
-                cc["DFs"]["DF2"]["Uniques"] = df2[col].nunique()
-                cc["DFs"]["DF2"]["NAs"] = sum(df2[col].isna())
+                for df, df_name in ((df1, "DF1"), (df2, "DF2")):
+                    profile = profile_categorical(df, [col])[col]
+                    cc["DFs"][df_name]["Uniques"] = profile["Uniques"]
+                    cc["DFs"][df_name]["NAs"] = profile["NAs"]
+
+    file_names = (
+        df1._metadata["file_name"] if df1._metadata else "First file",
+        df2._metadata["file_name"] if df2._metadata else "Second file")
+
+    return generate_summary_output(
+        common_cols, diff_cols, file_names, (shape_1, shape_2))
+
+def generate_summary_output(common_cols, diff_cols, file_names, shapes):
+    '''
+    Wrap the collected column statistics into the pseudo-JSON structure
+    consumed by the Jinja2 template.
+
+    Parameters
+    ----------
+    common_cols : dict
+        {dtype : {column name : summary dictionary}}
+    diff_cols : list
+        columns present in only one of the datasets
+    file_names : tuple
+        display names of the first and second dataset
+    shapes : tuple
+        (rows, columns) of the first and second dataset
+
+    Returns
+    -------
+    Dictionary with Metadata and DFs keys
+    '''
 
     if not diff_cols:
         diff_cols = ["None"]
@@ -298,11 +427,11 @@ def generate_summary(df1, df2, user_dtypes):
             },
         "DFs" : {
             "DF1" : {
-                "file_name": df1._metadata["file_name"] if df1._metadata else "First file",
-                "shape" : shape_1},
+                "file_name": file_names[0],
+                "shape" : shapes[0]},
             "DF2" : {
-                "file_name": df2._metadata["file_name"] if df2._metadata else "Second file",
-                "shape" : shape_2}
+                "file_name": file_names[1],
+                "shape" : shapes[1]}
             }
         }
 
@@ -0,0 +1,3 @@
+'''
+Summarize_two
+'''
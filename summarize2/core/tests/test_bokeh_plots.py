@@ -0,0 +1,240 @@
+'''
+Unit tests for the Bokeh plots
+'''
+# Standard library imports
+import unittest
+import json
+
+# External library imports
+import numpy as np
+import pandas as pd
+
+# Summarize2 imports
+from summarize2.core.helper_funcs import (
+    package_dir, align_frequencies, top_categories, crosstab_cells)
+
+# Module under test
+from summarize2.core import bokeh_plots as tm
+
+class alignFrequenciesTests(unittest.TestCase):
+    '''
+    Value counts of both datasets should be joined on their values
+    '''
+
+    def test_missing_values_get_zero_counts_and_nas_are_one_value(self):
+        '''
+        NaN and None should be a single zero-count NaN value at the end
+        '''
+
+        df1 = pd.DataFrame({"A": ["x", "y", "y", np.nan, None]})
+        df2 = pd.DataFrame({"A": ["y", "z", float("nan")]})
+
+        values, counts_1, counts_2 = align_frequencies(df1, df2, "A")
+
+        self.assertListEqual(list(values[:-1]), ["y", "x", "z"])
+        self.assertTrue(np.isnan(values[-1]))
+        self.assertListEqual(counts_1.tolist(), [2, 1, 0, 0])
+        self.assertListEqual(counts_2.tolist(), [1, 0, 1, 0])
+        self.assertEqual(counts_1.dtype, np.int64)
+
+    def test_categories_and_precomputed_counts_align_the_same(self):
+        '''
+        Unused categories are left out and value counts passed in (as
+        when streaming) give the same result as the full columns
+        '''
+
+        df1 = pd.DataFrame({"A": pd.Categorical(["x", "y", None], categories=["x", "y", "w"])})
+        df2 = pd.DataFrame({"A": pd.Categorical(["y", "y"], categories=["y"])})
+
+        expected = align_frequencies(df1, df2, "A")
+        frequencies = (
+            df1["A"].value_counts(dropna=False), df2["A"].value_counts(dropna=False))
+
+        for result in (expected, align_frequencies(None, None, "A", frequencies)):
+            self.assertListEqual([str(x) for x in result[0]], ["x", "y", "nan"])
+            self.assertListEqual(result[1].tolist(), [1, 1, 0])
+            self.assertListEqual(result[2].tolist(), [0, 2, 0])
+
+class diffPlotTests(unittest.TestCase):
+    '''
+    High cardinality columns should be plotted as the most
+    different values and an "Other" bar for the rest
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+
+        rng = np.random.default_rng(0)
+
+        #ID-like column with a few over-represented values in the second dataset
+        cls.df1 = pd.DataFrame({"ID": [f"ID{i}" for i in range(5000)]})
+        cls.df2 = pd.DataFrame(
+            {"ID": [f"ID{i}" for i in rng.integers(0, 5000, 4000)] + ["ID7"] * 500})
+
+    def test_top_values_and_other_keep_the_totals(self):
+        '''
+        Most different value should be kept and counts should add up
+        '''
+
+        aligned = align_frequencies(self.df1, self.df2, "ID")
+        values, counts_1, counts_2 = top_categories(*aligned, 20)
+
+        self.assertEqual(len(values), 20)
+        self.assertIn("ID7", values)
+        self.assertEqual(values[-1], f"Other ({len(aligned[0]) - 19} values)")
+        self.assertEqual(counts_1.sum(), len(self.df1))
+        self.assertEqual(counts_2.sum(), len(self.df2))
+
+    def test_plot_data_is_bounded(self):
+        '''
+        Plot should have max_categories bars; small columns are unchanged
+        '''
+
+        plot = json.loads(tm.generate_diff_plot(self.df1, self.df2, "ID", 0, max_categories=30))
+        factors = [
+            x["attributes"]["factors"] for x in plot["doc"]["roots"]["references"]
+            if x["type"] == "FactorRange"][0]
+
+        self.assertEqual(len(factors), 30)
+
+        small = pd.DataFrame({"ID": list("abcabc")})
+        aligned = align_frequencies(small, small, "ID")
+
+        self.assertIs(top_categories(*aligned, 3)[0], aligned[0])
+
+    def test_at_least_one_bar(self):
+        '''
+        A single bar should hold every value and fewer bars are an error
+        '''
+
+        aligned = align_frequencies(self.df1, self.df2, "ID")
+        values, counts_1, _ = top_categories(*aligned, 1)
+
+        self.assertListEqual(list(values), [f"Other ({len(aligned[0])} values)"])
+        self.assertEqual(counts_1.sum(), len(self.df1))
+
+        for max_categories in (0, -1):
+            with self.assertRaises(ValueError):
+                top_categories(*aligned, max_categories)
+
+class crosstabTests(unittest.TestCase):
+    '''
+    Sparse crosstab counts should match the dense crosstabs
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+
+        cls.df1 = pd.read_csv(package_dir('sample data', 'Original.csv'))
+        cls.df2 = pd.read_csv(package_dir('sample data', 'Synth.csv'))
+
+    def test_cells_match_dense_crosstabs(self):
+        '''
+        Counts of cells in both datasets should be the same as in
+        pd.crosstab and the dataframes shouldn't be changed
+        '''
+
+        columns = list(self.df1.columns)
+        cells, x_labels, n_y = crosstab_cells(self.df1, self.df2, ["sex", "marital"], ["edu"])
+
+        self.assertListEqual(list(self.df1.columns), columns)
+
+        keys = [
+            (self.df1["sex"] + " - " + self.df1["marital"], self.df1["edu"]),
+            (self.df2["sex"] + " - " + self.df2["marital"], self.df2["edu"])]
+        dense = [pd.crosstab(index=y, columns=x) for x, y in keys]
+
+        self.assertListEqual(x_labels, [str(x) for x in dense[0].columns])
+        self.assertEqual(n_y, len(dense[0].index))
+
+        for row in cells.itertuples(index=False):
+            x, y, o, s = row[:4]
+            self.assertEqual(o, dense[0].loc[y, x])
+            self.assertEqual(s, dense[1].loc[y, x])
+
+    def test_memory_scales_with_observed_cells(self):
+        '''
+        Two ID-like axes should only produce a cell per row
+        '''
+
+        n = 20000
+        df = pd.DataFrame({"x": np.arange(n), "y": np.arange(n)[::-1]})
+
+        cells, x_labels, n_y = crosstab_cells(df, df, ["x"], ["y"])
+
+        self.assertEqual(len(cells), n)
+        self.assertEqual((len(x_labels), n_y), (n, n))
+        self.assertTrue((cells["o"] == 1).all())
+
+    def test_large_crosstabs_are_one_image(self):
+        '''
+        Above the raster threshold the crosstab should be a single image
+        whose pixels hold the DF2 share and counts of each cell
+        '''
+
+        spec = {
+            "columns": {"x_axis": ["sex", "marital"], "y_axis": "edu"},
+            "options": {
+                "column_sort": False, "colour_preset": "default",
+                "x_labels_visible": True, "y_labels_visible": True,
+                "raster_threshold": 1}}
+
+        cells, _, _ = crosstab_cells(self.df1, self.df2, ["sex", "marital"], ["edu"])
+        plot = json.loads(tm.generate_xtab_plot(self.df1, self.df2, spec))
+        models = plot["doc"]["roots"]["references"]
+        types = [model["type"] for model in models]
+
+        self.assertEqual(types.count("GlyphRenderer"), 1)
+        self.assertIn("Image", types)
+        self.assertNotIn("Wedge", types)
+
+        data = [
+            model["attributes"]["data"] for model in models
+            if model["type"] == "ColumnDataSource"
+            and "image" in model["attributes"]["data"]][0]
+
+        #arrays are sent as binary rather than lists of numbers
+        self.assertTrue(all("__ndarray__" in data[name][0] for name in ("image", "o", "s")))
+        self.assertEqual(data["o"][0]["dtype"], "int32")
+        self.assertEqual(data["o"][0]["shape"][1], cells["sex-marital"].nunique())
+
+class compactPlotTests(unittest.TestCase):
+    '''
+    Compact plots should hold the same data in smaller binary arrays
+    '''
+
+    def test_columns_are_downcast_where_precision_is_not_visible(self):
+        '''
+        Small floats become float32, whole numbers int32, large floats
+        float64 and strings are left as they are
+        '''
+
+        small = np.linspace(0, 1, 50)
+        large = np.full(3, 2.0 ** 24 + 1)
+
+        column = tm.compact_column(list(small))
+        self.assertEqual(column["dtype"], "float32")
+        np.testing.assert_allclose(
+            tm.decode_base64_dict(column), small, rtol=1e-7)
+
+        self.assertEqual(tm.compact_column([1, 2, 3])["dtype"], "int32")
+        self.assertEqual(tm.compact_column(list(large))["dtype"], "float64")
+        self.assertEqual(tm.compact_column(["a", "b"]), ["a", "b"])
+
+    def test_compact_kde_plot_has_no_float64_arrays(self):
+        '''
+        The compact KDE plot should have the same models as the original
+        '''
+
+        rng = np.random.default_rng(0)
+        df1 = pd.DataFrame({"A": rng.normal(size=1000)})
+        df2 = pd.DataFrame({"A": rng.normal(0.5, size=1000)})
+
+        plot = tm.generate_kde_plot(df1, df2, "A", 0)
+        compact = tm.compact_plot(plot)
+
+        self.assertLess(len(compact), len(plot))
+        self.assertNotIn("float64", compact)
+        self.assertListEqual(
+            [x["type"] for x in json.loads(compact)["doc"]["roots"]["references"]],
+            [x["type"] for x in json.loads(plot)["doc"]["roots"]["references"]])
@@ -0,0 +1,137 @@
+'''
+Unit tests for the on-disk dataset cache
+'''
+# Standard library imports
+import unittest
+import shutil
+import tempfile
+import os
+from pathlib import Path
+
+# External library imports
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+# Summarize2 imports
+from summarize2.core.helper_funcs import package_dir, parse_file
+
+# Module under test
+from summarize2.core import cache as tm
+
+class cacheTests(unittest.TestCase):
+    '''
+    Cached dataframes should be identical to freshly parsed ones
+    '''
+
+    def setUp(self):
+
+        self.temp_dir = tempfile.mkdtemp()
+        self.data_path = Path(package_dir('sample data', 'basic_2.csv'))
+
+    def tearDown(self):
+
+        shutil.rmtree(self.temp_dir)
+
+    def test_cache_roundtrip_is_memory_mapped(self):
+        '''
+        Numerical columns should be read back as memory maps
+        '''
+
+        cache = tm.DatasetCache(self.temp_dir)
+        df = parse_file(self.data_path, dtype={"gender": "category"})
+        key = cache.key(self.data_path, dtype={"gender": "category"})
+
+        self.assertIsNone(cache.get(key))
+        cache.put(key, df)
+        cached_df = cache.get(key)
+
+        assert_frame_equal(df, cached_df)
+        self.assertIsInstance(cached_df["age"].values.base, np.memmap)
+
+    def test_cache_key_is_content_addressed(self):
+        '''
+        A copy of the same file has the same key, different kwargs don't
+        '''
+
+        cache = tm.DatasetCache(self.temp_dir)
+        copy_path = Path(self.temp_dir, "copy.csv")
+        shutil.copyfile(self.data_path, copy_path)
+
+        self.assertEqual(cache.key(self.data_path), cache.key(copy_path))
+        self.assertNotEqual(cache.key(self.data_path), cache.key(copy_path, nrows=1))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        '''
+        Entry read most recently should survive eviction
+        '''
+
+        df = parse_file(self.data_path)
+        cache = tm.DatasetCache(self.temp_dir)
+
+        cache.put("first", df)
+        cache.put("second", df)
+
+        entry_size = sum(
+            f.stat().st_size for f in Path(self.temp_dir, "entries", "first").iterdir())
+
+        #make "first" the most recently used entry
+        os.utime(Path(self.temp_dir, "entries", "second", "manifest.json"), (0, 0))
+        cache.get("first")
+
+        cache.size_limit = entry_size * 2.5
+        cache.put("third", df)
+
+        self.assertIsNotNone(cache.get("first"))
+        self.assertIsNone(cache.get("second"))
+        self.assertIsNotNone(cache.get("third"))
+
+    def test_text_and_categories_are_stored_without_pickle(self):
+        '''
+        Text and categorical columns should round trip with every .npy
+        file readable without pickling; other objects aren't cached
+        '''
+
+        cache = tm.DatasetCache(self.temp_dir)
+        df = pd.DataFrame({
+            "text": ["b", np.nan, "a", "b", "ü"],
+            "labels": pd.Categorical(["x", "y", None, "x", "y"]),
+            "grades": pd.Categorical([3, 1, 2, 3, 1], categories=[3, 2, 1], ordered=True),
+            "number": [1.5, 2.0, np.nan, 4.0, 5.0]})
+
+        cache.put("text", df)
+        cached_df = cache.get("text")
+
+        assert_frame_equal(df, cached_df)
+        self.assertIs(cached_df["text"][1], np.nan)
+
+        for npy_path in Path(self.temp_dir, "entries", "text").glob("*.npy"):
+            np.load(npy_path, allow_pickle=False)
+
+        for column in (["b", 1, True], [pd.Timestamp("2020-01-01"), "a", "b"]):
+
+            cache.put("objects", pd.DataFrame({"objects": column}))
+
+            self.assertIsNone(cache.get("objects"))
+            self.assertListEqual(os.listdir(Path(self.temp_dir, "entries")), ["text"])
+
+    def test_index_files_are_evicted_with_their_entries(self):
+        '''
+        Index files shouldn't outlive the entries of their contents
+        '''
+
+        df = parse_file(self.data_path)
+        cache = tm.DatasetCache(self.temp_dir)
+        index_dir = Path(self.temp_dir, "index")
+
+        key = cache.key(self.data_path)
+        cache.put(key, df)
+
+        self.assertEqual(len(os.listdir(index_dir)), 1)
+
+        os.utime(Path(self.temp_dir, "entries", key, "manifest.json"), (0, 0))
+        cache.size_limit = 0
+        cache.put("other", df)
+
+        self.assertIsNone(cache.get(key))
+        self.assertListEqual(os.listdir(index_dir), [])
@@ -0,0 +1,97 @@
+'''
+Unit tests for reading Parquet and Arrow IPC files
+'''
+# Standard library imports
+import unittest
+import shutil
+import tempfile
+from pathlib import Path
+
+# External library imports
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+# Summarize2 imports
+from summarize2.core.helper_funcs import (
+    package_dir, parse_file, read_headers, read_data_chunks, filter_checker)
+
+# Module under test
+from summarize2.core import columnar as tm
+
+try:
+    import pyarrow # pylint: disable=unused-import
+    PYARROW = True
+except ImportError:
+    PYARROW = False
+
+@unittest.skipUnless(PYARROW, "pyarrow is not installed")
+class columnarTests(unittest.TestCase):
+    '''
+    Columnar files should give the same dataframes as the .csv they were
+    written from, with columns and row filters applied while reading
+    '''
+
+    def setUp(self):
+
+        self.temp_dir = tempfile.mkdtemp()
+        self.csv_path = Path(package_dir('sample data', 'basic_1.csv'))
+        self.df = pd.read_csv(self.csv_path)
+
+        self.parquet_path = Path(self.temp_dir, "basic_1.parquet")
+        self.feather_path = Path(self.temp_dir, "basic_1.feather")
+
+        #small row groups and batches so that there's something to prune
+        self.df.to_parquet(self.parquet_path, row_group_size=5)
+        self.df.to_feather(self.feather_path, chunksize=5)
+
+    def tearDown(self):
+
+        shutil.rmtree(self.temp_dir)
+
+    def test_columnar_files_match_csv(self):
+        '''
+        Full reads, headers and usecols should behave like read_csv
+        '''
+
+        for path in (self.parquet_path, self.feather_path):
+
+            assert_frame_equal(parse_file(path), self.df)
+            self.assertListEqual(read_headers(path), list(self.df.columns))
+
+            usecols = ["age", "episodes"]
+            assert_frame_equal(
+                parse_file(path, usecols=usecols),
+                pd.read_csv(self.csv_path, usecols=usecols))
+
+            assert_frame_equal(parse_file(path, nrows=7), self.df.head(7))
+
+    def test_columnar_filters_match_csv(self):
+        '''
+        Pushed down filters should select the same rows as filtering
+        the parsed .csv file
+        '''
+
+        filters = [filter_checker("episodes>=10"), filter_checker("gender=='F'")]
+        expected = parse_file(self.csv_path, filters=filters)
+
+        self.assertTrue(len(expected))
+
+        for path in (self.parquet_path, self.feather_path):
+
+            assert_frame_equal(parse_file(path, filters=filters), expected)
+
+            chunks = list(read_data_chunks(path, 3, filters=filters))
+            self.assertTrue(all(len(chunk) <= 3 for chunk in chunks))
+            assert_frame_equal(
+                pd.concat(chunks, ignore_index=True), expected)
+
+    def test_columnar_sample_reads_whole_row_groups(self):
+        '''
+        Sampling should pick whole row groups in their original order
+        '''
+
+        df = tm.read_columnar(self.parquet_path, sample=0.5)
+
+        self.assertEqual(len(df) % 5, 0)
+        self.assertTrue(0 < len(df) < len(self.df))
+        self.assertTrue(df["episodes"].isin(self.df["episodes"]).all())
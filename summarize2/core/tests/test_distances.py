@@ -0,0 +1,68 @@
+'''
+Unit tests for the numeric distribution distances
+'''
+# Standard library imports
+import unittest
+
+# External library imports
+import numpy as np
+from scipy import stats
+
+# Module under test
+from summarize2.core import distances as tm
+
+class distancesTests(unittest.TestCase):
+    '''
+    Distances should be zero for the same sample, grow as samples
+    move apart and match scipy where it has an equivalent
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+
+        rng = np.random.default_rng(0)
+        cls.s1 = rng.normal(size=2000)
+        cls.s2 = rng.normal(loc=0.5, size=1500)
+
+    def test_empirical_distances_match_scipy(self):
+        '''
+        KS and Wasserstein distances are exact
+        '''
+
+        self.assertAlmostEqual(
+            tm.distribution_distance(self.s1, self.s2, "ks"),
+            stats.ks_2samp(self.s1, self.s2).statistic)
+
+        self.assertAlmostEqual(
+            tm.distribution_distance(self.s1, self.s2, "wasserstein"),
+            stats.wasserstein_distance(self.s1, self.s2))
+
+    def test_distances_order_similar_and_different_samples(self):
+        '''
+        Every metric should be ~0 for identical samples, larger for
+        shifted samples and (for bounded ones) ~1 for disjoint samples
+        '''
+
+        for metric in tm.DISTANCE_METRICS:
+
+            same = tm.distribution_distance(self.s1, self.s1, metric)
+            shifted = tm.distribution_distance(self.s1, self.s2, metric)
+            disjoint = tm.distribution_distance(self.s1, self.s1 + 100, metric)
+
+            self.assertAlmostEqual(same, 0, places=6, msg=metric)
+            self.assertLess(same, shifted, msg=metric)
+            self.assertLess(shifted, disjoint, msg=metric)
+
+            if metric != "wasserstein":
+                self.assertAlmostEqual(disjoint, 1, places=3, msg=metric)
+
+    def test_distances_ignore_nas(self):
+        '''
+        NAs should be dropped before comparing
+        '''
+
+        s1_with_nas = np.append(self.s1, [np.nan] * 10)
+
+        self.assertEqual(
+            tm.distribution_distance(s1_with_nas, self.s2, "overlap"),
+            tm.distribution_distance(self.s1, self.s2, "overlap"))
@@ -0,0 +1,103 @@
+'''
+Unit tests for the executors of the distribution search
+'''
+# Standard library imports
+import unittest
+import socket
+
+# External library imports
+import numpy as np
+import pandas as pd
+
+# Summarize2 imports
+from summarize2.core.helper_funcs import package_dir
+from summarize2.core.mp_distributions import compare_groups, pack_groups
+
+# Module under test
+from summarize2.core import executors as tm
+
+class executorsTests(unittest.TestCase):
+    '''
+    Socket workers on this machine should find the same
+    permutations as scoring them all in this process
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+
+        cls.df1 = pd.read_csv(package_dir('sample data', 'Original.csv'))
+        cls.df2 = pd.read_csv(package_dir('sample data', 'Synth.csv'))
+        cls.processes, cls.addresses = tm.start_local_workers(3)
+
+    @classmethod
+    def tearDownClass(cls):
+
+        for address in cls.addresses:
+            tm.shutdown_worker(address, timeout=10)
+
+        for process in cls.processes:
+            process.join(10)
+
+    def test_socket_workers_match_local_search(self):
+        '''
+        Merged heaps of the partitions should give the same top N
+        '''
+
+        executor = tm.SocketExecutor(
+            ["%s:%d" % address for address in self.addresses], timeout=60)
+        cols = ["edu", "sex", "agegr"]
+
+        for metric, engine in (("ks", "exact"), ("overlap", "vectorized")):
+
+            self.assertListEqual(
+                compare_groups(
+                    self.df1, self.df2, cols, "income", metric=metric,
+                    engine=engine, top_n=7, executor=executor),
+                compare_groups(
+                    self.df1, self.df2, cols, "income", metric=metric,
+                    engine=engine, top_n=7, workers=1))
+
+    def test_subsets_are_compact_copies_of_groups(self):
+        '''
+        Repacked partitions should hold the same values for each group
+        '''
+
+        _, arrays = pack_groups(self.df1, self.df2, ["sex", "agegr"], "income")
+        positions = np.array([1, 4, 5])
+        subset = tm.subset_groups(arrays, positions)
+
+        for (values, offsets), (sub_values, sub_offsets) in zip(
+                zip(arrays[::2], arrays[1::2]), zip(subset[::2], subset[1::2])):
+
+            for i, position in enumerate(positions):
+                np.testing.assert_array_equal(
+                    sub_values[sub_offsets[i]:sub_offsets[i + 1]],
+                    values[offsets[position]:offsets[position + 1]])
+
+    def test_silent_worker_times_out(self):
+        '''
+        A worker that never answers should fail the search after the
+        timeout instead of hanging it, and there is a timeout by default
+        '''
+
+        self.assertEqual(tm.SocketExecutor(["127.0.0.1:8765"]).timeout, tm.REQUEST_TIMEOUT)
+
+        #connections are queued by the listening socket but never accepted
+        with socket.create_server(("127.0.0.1", 0)) as server:
+
+            executor = tm.SocketExecutor(["%s:%d" % server.getsockname()[:2]], timeout=0.5)
+
+            with self.assertRaisesRegex(RuntimeError, "didn't answer"):
+                compare_groups(
+                    self.df1, self.df2, ["sex", "agegr"], "income", executor=executor)
+
+    def test_workers_below_one_are_rejected(self):
+        '''
+        0 workers shouldn't silently mean all CPUs
+        '''
+
+        for workers in (0, -2):
+            with self.assertRaises(ValueError):
+                tm.LocalExecutor(workers)
+
+        self.assertGreaterEqual(tm.LocalExecutor().workers, 1)
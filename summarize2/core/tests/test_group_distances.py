@@ -0,0 +1,138 @@
+'''
+Unit tests for the vectorized scoring of all groups
+'''
+# Standard library imports
+import unittest
+
+# External library imports
+import numpy as np
+import pandas as pd
+
+# Summarize2 imports
+from summarize2.core.helper_funcs import package_dir
+from summarize2.core.distances import distribution_distance
+from summarize2.core.mp_distributions import pack_groups
+
+# Module under test
+from summarize2.core import group_distances as tm
+
+class groupDistancesTests(unittest.TestCase):
+    '''
+    Scoring all groups at once should closely match scoring
+    each group on its own with core.distances
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+
+        df1 = pd.read_csv(package_dir('sample data', 'Original.csv'))
+        df2 = pd.read_csv(package_dir('sample data', 'Synth.csv'))
+
+        _, cls.arrays = pack_groups(df1, df2, ["sex", "agegr", "edu"], "income")
+
+    def exact_distances(self, metric):
+        '''
+        Per-group distances with the same rules for skipping groups
+        '''
+
+        values1, offsets1, values2, offsets2 = self.arrays
+        result = []
+
+        for i in range(len(offsets1) - 1):
+
+            s1 = values1[offsets1[i]:offsets1[i + 1]]
+            s2 = values2[offsets2[i]:offsets2[i + 1]]
+
+            if len(s1) >= 10 and len(s2) >= 10 and s1.sum() != 0 and s2.sum() != 0:
+                try:
+                    result.append(distribution_distance(s1, s2, metric))
+                except ValueError:
+                    result.append(np.nan)
+            else:
+                result.append(np.nan)
+
+        return np.array(result)
+
+    def test_vectorized_distances_match_exact_distances(self):
+        '''
+        Same groups should be scored, to within a fraction of the largest
+        distance, and the top 5 groups should be the same
+        '''
+
+        for metric in ("ks", "wasserstein", "js", "overlap"):
+
+            vectorized = tm.group_distances(*self.arrays, metric=metric)
+            exact = self.exact_distances(metric)
+
+            np.testing.assert_array_equal(np.isnan(vectorized), np.isnan(exact))
+            self.assertLess(
+                np.nanmax(np.abs(vectorized - exact)), 0.03 * np.nanmax(exact), msg=metric)
+
+            np.testing.assert_array_equal(
+                np.argsort(-np.nan_to_num(vectorized, nan=-1))[:5],
+                np.argsort(-np.nan_to_num(exact, nan=-1))[:5])
+
+    def test_subsets_and_chunks_dont_change_scores(self):
+        '''
+        Scores of selected groups shouldn't depend on the other groups
+        or on how many groups are scored together
+        '''
+
+        expected = tm.group_distances(*self.arrays, metric="overlap")
+        groups = np.array([30, 2, 5, 17])
+
+        np.testing.assert_array_equal(
+            tm.group_distances(*self.arrays, metric="overlap", groups=groups),
+            expected[groups])
+
+        max_cells = tm.MAX_CELLS
+
+        try:
+            tm.MAX_CELLS = 3 * 2 * tm.GRID_SIZE
+            np.testing.assert_allclose(
+                tm.group_distances(*self.arrays, metric="overlap"), expected)
+        finally:
+            tm.MAX_CELLS = max_cells
+
+    def test_bounds_contain_exact_distances(self):
+        '''
+        Exact distances should be within the bounds of every group
+        and the same groups should be scored
+        '''
+
+        for metric in ("ks", "wasserstein", "js", "overlap"):
+
+            lower, upper = tm.distance_bounds(*self.arrays, metric=metric)
+            exact = self.exact_distances(metric)
+            scored = ~np.isnan(exact)
+
+            np.testing.assert_array_equal(np.isnan(upper), ~scored)
+            self.assertTrue(np.all(lower[scored] <= exact[scored] + 1e-9), msg=metric)
+            self.assertTrue(np.all(upper[scored] >= exact[scored] - 1e-9), msg=metric)
+
+    def test_all_na_last_group_is_not_scored(self):
+        '''
+        An all-NA group at the end of a chunk should be NaN rather
+        than take another group's score or break the chunk's shapes
+        '''
+
+        rng = np.random.default_rng(0)
+        real = [rng.normal(size=20), rng.normal(1, size=20)]
+        na = np.full(20, np.nan)
+
+        def packed(*groups):
+            return np.concatenate(groups), np.cumsum([0] + [len(g) for g in groups])
+
+        for groups in ([real[0], na], [real[0], real[1], na]):
+
+            values1, offsets1 = packed(*groups)
+            values2, offsets2 = packed(*[g + 0.5 for g in groups])
+
+            for metric in ("ks", "wasserstein", "js", "overlap"):
+
+                scores = tm.group_distances(
+                    values1, offsets1, values2, offsets2, metric=metric, min_rows=10)
+
+                self.assertEqual(len(scores), len(groups))
+                self.assertTrue(np.all(~np.isnan(scores[:-1])), msg=metric)
+                self.assertTrue(np.isnan(scores[-1]), msg=metric)
@@ -0,0 +1,127 @@
+'''
+Unit tests for reading the datasets
+'''
+# Standard library imports
+import unittest
+import shutil
+import tempfile
+import os
+from io import StringIO
+from contextlib import redirect_stdout
+
+# External library imports
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+# Summarize2 imports
+from summarize2.core.cache import DatasetCache
+
+# Module under test
+from summarize2.core import helper_funcs as tm
+
+class readDataTests(unittest.TestCase):
+    '''
+    Reading both datasets at the same time should give the same
+    dataframes as reading them one after the other
+    '''
+
+    def setUp(self):
+
+        self.temp_dir = tempfile.mkdtemp()
+        self.paths = (
+            tm.package_dir('sample data', 'Original.csv'),
+            tm.package_dir('sample data', 'Synth.csv'))
+
+    def tearDown(self):
+
+        shutil.rmtree(self.temp_dir)
+
+    def assert_same_as_sequential(self, paths, **kwargs):
+        '''
+        Compare read_data with read_dataset called on each path in turn
+        '''
+
+        concurrent = tm.read_data(*paths, **kwargs)
+
+        for df, path in zip(concurrent, paths):
+
+            sequential = tm.read_dataset(path, **kwargs)
+
+            assert_frame_equal(df, sequential)
+            self.assertEqual(df._metadata["file_name"], sequential._metadata["file_name"])
+
+    def test_concurrent_reads_match_sequential_reads(self):
+        '''
+        Full reads, partial reads and reads of a subset of columns
+        '''
+
+        self.assert_same_as_sequential(self.paths)
+        self.assert_same_as_sequential(self.paths, nrows=100)
+        self.assert_same_as_sequential(self.paths, usecols=["sex", "income"])
+
+    @unittest.skipIf(openpyxl is None, "writing Excel files needs openpyxl")
+    def test_excel_read_in_process_matches_sequential_read(self):
+        '''
+        Excel files are parsed in a separate process and pickled back
+        '''
+
+        excel_path = os.path.join(self.temp_dir, "Synth.xlsx")
+        pd.read_csv(self.paths[1]).to_excel(excel_path, index=False)
+
+        self.assert_same_as_sequential((self.paths[0], excel_path))
+
+    def test_load_times_are_saved_and_printed(self):
+        '''
+        Each dataframe should record when it was read and whether it
+        came from the cache, which print_load_times reports
+        '''
+
+        cache = DatasetCache(self.temp_dir)
+
+        for cached in (False, True):
+
+            dfs = tm.read_data(*self.paths, cache=cache)
+
+            for df in dfs:
+
+                began, ended = df._metadata["load_time"]
+
+                self.assertLessEqual(0, began)
+                self.assertLessEqual(began, ended)
+                self.assertIs(df._metadata["cached"], cached)
+
+            output = StringIO()
+
+            with redirect_stdout(output):
+                tm.print_load_times(*dfs)
+
+            lines = output.getvalue().splitlines()
+
+            self.assertEqual(len(lines), 2)
+
+            for line, path in zip(lines, self.paths):
+                self.assertTrue(line.startswith(f"Read {os.path.basename(path)}"))
+                self.assertEqual("from cache" in line, cached)
+
+    def test_upper_case_extensions_are_read(self):
+        '''
+        Files accepted by path_checker in any case should be read
+        like their lower case versions
+        '''
+
+        upper_path = os.path.join(self.temp_dir, "ORIGINAL.CSV")
+        shutil.copyfile(self.paths[0], upper_path)
+
+        self.assertEqual(tm.path_checker(upper_path).name, "ORIGINAL.CSV")
+        self.assertListEqual(tm.read_headers(upper_path), tm.read_headers(self.paths[0]))
+
+        df, _ = tm.read_data(upper_path, self.paths[1])
+        assert_frame_equal(df, tm.parse_file(self.paths[0]))
+
+        chunks = list(tm.read_data_chunks(upper_path, 1000))
+        assert_frame_equal(pd.concat(chunks), tm.parse_file(self.paths[0]))
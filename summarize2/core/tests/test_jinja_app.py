@@ -0,0 +1,157 @@
+'''
+Unit tests for the report rendering
+'''
+# Standard library imports
+import unittest
+from unittest.mock import patch
+import shutil
+import subprocess
+import sys
+import tempfile
+import os
+import re
+import json
+from io import StringIO
+
+# External library imports
+import pandas as pd
+from jinja2 import Environment, FileSystemLoader
+
+# Summarize2 imports
+from summarize2.core.helper_funcs import package_dir
+
+# Module under test
+from summarize2.core import jinja_app as tm
+
+#Sequential Bokeh IDs of the plots
+BOKEH_ID = re.compile(r'"\d{4,}"')
+
+class renderingTests(unittest.TestCase):
+    '''
+    Reports should be streamed to files from cached templates
+    '''
+
+    def setUp(self):
+
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+
+        shutil.rmtree(self.temp_dir)
+
+    def test_bytecode_is_reused_by_new_environments(self):
+        '''
+        A second environment should load the compiled template from
+        the bytecode cache instead of compiling it again
+        '''
+
+        def new_env():
+            return Environment(
+                loader=FileSystemLoader(package_dir("static")),
+                bytecode_cache=tm.TemplateBytecodeCache(self.temp_dir))
+
+        new_env().get_template("templates/main.jinja")
+
+        self.assertTrue(os.listdir(self.temp_dir))
+
+        env = new_env()
+
+        with patch.object(env, "compile", side_effect=AssertionError("compiled")):
+            env.get_template("templates/main.jinja")
+
+    def test_report_streamed_to_file_matches_string(self):
+        '''
+        Writing into a file object should give the same report as the
+        returned string
+        '''
+
+        #the summary converts date columns in place so each report gets new frames
+        def frames():
+            return (
+                pd.read_csv(package_dir('sample data', 'basic_1.csv')),
+                pd.read_csv(package_dir('sample data', 'basic_2.csv')))
+
+        dtypes = {
+            "age": "Categorical",
+            "episodes": "Continuous",
+            "gender": "Categorical",
+            "hbres_name": "Categorical",
+            "length_of_stay": "Continuous",
+            "reporting_date": "Timeseries"
+        }
+
+        report = tm.generate_report(*frames(), dtypes)
+        path = os.path.join(self.temp_dir, "report.html")
+
+        with open(path, "w") as f:
+            self.assertIsNone(tm.generate_report(*frames(), dtypes, output=f))
+
+        #Bokeh IDs continue from the previous report and the models of
+        #a plot can be listed in a different order each time
+        def normalized(text):
+            return sorted(BOKEH_ID.sub("", text))
+
+        with open(path) as f:
+            self.assertEqual(normalized(f.read()), normalized(report))
+
+        output = StringIO()
+        tm.generate_report(*frames(), dtypes, output=output)
+
+        self.assertEqual(normalized(output.getvalue()), normalized(report))
+
+    def test_cache_directory_is_created_on_first_template(self):
+        '''
+        Importing the module and opting out of the cache shouldn't
+        create the cache directory; the first cached template should
+        '''
+
+        cache_dir = os.path.join(self.temp_dir, "cache")
+
+        subprocess.run(
+            [sys.executable, "-c", "import summarize2.core.jinja_app"],
+            env={**os.environ, "SUMMARIZE2_CACHE_DIR": cache_dir}, check=True)
+
+        self.assertFalse(os.path.exists(cache_dir))
+
+        self.assertIsNone(tm.template_env(bytecode_cache=False).bytecode_cache)
+
+        env = Environment(
+            loader=FileSystemLoader(package_dir("static")),
+            bytecode_cache=tm.TemplateBytecodeCache(cache_dir))
+
+        self.assertFalse(os.path.exists(cache_dir))
+
+        env.get_template("templates/main.jinja")
+
+        self.assertTrue(os.listdir(cache_dir))
+
+    def test_plots_from_workers_have_unique_ids(self):
+        '''
+        Plots generated in worker processes shouldn't share any Bokeh
+        IDs with each other or with the plots of the parent process,
+        and Bokeh's own ID counter should be left alone
+        '''
+
+        df1 = pd.read_csv(package_dir('sample data', 'Original.csv'))
+        df2 = pd.read_csv(package_dir('sample data', 'Synth.csv'))
+
+        tasks = [
+            ("kde", df1[["income"]], df2[["income"]], "income", 0, None, None),
+            ("diff", df1[["edu"]], df2[["edu"]], "edu", 1, None, 50),
+            ("diff", df1[["sex"]], df2[["sex"]], "sex", 0, None, 50)]
+
+        def plot_ids(plot):
+            return set(re.findall(r'"id": "(.*?)"', plot))
+
+        serial = [tm.generate_column_plot(task) for task in tasks]
+        parallel = tm.generate_column_plots(tasks, workers=2)
+        after = tm.generate_column_plot(tasks[0])
+
+        self.assertEqual(len(parallel), len(tasks))
+
+        ids = [plot_ids(plot) for plot in serial + parallel + [after]]
+
+        self.assertEqual(sum(map(len, ids)), len(set().union(*ids)))
+
+        for plot, serial_plot in zip(parallel, serial):
+            self.assertEqual(json.loads(plot)["target_id"], json.loads(serial_plot)["target_id"])
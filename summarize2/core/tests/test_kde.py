@@ -0,0 +1,70 @@
+'''
+Unit tests for the binned KDE
+'''
+# Standard library imports
+import unittest
+
+# External library imports
+import numpy as np
+import pandas as pd
+from scipy.stats import gaussian_kde
+
+# Summarize2 imports
+from summarize2.core.helper_funcs import package_dir
+
+# Module under test
+from summarize2.core import kde as tm
+
+class kdeTests(unittest.TestCase):
+    '''
+    Binned KDE should closely match scipy's gaussian_kde
+    '''
+
+    def test_binned_kde_matches_scipy_on_sample_data(self):
+        '''
+        Densities on the 500 point plot grid should be within 0.1%
+        of the peak density for every continuous sample data column
+        '''
+
+        sample_columns = {
+            "Original.csv": ["income", "weight", "depress"],
+            "Synth.csv": ["income", "weight", "depress"],
+            "basic_1.csv": ["episodes", "length_of_stay"],
+            "basic_2.csv": ["episodes", "length_of_stay"],
+        }
+
+        for file_name, columns in sample_columns.items():
+
+            df = pd.read_csv(package_dir("sample data", file_name))
+
+            for col in columns:
+
+                values = df[col].dropna().values
+                x = np.linspace(values.min(), values.max(), 500)
+
+                for bw_method in (0.1, "scott"):
+
+                    expected = gaussian_kde(values, bw_method=bw_method)(x)
+                    result = tm.BinnedKDE(values, bw_method=bw_method)(x)
+
+                    self.assertLess(
+                        np.abs(result - expected).max() / expected.max(), 1e-3,
+                        msg=f"{file_name} {col} {bw_method}")
+
+    def test_binned_kde_integrates_to_one(self):
+        '''
+        Kernel mass should not leak through the edges of the grid
+        '''
+
+        values = np.random.default_rng(0).lognormal(size=10000)
+        kde = tm.BinnedKDE(values)
+
+        self.assertAlmostEqual(np.trapz(kde.density, kde.grid), 1, places=4)
+
+    def test_binned_kde_needs_distinct_values(self):
+        '''
+        A constant column has no bandwidth to estimate the density with
+        '''
+
+        with self.assertRaises(ValueError):
+            tm.BinnedKDE(np.ones(10))
@@ -0,0 +1,173 @@
+'''
+Unit tests for the multiprocessing distribution comparison
+'''
+# Standard library imports
+import unittest
+import heapq
+import sys
+
+# External library imports
+import numpy as np
+import pandas as pd
+
+# Summarize2 imports
+from summarize2.core.helper_funcs import package_dir
+from summarize2.core.distances import distribution_distance
+
+# Module under test
+from summarize2.core import mp_distributions as tm
+
+def shared_memory_maps(_):
+    '''
+    Shared memory blocks mapped into the calling worker process
+    '''
+
+    with open("/proc/self/maps") as f:
+        return [line for line in f if "/psm_" in line]
+
+class mpDistributionsTests(unittest.TestCase):
+    '''
+    Shared memory handoff should give workers the same groups
+    as reading and grouping the datasets in each worker
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+
+        cls.path1 = package_dir('sample data', 'Original.csv')
+        cls.path2 = package_dir('sample data', 'Synth.csv')
+        cls.df1 = pd.read_csv(cls.path1)
+        cls.df2 = pd.read_csv(cls.path2)
+
+    def test_packed_groups_match_groupby(self):
+        '''
+        Each group's slice should hold the same values as groupby
+        '''
+
+        cols = ["sex", "agegr"]
+        keys, (values1, offsets1, values2, offsets2) = tm.pack_groups(
+            self.df1, self.df2, cols, "income")
+
+        for df, values, offsets in ((self.df1, values1, offsets1), (self.df2, values2, offsets2)):
+
+            groups = {key: group.values for key, group in df.groupby(cols)["income"]}
+
+            for i, key in enumerate(keys):
+                np.testing.assert_array_equal(
+                    values[offsets[i]:offsets[i + 1]], groups.get(key, []))
+
+    def test_shared_arrays_are_read_only_views(self):
+        '''
+        Attached arrays should equal the originals and not be writeable
+        '''
+
+        arrays = [np.arange(10, dtype="float64"), np.arange(0, dtype="int64")]
+        blocks, specs = tm.share_arrays(arrays)
+
+        try:
+            attached_blocks, attached = tm.attach_arrays(specs)
+
+            for original, shared in zip(arrays, attached):
+                np.testing.assert_array_equal(original, shared)
+                self.assertFalse(shared.flags.writeable)
+
+            attached = None
+            for block in attached_blocks:
+                block.close()
+
+        finally:
+            for block in blocks:
+                block.close()
+                block.unlink()
+
+    def test_shared_controller_matches_worker_reads(self):
+        '''
+        Both modes should return the same top 5 permutations
+        '''
+
+        for metric in ("ks", "overlap"):
+
+            self.assertListEqual(
+                tm.launch_controller(
+                    self.path1, self.path2, ["sex", "agegr"], "income",
+                    metric=metric, shared=True),
+                tm.launch_controller(
+                    self.path1, self.path2, ["sex", "agegr"], "income",
+                    metric=metric, shared=False))
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "reads /proc/self/maps")
+    def test_workers_release_shared_memory_after_search(self):
+        '''
+        Pool workers shouldn't keep the shared blocks mapped once
+        the search is over and the blocks are unlinked
+        '''
+
+        tm.launch_controller(
+            self.path1, self.path2, ["sex", "agegr"], "income", workers=2, shared=True)
+
+        maps = tm.get_pool(2).map(shared_memory_maps, range(8), chunksize=1)
+
+        self.assertListEqual(sum(maps, []), [])
+
+    def test_pool_is_reused_and_batches_dont_change_results(self):
+        '''
+        Repeated calls should use the same pool and any batch size
+        should give the same top 5 permutations
+        '''
+
+        cols = ["edu", "sex", "agegr"]
+        expected = tm.launch_controller(
+            self.path1, self.path2, cols, "income", metric="ks", workers=2)
+        pool = tm.get_pool(2)
+
+        for batch_size in (1, 7, 1000):
+
+            self.assertListEqual(
+                tm.launch_controller(
+                    self.path1, self.path2, cols, "income", metric="ks",
+                    workers=2, batch_size=batch_size),
+                expected)
+
+        self.assertIs(tm.get_pool(2), pool)
+
+        tm.close_pools()
+        self.assertDictEqual(tm._pools, {})
+
+    def test_pruned_scoring_matches_scoring_every_permutation(self):
+        '''
+        Permutations ruled out by the bounds should never be
+        in the top N, whatever N and the minimum group size
+        '''
+
+        _, arrays = tm.pack_groups(self.df1, self.df2, ["sex", "agegr", "edu"], "income")
+        values1, offsets1, values2, offsets2 = arrays
+
+        for metric in ("ks", "wasserstein", "overlap"):
+            for top_n, min_rows in ((5, 10), (1, 10), (10, 20)):
+
+                scores = []
+
+                for i in range(len(offsets1) - 1):
+
+                    s1 = values1[offsets1[i]:offsets1[i + 1]]
+                    s2 = values2[offsets2[i]:offsets2[i + 1]]
+
+                    if min(len(s1), len(s2)) >= min_rows and s1.sum() != 0 and s2.sum() != 0:
+                        scores.append((distribution_distance(s1, s2, metric), i))
+
+                self.assertListEqual(
+                    heapq.nlargest(top_n, tm.top_scores(
+                        arrays, metric, "exact", 0, len(offsets1) - 1, top_n, min_rows)),
+                    heapq.nlargest(top_n, scores))
+
+    def test_loaded_frames_match_file_paths(self):
+        '''
+        Comparing dataframes that are already loaded should give
+        the same slices as reading the files
+        '''
+
+        cols = ["sex", "agegr"]
+
+        self.assertListEqual(
+            tm.compare_groups(self.df1, self.df2, cols, "income", workers=1, top_n=3),
+            tm.launch_controller(self.path1, self.path2, cols, "income", workers=2, top_n=3))
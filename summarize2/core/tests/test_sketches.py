@@ -0,0 +1,81 @@
+'''
+Unit tests for the approximate statistics sketches
+'''
+# Standard library imports
+import unittest
+
+# External library imports
+import numpy as np
+import pandas as pd
+
+# Module under test
+from summarize2.core import sketches as tm
+
+class sketchTests(unittest.TestCase):
+    '''
+    Sketches built from separate chunks should merge into
+    estimates within their reported error bounds
+    '''
+
+    def test_merged_tdigest_quartiles_within_error_bound(self):
+        '''
+        True quantiles should lie within the reported error
+        '''
+
+        rng = np.random.default_rng(0)
+        values = rng.lognormal(size=200000)
+
+        digest = tm.TDigest()
+        for chunk in np.array_split(values, 8):
+            chunk_digest = tm.TDigest()
+            chunk_digest.update(chunk)
+            digest.merge(chunk_digest)
+
+        self.assertLessEqual(len(digest.weights), digest.compression)
+
+        for q in (0.01, 0.25, 0.5, 0.75, 0.99):
+            estimate, error = digest.quantile(q)
+            self.assertLessEqual(abs(estimate - np.quantile(values, q)), error)
+
+    def test_small_tdigest_matches_pandas(self):
+        '''
+        While each centroid is a single value, quartiles are exact
+        '''
+
+        series = pd.Series([3, 1, np.nan, 10, 4, 2])
+
+        self.assertEqual(
+            tm.sketch_quartiles(series),
+            {"25%": series.quantile(0.25), "75%": series.quantile(0.75)})
+
+    def test_merged_hyperloglog_within_three_standard_errors(self):
+        '''
+        High cardinality columns switch from exact hashes to registers
+        '''
+
+        rng = np.random.default_rng(0)
+        values = pd.Series(rng.integers(0, 10**6, 300000))
+
+        sketch = tm.HyperLogLog()
+        for chunk in np.array_split(values, 5):
+            chunk_sketch = tm.HyperLogLog()
+            chunk_sketch.update(chunk)
+            sketch.merge(chunk_sketch)
+
+        expected = values.nunique()
+
+        self.assertFalse(sketch.exact)
+        self.assertLessEqual(
+            abs(sketch.estimate() - expected),
+            3 * sketch.relative_error * expected)
+
+    def test_low_cardinality_uniques_are_exact(self):
+        '''
+        Uniques and Duplicates should match Pandas for small columns
+        '''
+
+        series = pd.Series(["a", "b", None, "a", 1, 1.0])
+
+        self.assertEqual(
+            tm.sketch_uniques(series),
+            {"Uniques": 3, "Duplicates": True, "NAs": 1})
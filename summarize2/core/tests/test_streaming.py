@@ -0,0 +1,67 @@
+'''
+Unit tests for the chunked summary accumulators
+'''
+# Standard library imports
+import unittest
+from pathlib import Path
+
+# Summarize2 imports
+from summarize2.core.helper_funcs import package_dir, read_data
+from summarize2.core.summary_stats import generate_summary
+
+# Module under test
+from summarize2.core import streaming as tm
+
+class streamingTests(unittest.TestCase):
+    '''
+    Streamed summaries should match the ones built from full dataframes
+    '''
+
+    def test_stream_summary_matches_in_memory_summary(self):
+        '''
+        Basic datasets are smaller than the row sample so even
+        the quartiles should be exact.
+        '''
+
+        path_1 = Path(package_dir('sample data', 'basic_1.csv'))
+        path_2 = Path(package_dir('sample data', 'basic_2.csv'))
+
+        test_dtypes = {
+            "age": "Categorical",
+            "episodes": "Continuous",
+            "gender": "Categorical",
+            "hbres_name": "Categorical",
+            "length_of_stay": "Continuous",
+            "reporting_date": "Timeseries"
+        }
+
+        df1, df2 = read_data(path_1, path_2)
+        expected = generate_summary(df1, df2, test_dtypes)
+
+        result, samples, frequencies = tm.stream_summary(
+            path_1, path_2, test_dtypes, chunksize=7)
+
+        self.assertEqual(expected, result)
+        self.assertEqual(len(samples[0]), df1.shape[0])
+        self.assertEqual(frequencies["gender"][1].sum(), df2.shape[0])
+
+    def test_row_sampler_is_bounded_and_mergeable(self):
+        '''
+        Merged samples keep the rows with the smallest keys overall
+        '''
+
+        df1, _ = read_data(
+            Path(package_dir('sample data', 'Original.csv')),
+            Path(package_dir('sample data', 'Synth.csv')))
+
+        sampler_1 = tm.RowSampler(100, seed=1)
+        sampler_2 = tm.RowSampler(100, seed=2)
+
+        sampler_1.update(df1.iloc[:2500])
+        sampler_2.update(df1.iloc[2500:])
+
+        expected_keys = sorted([*sampler_1.keys, *sampler_2.keys])[:100]
+        sampler_1.merge(sampler_2)
+
+        self.assertEqual(len(sampler_1.rows), 100)
+        self.assertEqual(sorted(sampler_1.keys), expected_keys)
@@ -0,0 +1,73 @@
+'''
+Unit tests for the batched column profiling functions
+'''
+# Standard library imports
+import unittest
+
+# External library imports
+import numpy as np
+import pandas as pd
+
+# Summarize2 imports
+from summarize2.core.helper_funcs import package_dir
+
+# Module under test
+from summarize2.core import summary_stats as tm
+
+class summaryStatsTests(unittest.TestCase):
+    '''
+    Batched profiles should match column by column Pandas statistics
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+
+        cls.df = pd.read_csv(package_dir('sample data', 'Original.csv'))
+
+    def test_profile_continuous_matches_pandas(self):
+        '''
+        Mixed integer and float columns with NAs, in any order
+        '''
+
+        columns = ["income", "depress", "weight"]
+        profiles = tm.profile_continuous(self.df, columns)
+
+        for col in columns:
+
+            series = self.df[col]
+            expected = {
+                "Min": round(series.min(), 2),
+                "Max": round(series.max(), 2),
+                "Mean": round(series.mean(), 2),
+                "NAs": series.isna().sum(),
+                "25%": round(series.quantile(0.25), 2),
+                "75%": round(series.quantile(0.75), 2),
+            }
+
+            self.assertDictEqual(profiles[col], expected)
+            self.assertEqual(
+                np.asarray(profiles[col]["Min"]).dtype.kind, series.dtype.kind)
+
+    def test_profile_categorical_matches_pandas(self):
+        '''
+        Duplicates should count repeated NAs like duplicated() does
+        '''
+
+        test_df = pd.DataFrame({
+            "unique": ["A", "B", "C"],
+            "one_na": ["A", "B", np.nan],
+            "two_nas": ["A", np.nan, np.nan],
+            "category": pd.Categorical(["A", "A", np.nan], categories=["A", "B"]),
+        })
+
+        for df in (self.df, test_df):
+
+            profiles = tm.profile_categorical(df, df.columns)
+
+            for col in df.columns:
+                expected = {
+                    "Uniques": df[col].nunique(),
+                    "Duplicates": df[col].duplicated().any(),
+                    "NAs": df[col].isna().sum(),
+                }
+                self.assertDictEqual(profiles[col], expected)